@@ -1,13 +1,36 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
 
+from array import array
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+import StringIO
 import sys
-sys.path.append('./signstream-xmlparser')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'signstream-xmlparser'))
 import analysis.signstream as ss
+import analysis.signstream.cache as sscache
+from analysis.signstream.corpus import expand_sources
+import analysis.xmlbase as xmlbase
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bump whenever analyze_utterance changes, so that stored results are
+# recomputed.
+RESULT_VERSION = '1'
 
 class Token(object):
     def __init__(self, ss_token):
         self.gloss = ss_token.get_text()
+        self.sign = self.gloss
         self.start = ss_token.get_timecodes()[0]
         self.end   = ss_token.get_timecodes()[1]
         assert self.end > self.start
@@ -18,6 +41,7 @@ class Token(object):
 class HoldToken(Token):
     """Merged sign and HOLD"""
     def __init__(self, token, hold_ss_token):
+        self.sign  = token.sign
         self.start = token.start
         self.end   = hold_ss_token.get_timecodes()[1]
         self.gloss = "{}/HOLD{}".format(
@@ -34,56 +58,849 @@ class Node(object):
         self.pause_length = right.start - left.end
         assert self.pause_length >= 0
 
-    def _prepend_indent(self, s):
-        return '\n'.join('  ' + line for line in s.split('\n'))
-
     def __str__(self):
-        left_str = str(self.left)
-        right_str = str(self.right)
-        return "[{}\n{}\n{}]".format(
-            self.pause_length,
-            self._prepend_indent(str(self.left)),
-            self._prepend_indent(str(self.right))
-        )
+        out = StringIO.StringIO()
+        write_brackets(out, self, _node_children, _node_label)
+        return out.getvalue()
+
+def _node_children(node):
+    if isinstance(node, Node):
+        return (node.left, node.right)
+    return None
+
+def _node_label(node):
+    if isinstance(node, Node):
+        return node.pause_length
+    return node
+
+def write_brackets(f, root, children, label):
+    """Write a tree in bracketed form to the file object f: a leaf is written
+       as str(label(leaf)), and a node as its pause length followed by its
+       two children, one per line and indented by two more spaces.
+       children(node) returns the (left, right) pair of a node, or None for
+       a leaf. Works without recursion, in time linear in the output."""
+    # the stack holds nodes still to be written, with their depth, and the
+    # literal text that goes between and after them
+    stack = [(root, 0)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            f.write(item)
+            continue
+        node, depth = item
+        pair = children(node)
+        if pair is None:
+            f.write("{}{}".format('  ' * depth, label(node)))
+        else:
+            f.write("{}[{}\n".format('  ' * depth, label(node)))
+            stack.append("]")
+            stack.append((pair[1], depth + 1))
+            stack.append("\n")
+            stack.append((pair[0], depth + 1))
 
 def cleanup_utterance(utterance):
     """Convert SignStream tokens to lighter ones that only have the things we
        need, merge HOLDs into their preceding sign, and drop features besides
-       the main gloss."""
+       the main gloss. A HOLD that opens the utterance has no sign to extend
+       and stays a token of its own, as in PauseBatch."""
     tokens = []
     for ss_token in utterance.get_tokens_for_field('main gloss'):
-        if ss_token.get_text() == 'HOLD':
+        if ss_token.get_text() == 'HOLD' and tokens:
             tokens[-1] = HoldToken(tokens[-1], ss_token)
         else:
             tokens.append(Token(ss_token))
     return tokens
 
 def process_gloss(cleaned):
-    """Apply algorithm from Groçjean & Lane paper"""
-    working = list(cleaned)
-    while len(working) > 1:
-        min_pause_len = float('Infinity')
-        min_pause_pos = 0
-        for i in range(len(working) - 1):
-            pause_len = working[i + 1].start - working[i].end
-            if pause_len < min_pause_len:
-                min_pause_len = pause_len
-                min_pause_pos = i
-        merged = Node(working[i], working[i + 1])
-        working = working[:i] + [merged] + working[i + 2:]
-    return working[0]
+    """Apply algorithm from Groçjean & Lane paper: repeatedly join the two
+       adjacent constituents separated by the shortest pause (the leftmost
+       one on ties) until a single tree remains."""
+    cleaned = list(cleaned)
+    return merge_in_order(cleaned, gap_order(cleaned))
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        sys.stderr.write("Usage: {} <XML file>\n".format(sys.argv[0]))
-        sys.exit(1)
+def gap_order(cleaned):
+    """Return the order in which process_gloss closes the gaps between the
+       cleaned tokens, where gap i lies between token i and token i + 1.
+
+       Runs in O(n log n). A merged constituent keeps the start of its left
+       child and the end of its right child, so the pause across every gap
+       that is still open never changes; the gaps can therefore sit in a heap
+       keyed by (pause, position) for the whole run."""
+    gaps = [(cleaned[i + 1].start - cleaned[i].end, i) for i in range(len(cleaned) - 1)]
+    heapq.heapify(gaps)
+    return [heapq.heappop(gaps)[1] for _ in range(len(gaps))]
+
+def merge_in_order(cleaned, merge_order):
+    """Build the tree over the cleaned tokens by closing the gaps in the
+       given order, where gap i lies between token i and token i + 1. The
+       constituents in play are kept in a doubly linked list, addressed by
+       the index of their leftmost token."""
+    nodes = list(cleaned)
+    n = len(nodes)
+    prev_pos = range(-1, n - 1)
+    next_pos = range(1, n + 1)
+    for i in merge_order:
+        right = i + 1
+        left = prev_pos[right]
+        nodes[left] = Node(nodes[left], nodes[right])
+        nodes[right] = None
+        following = next_pos[right]
+        next_pos[left] = following
+        if following < n:
+            prev_pos[following] = left
+    return nodes[0]
+
+class PauseTree(object):
+    """Compact form of the tree built by process_gloss, in the style of a
+       linkage matrix. Leaves 0 .. n-1 are the cleaned tokens; the node made
+       by the k-th merge has id n + k, so the root is the last id. For each
+       merge, the ids of its two children, its pause length and the span it
+       covers are kept in parallel integer arrays."""
+
+    def __init__(self, cleaned, merge_order):
+        """Build the tree over the cleaned tokens by closing the gaps in the
+           given order (see gap_order)."""
+        self.tokens = list(cleaned)
+        n = len(self.tokens)
+        self.left = array('i')
+        self.right = array('i')
+        self.pause = array('i')
+        self.start = array('i')
+        self.end = array('i')
+        self.height_of = array('i', [0] * n)
+        # the constituents in play, addressed by their leftmost token
+        node_at = range(n)
+        prev_pos = range(-1, n - 1)
+        next_pos = range(1, n + 1)
+        for i in merge_order:
+            right_pos = i + 1
+            left_pos = prev_pos[right_pos]
+            left, right = node_at[left_pos], node_at[right_pos]
+            self.left.append(left)
+            self.right.append(right)
+            start, left_end = self._span(left)
+            right_start, end = self._span(right)
+            self.pause.append(right_start - left_end)
+            self.start.append(start)
+            self.end.append(end)
+            self.height_of.append(1 + max(self.height_of[left], self.height_of[right]))
+            node_at[left_pos] = n + len(self.left) - 1
+            following = next_pos[right_pos]
+            next_pos[left_pos] = following
+            if following < n:
+                prev_pos[following] = left_pos
+        if n and len(self.left) != n - 1:
+            raise ValueError("merge order does not close all {} gaps".format(n - 1))
+        self.parent = array('i', [-1] * len(self))
+        for k in range(len(self.left)):
+            self.parent[self.left[k]] = self.parent[self.right[k]] = n + k
+
+    @classmethod
+    def from_tokens(cls, cleaned):
+        """The tree process_gloss would build over the cleaned tokens"""
+        cleaned = list(cleaned)
+        return cls(cleaned, gap_order(cleaned))
+
+    def __len__(self):
+        """Number of nodes, leaves included"""
+        return len(self.tokens) + len(self.left)
+
+    def root(self):
+        """Id of the root node, or None for an empty tree"""
+        return len(self) - 1 if self.tokens else None
+
+    def is_leaf(self, node):
+        return node < len(self.tokens)
+
+    def children(self, node):
+        """The (left, right) children of a node, or None for a leaf"""
+        if self.is_leaf(node):
+            return None
+        k = node - len(self.tokens)
+        return (self.left[k], self.right[k])
+
+    def pause_length(self, node):
+        return self.pause[node - len(self.tokens)]
+
+    def _span(self, node):
+        if self.is_leaf(node):
+            return (self.tokens[node].start, self.tokens[node].end)
+        k = node - len(self.tokens)
+        return (self.start[k], self.end[k])
+
+    def span(self, node):
+        """The (start, end) time of a node, in ms"""
+        return self._span(node)
+
+    def depth(self, node):
+        """Number of edges between the node and the root"""
+        depth = 0
+        node = self.parent[node]
+        while node >= 0:
+            depth += 1
+            node = self.parent[node]
+        return depth
+
+    def height(self, node=None):
+        """Number of edges on the longest path from the node (by default
+           the root) down to a leaf"""
+        if node is None:
+            node = self.root()
+        return self.height_of[node]
+
+    def preorder(self, node=None):
+        """Iterate over the ids of the subtree at node (by default the
+           whole tree), each node before its children, left to right"""
+        if node is None:
+            node = self.root()
+            if node is None:
+                return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            pair = self.children(node)
+            if pair is not None:
+                stack.append(pair[1])
+                stack.append(pair[0])
+
+    def to_node(self):
+        """Convert to the Node form process_gloss returns"""
+        if not self.tokens:
+            return None
+        built = list(self.tokens)
+        for k in range(len(self.left)):
+            built.append(Node(built[self.left[k]], built[self.right[k]]))
+        return built[-1]
+
+    def write(self, f):
+        """Write the tree to the file object f in the bracketed form of
+           str(Node), in linear time"""
+        if self.tokens:
+            write_brackets(f, self.root(), self.children, self._label)
+
+    def _label(self, node):
+        if self.is_leaf(node):
+            return self.tokens[node]
+        return self.pause_length(node)
+
+    def __str__(self):
+        out = StringIO.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+class PauseBatch(object):
+    """Grosjean & Lane analysis of many utterances at once, with NumPy.
+
+       The main gloss start and end times of all utterances are packed into
+       flat arrays, with offsets marking where each utterance begins. HOLDs
+       are merged into their preceding sign, all inter-sign pauses are
+       computed, and every utterance's merge order is found, each in a few
+       whole-batch array operations: since the pause across a gap never
+       changes while merging, the merge order is just the gaps sorted by
+       (utterance, pause, position). Token and Node objects are only created
+       when tree() is called."""
+
+    def __init__(self, utterances):
+        """utterances is an iterable of SignStream utterances. Utterances
+           without a main gloss track count as empty."""
+        if np is None:
+            raise ImportError("PauseBatch requires NumPy")
+        self.utterances = list(utterances)
+        raw_starts = []
+        raw_ends = []
+        raw_hold = []
+        raw_lengths = []
+        for utterance in self.utterances:
+            try:
+                ss_tokens = utterance.get_tokens_for_field('main gloss')
+            except KeyError:
+                ss_tokens = ()
+            n = 0
+            for ss_token in ss_tokens:
+                start, end = ss_token.get_timecodes()
+                raw_starts.append(start)
+                raw_ends.append(end)
+                raw_hold.append(ss_token.get_text() == 'HOLD')
+                n += 1
+            raw_lengths.append(n)
+        raw_starts = np.array(raw_starts, dtype=np.int64)
+        raw_ends = np.array(raw_ends, dtype=np.int64)
+        raw_lengths = np.array(raw_lengths, dtype=np.int64)
+        raw_offsets = np.concatenate(([0], np.cumsum(raw_lengths)))
+
+        # a HOLD extends the preceding sign; one that opens an utterance
+        # has nothing to extend and stays a token of its own
+        hold = np.array(raw_hold, dtype=bool)
+        hold[raw_offsets[:-1][raw_lengths > 0]] = False
+        keep = ~hold
+        kept = np.flatnonzero(keep)
+        last_raw = np.append(kept[1:] - 1, len(keep) - 1)
+        self.starts = raw_starts[kept]
+        self.ends = raw_ends[last_raw[:len(kept)]]
+        kept_before = np.concatenate(([0], np.cumsum(keep)))
+        self.lengths = kept_before[raw_offsets[1:]] - kept_before[raw_offsets[:-1]]
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+
+        # pauses between neighbouring tokens of the same utterance
+        owner = np.repeat(np.arange(len(self.lengths)), self.lengths)
+        inside = owner[:-1] == owner[1:]
+        self.pauses = (self.starts[1:] - self.ends[:-1])[inside]
+        gap_owner = owner[:-1][inside]
+        local_gap = np.flatnonzero(inside) - self.offsets[gap_owner]
+        gap_counts = np.maximum(self.lengths - 1, 0)
+        self.gap_offsets = np.concatenate(([0], np.cumsum(gap_counts)))
+
+        # lexsort is stable, so ties keep their left-to-right order
+        order = np.lexsort((self.pauses, gap_owner))
+        self.merges = local_gap[order].astype(np.int32)
+
+    def __len__(self):
+        return len(self.utterances)
+
+    def pause_vector(self, i):
+        """The pauses between the cleaned tokens of utterance i, in order"""
+        return self.pauses[self.gap_offsets[i]:self.gap_offsets[i + 1]]
+
+    def merge_order(self, i):
+        """The gaps of utterance i in the order they are closed, as an int32
+           array; gap j lies between cleaned tokens j and j + 1"""
+        return self.merges[self.gap_offsets[i]:self.gap_offsets[i + 1]]
+
+    def tree(self, i):
+        """Materialize the tree of utterance i (None if it is empty)"""
+        if self.lengths[i] == 0:
+            return None
+        return merge_in_order(cleanup_utterance(self.utterances[i]),
+                              self.merge_order(i).tolist())
+
+    def trees(self):
+        """Materialize all trees, in order"""
+        return (self.tree(i) for i in range(len(self)))
+
+    def pause_tree(self, i):
+        """The PauseTree of utterance i"""
+        return PauseTree(cleanup_utterance(self.utterances[i]),
+                         self.merge_order(i).tolist())
+
+def format_nonmanual(utterance, fields):
+    """List the tokens of the given non-manual fields that overlap each main
+       gloss, one line per pair."""
+    lines = []
+    for gloss, other, overlap in utterance.join_tiers('main gloss', fields):
+        lines.append(u"  {} ~ {}: {} ({} ms)".format(
+            gloss.get_text(), other.get_field().get_label(), other.get_text(),
+            overlap))
+    return u'\n'.join(lines)
+
+def tree_structure(tree):
+    """The tree as nested lists for JSON: a node is [pause, left, right], and
+       a leaf is the index of its token"""
+    if tree.root() is None:
+        return None
+    built = range(len(tree.tokens))
+    for k in range(len(tree.left)):
+        built.append([tree.pause[k], built[tree.left[k]], built[tree.right[k]]])
+    return built[-1]
 
-    db = ss.SignStreamDatabase.read_xml(sys.argv[1])
-    for person in db.get_participants():
-        for utterance in person.get_utterances():
+def utterance_key(utterance):
+    """Content address of an utterance's analysis: a hash of the text and
+       timecodes of its main gloss tokens, which are all the analysis
+       depends on"""
+    h = hashlib.sha1(RESULT_VERSION)
+    for ss_token in utterance.get_tokens_for_field('main gloss'):
+        start, end = ss_token.get_timecodes()
+        h.update(u"\0{}\0{}\0{}".format(ss_token.get_text(), start, end).encode('utf-8'))
+    return h.hexdigest()
+
+def analyze_utterance(utterance):
+    """The main gloss analysis of an utterance, as a JSON-compatible dict:
+       the cleaned glosses with their start and end times, the pauses
+       between them, the tree (see tree_structure), and its bracketed
+       rendering"""
+    tokens = cleanup_utterance(utterance)
+    tree = PauseTree.from_tokens(tokens)
+    # if you want to further process the trees instead of just printing
+    # them, modify this (tree.to_node() gives the linked Node form)
+    return {
+        'glosses': [t.gloss for t in tokens],
+        'starts': [t.start for t in tokens],
+        'ends': [t.end for t in tokens],
+        'pauses': [b.start - a.end for a, b in zip(tokens, tokens[1:])],
+        'tree': tree_structure(tree),
+        'brackets': str(tree),
+    }
+
+class ResultStore(object):
+    """Content-addressed store of utterance analyses, in an SQLite file, so
+       that a re-run only analyzes the utterances whose main gloss changed.
+       Entries are keyed by utterance_key and never go stale; old ones are
+       simply no longer asked for."""
+
+    def __init__(self, path):
+        self.path = path
+        # several workers may write at once; wait for each other's locks
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                '(key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS outputs '
+                                '(key TEXT PRIMARY KEY, output BLOB NOT NULL)')
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """The stored analysis for key, or None"""
+        row = self.connection.execute('SELECT value FROM results WHERE key = ?',
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put_many(self, items):
+        """Store (key, analysis) pairs, in one transaction"""
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)',
+                ((key, json.dumps(value, sort_keys=True)) for key, value in items))
+
+    def analyze(self, utterances):
+        """Yield (utterance, analysis) for each utterance, from the store
+           where possible. The new analyses are stored once the iteration
+           has run to completion."""
+        new = []
+        for utterance in utterances:
+            key = utterance_key(utterance)
+            result = self.get(key)
+            if result is None:
+                self.misses += 1
+                result = analyze_utterance(utterance)
+                new.append((key, result))
+            else:
+                self.hits += 1
+            yield utterance, result
+        if new:
+            self.put_many(new)
+
+    def get_output(self, key):
+        """The stored output of a whole file, or None"""
+        row = self.connection.execute('SELECT output FROM outputs WHERE key = ?',
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        return str(row[0])
+
+    def put_output(self, key, output):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO outputs (key, output) VALUES (?, ?)',
+                (key, sqlite3.Binary(output)))
+
+    def close(self):
+        self.connection.close()
+
+def output_key(path, nonmanual, output_format):
+    """Content address of the output for a whole file: a hash of the file's
+       contents and name, and of the options that shape the output"""
+    h = hashlib.sha1(RESULT_VERSION)
+    h.update(u"\0{}\0{}\0{!r}\0".format(path, output_format, list(nonmanual)).encode('utf-8'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), ''):
+            h.update(block)
+    return h.hexdigest()
+
+def utterance_record(path, utterance, result, nonmanual):
+    """One JSON Lines record describing an analyzed utterance"""
+    record = {
+        'file': path,
+        'utterance': utterance.get_id(),
+        'participant': utterance.get_participant().get_label(),
+    }
+    for name in ('glosses', 'starts', 'ends', 'pauses', 'tree'):
+        record[name] = result[name]
+    if nonmanual:
+        record['nonmanual'] = [
+            [gloss.get_text(), other.get_field().get_label(), other.get_text(), overlap]
+            for gloss, other, overlap in utterance.join_tiers('main gloss', nonmanual)]
+    return json.dumps(record, sort_keys=True)
+
+def analyze_file(path, nonmanual=(), output_format='brackets', store=None,
+                 stats=None):
+    """Analyze every utterance of one XML file, and return the output for
+       the file as a byte string in the given format ('brackets' or
+       'jsonl'). If a ResultStore is given, the output of an unchanged file
+       is read from it, and in a changed file only the utterances whose
+       main gloss changed are analyzed again. If an xmlbase.ParseStats is
+       given, the file is always parsed, bypassing the parse cache and
+       the stored outputs, and the parser statistics are added to it."""
+    nonmanual = list(nonmanual)
+    if store is None or stats is not None:
+        return _render_file(path, nonmanual, output_format, store, stats)
+    key = output_key(path, nonmanual, output_format)
+    output = store.get_output(key)
+    if output is None:
+        output = _render_file(path, nonmanual, output_format, store, None)
+        store.put_output(key, output)
+    return output
+
+def _render_file(path, nonmanual, output_format, store, stats):
+    fields = ['main gloss'] + nonmanual
+    utterances = sscache.iter_utterances(path, fields=fields, stats=stats)
+    if store is None:
+        results = ((u, analyze_utterance(u)) for u in utterances)
+    else:
+        results = store.analyze(utterances)
+    out = StringIO.StringIO()
+    for utterance, result in results:
+        if output_format == 'jsonl':
+            out.write(utterance_record(path, utterance, result, nonmanual))
+            out.write('\n')
+            continue
+        out.write(u'Utterance: {}\n'.format(u' '.join(result['glosses'])).encode('utf-8'))
+        out.write(result['brackets'].encode('utf-8'))
+        out.write('\n')
+        if nonmanual:
+            out.write(format_nonmanual(utterance, nonmanual).encode('utf-8'))
+            out.write('\n')
+        out.write('\n\n\n')
+    return out.getvalue()
+
+def _analyze_job(args):
+    """Pool worker: returns (output, error message or None, parser statistics
+       or None) for one file"""
+    path, nonmanual, output_format, store_path, profile = args
+    store = None
+    stats = xmlbase.ParseStats() if profile else None
+    try:
+        if store_path is not None:
+            store = ResultStore(store_path)
+        return (analyze_file(path, nonmanual, output_format, store, stats), None, stats)
+    except Exception, e:
+        return ('', '{}: {}: {}'.format(path, e.__class__.__name__, e), stats)
+    finally:
+        if store is not None:
+            store.close()
+
+def analyze_files(paths, nonmanual=(), output_format='brackets', jobs=None,
+                  store_path=None, stats=None):
+    """Analyze many files over a pool of worker processes. Yields (output,
+       error message or None) for each file, in the order of paths,
+       regardless of which worker finishes first. store_path names the
+       ResultStore file to use, if any. If an xmlbase.ParseStats is given,
+       the parser statistics of all workers are merged into it (see
+       analyze_file)."""
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(paths)))
+    tasks = [(path, list(nonmanual), output_format, store_path, stats is not None)
+             for path in paths]
+    if jobs == 1:
+        results = (_analyze_job(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(_analyze_job, tasks)
+    try:
+        for output, error, file_stats in results:
+            if stats is not None:
+                stats.merge(file_stats)
+            yield output, error
+    finally:
+        if jobs > 1:
+            pool.terminate()
+
+# pause statistics: fixed histogram bins, and the relative accuracy of the
+# quantile sketch
+HISTOGRAM_BIN_MS = 50
+HISTOGRAM_BINS = 40
+SKETCH_ACCURACY = 0.01
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+
+class PauseDistribution(object):
+    """Online summary of a stream of pause lengths (in ms), in constant
+       memory: count, sum and sum of squares (for mean and variance), min
+       and max, a histogram of fixed bins, and a quantile sketch with
+       logarithmic buckets, whose quantiles are within SKETCH_ACCURACY of
+       the true value. Pauses are whole milliseconds, so the sums are kept
+       as exact integers rather than as a running Welford mean: merging is
+       exact and does not depend on the order, and the variance does not
+       suffer from cancellation either."""
+
+    _gamma = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+    _log_gamma = math.log(_gamma)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.squares = 0
+        self.min = None
+        self.max = None
+        # the last bin also takes everything longer
+        self.histogram = [0] * HISTOGRAM_BINS
+        # bucket index -> count, for positive pauses and for (the lengths of)
+        # negative ones; zero pauses are counted apart
+        self.positive = dict()
+        self.negative = dict()
+        self.zeros = 0
+
+    def add(self, pause):
+        self.count += 1
+        self.total += pause
+        self.squares += pause * pause
+        if self.min is None or pause < self.min:
+            self.min = pause
+        if self.max is None or pause > self.max:
+            self.max = pause
+        self.histogram[min(HISTOGRAM_BINS - 1, max(0, pause // HISTOGRAM_BIN_MS))] += 1
+        if pause > 0:
+            key = self._bucket(pause)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif pause < 0:
+            key = self._bucket(-pause)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zeros += 1
+
+    def _bucket(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _bucket_value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def merge(self, other):
+        """Add the pauses summarized by another distribution to this one"""
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        for mine, theirs in ((self.positive, other.positive),
+                             (self.negative, other.negative)):
+            for key, count in theirs.iteritems():
+                mine[key] = mine.get(key, 0) + count
+        self.zeros += other.zeros
+
+    def mean(self):
+        if not self.count:
+            return None
+        return float(self.total) / self.count
+
+    def variance(self):
+        """The sample variance, or None for fewer than two pauses"""
+        if self.count < 2:
+            return None
+        return float(self.count * self.squares - self.total * self.total) / \
+            (self.count * (self.count - 1))
+
+    def quantile(self, q):
+        """The estimated q-quantile (0 <= q <= 1), or None if empty"""
+        if not self.count:
+            return None
+        rank = int(q * (self.count - 1))
+        buckets = [(-self._bucket_value(key), count)
+                   for key, count in sorted(self.negative.iteritems(), reverse=True)]
+        buckets.append((0, self.zeros))
+        buckets.extend((self._bucket_value(key), count)
+                       for key, count in sorted(self.positive.iteritems()))
+        seen = 0
+        for value, count in buckets:
+            seen += count
+            if seen > rank:
+                # the estimate can only stray outside the observed range by
+                # the bucket width
+                return min(self.max, max(self.min, value))
+        return self.max
+
+    def summary(self):
+        """A JSON-compatible dict of the statistics"""
+        variance = self.variance()
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'variance': variance,
+            'stdev': None if variance is None else math.sqrt(variance),
+            'min': self.min,
+            'max': self.max,
+            'quantiles': dict(('{:g}'.format(q), self.quantile(q)) for q in QUANTILES),
+            'histogram': {'bin_ms': HISTOGRAM_BIN_MS, 'counts': list(self.histogram)},
+        }
+
+def pause_context(spans, left, right):
+    """Where the pause between the cleaned tokens left and right lies
+       relative to the (start, end) spans of a context tier: 'inside' a
+       span that covers it, at an 'edge' where a span starts or ends, or
+       'outside' all spans. A span boundary belongs to the pause if it
+       lies between the midpoints of the two tokens, which allows for
+       spans that are not aligned with the signs exactly."""
+    low = (left.start + left.end) / 2.0
+    high = (right.start + right.end) / 2.0
+    context = 'outside'
+    for start, end in spans:
+        if low < start <= high or low <= end < high:
+            return 'edge'
+        if start <= low and end >= high:
+            context = 'inside'
+    return context
+
+class PauseStats(object):
+    """Pause distributions of a corpus, grouped by participant, by story
+       (file), by the gloss before and the gloss after the pause (HOLDs
+       merged into their sign), and by the pause's place relative to the
+       spans of each context tier (see pause_context). Built in one
+       streaming pass; partial statistics merge exactly, so files can be
+       counted in separate processes."""
+
+    def __init__(self, contexts=('topic/focus',)):
+        self.contexts = list(contexts)
+        self.all = PauseDistribution()
+        # group name -> key -> PauseDistribution
+        self.groups = dict()
+
+    def _add(self, group, key, pause):
+        keys = self.groups.setdefault(group, dict())
+        distribution = keys.get(key)
+        if distribution is None:
+            distribution = keys[key] = PauseDistribution()
+        distribution.add(pause)
+
+    def add_utterance(self, path, utterance):
+        """Count the pauses between the main gloss signs of an utterance"""
+        try:
             tokens = cleanup_utterance(utterance)
-            print 'Utterance:', ' '.join(t.gloss for t in tokens)
-            tree = process_gloss(tokens)
-            # if you want to further process the trees instead of just printing them, modify this
-            print str(tree)
-            print '\n\n'
\ No newline at end of file
+        except (KeyError, ss.InvalidField):
+            return
+        participant = utterance.get_participant().get_label()
+        story = os.path.splitext(os.path.basename(path))[0]
+        spans = dict()
+        for field in self.contexts:
+            try:
+                spans[field] = [t.get_timecodes()
+                                for t in utterance.get_tokens_for_field(field)]
+            except (KeyError, ss.InvalidField):
+                spans[field] = []
+        for left, right in zip(tokens, tokens[1:]):
+            pause = right.start - left.end
+            self.all.add(pause)
+            self._add('participant', participant, pause)
+            self._add('story', story, pause)
+            self._add('before', left.sign, pause)
+            self._add('after', right.sign, pause)
+            for field in self.contexts:
+                self._add(field, pause_context(spans[field], left, right), pause)
+
+    def add_file(self, path):
+        """Count the pauses of every utterance in an XML file"""
+        for utterance in sscache.iter_utterances(path,
+                                                 fields=['main gloss'] + self.contexts):
+            self.add_utterance(path, utterance)
+
+    def merge(self, other):
+        """Add the pauses counted by another PauseStats to this one"""
+        self.all.merge(other.all)
+        for group, keys in other.groups.iteritems():
+            mine = self.groups.setdefault(group, dict())
+            for key, distribution in keys.iteritems():
+                if key in mine:
+                    mine[key].merge(distribution)
+                else:
+                    mine[key] = distribution
+
+    def summary(self):
+        """A JSON-compatible dict: the summary of all pauses under 'all',
+           and one dict per group, from key to summary"""
+        result = {'all': self.all.summary()}
+        for group, keys in self.groups.iteritems():
+            result[group] = dict((key, distribution.summary())
+                                 for key, distribution in keys.iteritems())
+        return result
+
+def _pause_stats_job(args):
+    """Pool worker: returns (PauseStats, error message or None) for one file"""
+    path, contexts = args
+    stats = PauseStats(contexts)
+    try:
+        stats.add_file(path)
+    except Exception, e:
+        return (PauseStats(contexts), '{}: {}: {}'.format(path, e.__class__.__name__, e))
+    return (stats, None)
+
+def pause_stats_files(paths, contexts=('topic/focus',), jobs=None):
+    """Gather the pause statistics of many files over a pool of worker
+       processes. Returns (PauseStats, list of error messages); a file that
+       fails contributes nothing."""
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(paths)))
+    tasks = [(path, list(contexts)) for path in paths]
+    total = PauseStats(contexts)
+    errors = []
+    if jobs == 1:
+        results = (_pause_stats_job(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(_pause_stats_job, tasks)
+    try:
+        for stats, error in results:
+            total.merge(stats)
+            if error is not None:
+                errors.append(error)
+    finally:
+        if jobs > 1:
+            pool.terminate()
+    return total, sorted(errors)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build Grosjean & Lane pause trees for SignStream files.")
+    parser.add_argument('sources', nargs='+', metavar='PATH',
+                        help="XML file, directory of XML files, or glob pattern")
+    parser.add_argument('-f', '--field', action='append', default=[],
+                        dest='nonmanual', metavar='FIELD',
+                        help="non-manual field whose overlaps with each gloss "
+                             "are listed (may be repeated)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--format', choices=['brackets', 'jsonl'],
+                        default='brackets', dest='output_format',
+                        help="bracketed trees (default) or JSON Lines, one "
+                             "record per utterance")
+    parser.add_argument('--store', metavar='FILE',
+                        help="keep utterance analyses in this SQLite file, and "
+                             "only analyze utterances that changed since")
+    parser.add_argument('--pause-stats', action='store_true',
+                        help="print pause length statistics as JSON instead "
+                             "of the trees")
+    parser.add_argument('-c', '--context', action='append', default=None,
+                        dest='contexts', metavar='FIELD',
+                        help="with --pause-stats, tier whose spans pauses are "
+                             "grouped by (may be repeated; default: topic/focus)")
+    parser.add_argument('--profile', action='store_true',
+                        help="parse every file, without the caches, and print "
+                             "parser statistics to stderr")
+    args = parser.parse_args()
+
+    paths = expand_sources(args.sources)
+    if args.pause_stats:
+        contexts = args.contexts if args.contexts is not None else ['topic/focus']
+        pause_stats, errors = pause_stats_files(paths, contexts, args.jobs)
+        json.dump(pause_stats.summary(), sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+        for error in errors:
+            sys.stderr.write(error + '\n')
+        sys.exit(1 if errors else 0)
+    stats = xmlbase.ParseStats() if args.profile else None
+    failed = False
+    for output, error in analyze_files(paths, args.nonmanual,
+                                       args.output_format, args.jobs,
+                                       args.store, stats):
+        sys.stdout.write(output)
+        if error is not None:
+            sys.stderr.write(error + '\n')
+            failed = True
+    if stats is not None:
+        sys.stderr.write(stats.format() + '\n')
+    sys.exit(1 if failed else 0)
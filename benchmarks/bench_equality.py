@@ -0,0 +1,45 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Loads the bundled corpus twice with each database class, and times the
+# equality test between the two copies of every file: once by contents, as
+# a single comparison does it, then the computation of the digests, and the
+# best of a few comparisons by digest after that.
+
+import sys
+import time
+
+import benchutil
+import analysis.signstream as ss
+
+REPEAT = 5
+
+VARIANTS = [
+    ('SignStreamDatabase', ss.SignStreamDatabase),
+    ('CompactSignStreamDatabase', ss.CompactSignStreamDatabase),
+]
+
+def main():
+    paths = benchutil.corpus_files()
+    for (name, model_class) in VARIANTS:
+        first = [model_class.read_xml(path) for path in paths]
+        second = [model_class.read_xml(path) for path in paths]
+        start = time.time()
+        for (a, b) in zip(first, second):
+            assert a == b
+        by_contents = time.time() - start
+        start = time.time()
+        for db in first + second:
+            db.get_digest()
+        hashing = time.time() - start
+        times = []
+        for _ in range(REPEAT):
+            start = time.time()
+            for (a, b) in zip(first, second):
+                assert a == b
+            times.append(time.time() - start)
+        print '{:<28} contents {:>8.1f}ms, digests {:>8.1f}ms, then {:>8.3f}ms'.format(
+            name, by_contents * 1000, hashing * 1000, min(times) * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Compares loading a SignStream XML file in full against loading only a few
+# fields with read_xml(fields=...). Each variant runs in a fresh interpreter,
+# so that its peak resident memory can be measured on its own.
+
+import os
+import sys
+import time
+
+import benchutil
+import analysis.signstream as ss
+
+DEFAULT_FILE = os.path.join(benchutil.CORPUS_DIR, 'ncslgr10s.xml')
+REPEAT = 5
+
+# (name, fields); fields=False means "only start the interpreter"
+VARIANTS = [
+    ('interpreter only', False),
+    ('all fields', None),
+    ('main gloss, hm: shake', ['main gloss', 'hm: shake']),
+    ('main gloss', ['main gloss']),
+]
+
+def run_child(index, path):
+    fields = VARIANTS[index][1]
+    best = 0.0
+    if fields is not False:
+        best = float('Infinity')
+        for _ in range(REPEAT):
+            start = time.time()
+            db = ss.SignStreamDatabase.read_xml(path, fields=fields)
+            best = min(best, time.time() - start)
+            db = None
+    benchutil.report_child(seconds=best)
+
+def main(path):
+    print 'File: {} ({} KB)'.format(path, os.path.getsize(path) // 1024)
+    print '{:<24} {:>12} {:>16}'.format('variant', 'best load', 'peak RSS')
+    base_rss = None
+    for index, (name, _) in enumerate(VARIANTS):
+        result = benchutil.run_child(__file__, index, path)
+        rss = result['peak_rss_kb']
+        if base_rss is None:
+            base_rss = rss
+            print '{:<24} {:>12} {:>13} KB'.format(name, '-', rss)
+        else:
+            print '{:<24} {:>10.1f}ms {:>13} KB  (+{} KB over interpreter)'.format(
+                name, result['seconds'] * 1000, rss, rss - base_rss)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(int(sys.argv[2]), sys.argv[3])
+    else:
+        main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FILE)
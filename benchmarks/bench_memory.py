@@ -0,0 +1,48 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Loads the whole bundled corpus with each database class and keeps it in
+# memory, in a fresh interpreter per class, to compare their footprint.
+
+import gc
+import sys
+import time
+
+import benchutil
+import analysis.signstream as ss
+
+# (name, database class); None means "only start the interpreter"
+VARIANTS = [
+    ('interpreter only', None),
+    ('SignStreamDatabase', ss.SignStreamDatabase),
+    ('ColumnarSignStreamDatabase', ss.ColumnarSignStreamDatabase),
+    ('CompactSignStreamDatabase', ss.CompactSignStreamDatabase),
+]
+
+def run_child(index):
+    model_class = VARIANTS[index][1]
+    dbs = []
+    start = time.time()
+    if model_class is not None:
+        dbs = [model_class.read_xml(path) for path in benchutil.corpus_files()]
+    seconds = time.time() - start
+    gc.collect()
+    benchutil.report_child(seconds=seconds, objects=len(gc.get_objects()))
+
+def main():
+    print '{:<28} {:>10} {:>12} {:>14}'.format('variant', 'load', 'peak RSS',
+                                               'gc objects')
+    base = None
+    for index, (name, _) in enumerate(VARIANTS):
+        result = benchutil.run_child(__file__, index)
+        if base is None:
+            base = result
+        print '{:<28} {:>9.2f}s {:>9} KB {:>14}  (+{} KB over interpreter)'.format(
+            name, result['seconds'], result['peak_rss_kb'], result['objects'],
+            result['peak_rss_kb'] - base['peak_rss_kb'])
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Measures read_xml throughput over the bundled corpus (or the files given on
+# the command line): best of a few passes, in MB of XML per second.
+
+import os
+import sys
+import time
+
+import benchutil
+import analysis.signstream as ss
+
+REPEAT = 5
+
+def main(paths):
+    size = sum(os.path.getsize(path) for path in paths)
+    best = float('Infinity')
+    for _ in range(REPEAT):
+        start = time.time()
+        for path in paths:
+            ss.SignStreamDatabase.read_xml(path)
+        best = min(best, time.time() - start)
+    print '{} files, {:.1f} MB: best pass {:.3f}s, {:.2f} MB/s'.format(
+        len(paths), size / 1e6, best, size / 1e6 / best)
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or benchutil.corpus_files())
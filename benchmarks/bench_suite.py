@@ -0,0 +1,219 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# Benchmark suite for the analysis pipeline. Every file of the bundled corpus
+# (or the files given), plus a synthetic large file, is measured in a fresh
+# interpreter: parsing (read_xml), tier extraction (get_tokens),
+# cleanup_utterance, process_gloss and tree serialization are timed
+# separately, with throughput, per-utterance p50/p99 latency and peak memory.
+#
+#   bench_suite.py run [-o results.json] [files...]
+#   bench_suite.py compare baseline.json results.json
+#
+# compare flags every stage that got slower, and every file whose peak memory
+# grew, by more than the threshold, and exits with status 1 if there are any.
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from timeit import default_timer as timer
+
+import benchutil
+import analysis.signstream as ss
+import analysis.signstream.synthetic as synthetic
+import analyze
+
+REPEAT = 3
+
+STAGES = ['parse', 'get_tokens', 'cleanup', 'process_gloss', 'serialize']
+
+# size of the synthetic file (about 0.7 KB per utterance)
+SYNTHETIC_UTTERANCES = 12000
+SYNTHETIC_TIERS = 6
+
+# a slowdown is only flagged if it exceeds the relative threshold and this
+# many seconds, so that tiny stages do not flag timer noise
+MIN_SECONDS = 0.002
+
+
+def percentile(values, fraction):
+    """Returns the value at the given fraction of the sorted values (nearest
+       rank)"""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(math.ceil(fraction * len(values))) - 1))
+    return values[index]
+
+def growth(before, after):
+    """Returns the relative growth from before to after (infinite if before
+       is 0)"""
+    if not before:
+        return float('Infinity') if after else 0.0
+    return float(after) / before - 1
+
+def stage_result(seconds, latencies, amount, unit):
+    result = dict(seconds=seconds, throughput=amount / seconds if seconds else 0.0,
+                  unit=unit)
+    if latencies is not None:
+        result['p50_us'] = percentile(latencies, 0.5) * 1e6
+        result['p99_us'] = percentile(latencies, 0.99) * 1e6
+    return result
+
+def time_per_utterance(function, inputs):
+    """Calls function on every input, and returns (total seconds, list of
+       per-call seconds, outputs)"""
+    latencies = []
+    outputs = []
+    for value in inputs:
+        start = timer()
+        outputs.append(function(value))
+        latencies.append(timer() - start)
+    return (sum(latencies), latencies, outputs)
+
+def has_main_gloss(utterance):
+    try:
+        utterance.get_tokens_for_field('main gloss')
+        return True
+    except KeyError:
+        return False
+
+def measure_file(path, repeat):
+    """Measures every stage on one file; the best of repeat passes counts"""
+    size = os.path.getsize(path)
+    parse = float('Infinity')
+    for _ in range(repeat):
+        start = timer()
+        db = ss.SignStreamDatabase.read_xml(path)
+        parse = min(parse, timer() - start)
+    utterances = [u for p in db.get_participants() for u in p.get_utterances()
+                  if has_main_gloss(u)]
+    best = dict()
+    for _ in range(repeat):
+        passes = []
+        passes.append(time_per_utterance(
+            lambda u: list(u.get_tokens_for_field('main gloss')), utterances))
+        passes.append(time_per_utterance(analyze.cleanup_utterance, utterances))
+        cleaned = passes[-1][2]
+        passes.append(time_per_utterance(analyze.process_gloss, cleaned))
+        trees = passes[-1][2]
+        passes.append(time_per_utterance(str, trees))
+        for (stage, (seconds, latencies, _)) in zip(STAGES[1:], passes):
+            if stage not in best or seconds < best[stage][0]:
+                best[stage] = (seconds, latencies)
+    stages = dict(parse=stage_result(parse, None, size / 1e6, 'MB/s'))
+    for stage in STAGES[1:]:
+        (seconds, latencies) = best[stage]
+        stages[stage] = stage_result(seconds, latencies, len(utterances),
+                                     'utterances/s')
+    return dict(bytes=size, utterances=len(utterances), stages=stages)
+
+def make_synthetic(utterances, directory):
+    """Writes a synthetic file with the given number of utterances, drawn
+       from the distributions of the bundled corpus, and returns its name"""
+    profile = synthetic.SyntheticProfile.from_databases(
+        ss.SignStreamDatabase.read_xml(path, fields=['main gloss'])
+        for path in benchutil.corpus_files())
+    path = os.path.join(directory, 'synthetic.xml')
+    with open(path, 'wb') as f:
+        synthetic.write_database(f, utterances, participants=4,
+                                 tiers=SYNTHETIC_TIERS, profile=profile)
+    return path
+
+def run(args):
+    paths = args.files or benchutil.corpus_files()
+    results = dict(python=platform.python_version(), machine=platform.machine(),
+                   created=time.strftime('%Y-%m-%dT%H:%M:%S'), repeat=args.repeat,
+                   files=dict())
+    tempdir = None
+    if not args.no_synthetic:
+        tempdir = tempfile.mkdtemp()
+        paths = paths + [make_synthetic(args.synthetic_utterances, tempdir)]
+    try:
+        for path in paths:
+            result = benchutil.run_child(__file__, path, args.repeat)
+            results['files'][os.path.basename(path)] = result
+            print_file(os.path.basename(path), result)
+    finally:
+        if tempdir is not None:
+            for name in os.listdir(tempdir):
+                os.remove(os.path.join(tempdir, name))
+            os.rmdir(tempdir)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+            f.write('\n')
+
+def print_file(name, result):
+    print '{} ({:.2f} MB, {} utterances, peak RSS {} KB)'.format(
+        name, result['bytes'] / 1e6, result['utterances'], result['peak_rss_kb'])
+    for stage in STAGES:
+        values = result['stages'][stage]
+        line = '  {:<14} {:>9.4f}s {:>10.1f} {}'.format(
+            stage, values['seconds'], values['throughput'], values['unit'])
+        if 'p50_us' in values:
+            line += '   p50 {:.1f} us, p99 {:.1f} us'.format(values['p50_us'],
+                                                            values['p99_us'])
+        print line
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = []
+    for name in sorted(set(baseline['files']) & set(current['files'])):
+        old = baseline['files'][name]
+        new = current['files'][name]
+        for stage in STAGES:
+            before = old['stages'][stage]['seconds']
+            after = new['stages'][stage]['seconds']
+            if after > before * (1 + args.threshold) and after - before > MIN_SECONDS:
+                regressions.append('{} {}: {:.4f}s -> {:.4f}s (+{:.0%})'.format(
+                    name, stage, before, after, growth(before, after)))
+        before = old['peak_rss_kb']
+        after = new['peak_rss_kb']
+        if after > before * (1 + args.threshold):
+            regressions.append('{} peak RSS: {} KB -> {} KB (+{:.0%})'.format(
+                name, before, after, growth(before, after)))
+    for name in sorted(set(baseline['files']) ^ set(current['files'])):
+        print 'only in one result: {}'.format(name)
+    for line in regressions:
+        print 'REGRESSION', line
+    if not regressions:
+        print 'no regressions over {:.0%}'.format(args.threshold)
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Analysis pipeline benchmarks.")
+    commands = parser.add_subparsers()
+    run_parser = commands.add_parser('run', help="measure and optionally save results")
+    run_parser.add_argument('files', nargs='*', help="XML files (default: the corpus)")
+    run_parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    run_parser.add_argument('--repeat', type=int, default=REPEAT,
+                            help="passes per measurement; the best counts")
+    run_parser.add_argument('--synthetic-utterances', type=int,
+                            default=SYNTHETIC_UTTERANCES,
+                            help="size of the synthetic large file")
+    run_parser.add_argument('--no-synthetic', action='store_true',
+                            help="leave out the synthetic large file")
+    run_parser.set_defaults(command=run)
+    compare_parser = commands.add_parser('compare', help="flag regressions")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help="relative slowdown that counts (default 0.10)")
+    compare_parser.set_defaults(command=compare)
+    args = parser.parse_args()
+    sys.exit(args.command(args))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        benchutil.report_child(**measure_file(sys.argv[2], int(sys.argv[3])))
+    else:
+        main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+# Helpers shared by the benchmark scripts.
+
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_DIR = os.path.join(ROOT, 'ncslgr-xml')
+sys.path.append(os.path.join(ROOT, 'signstream-xmlparser'))
+sys.path.append(ROOT)
+
+def corpus_files():
+    """Returns the XML files of the bundled corpus, sorted by name"""
+    return sorted(glob.glob(os.path.join(CORPUS_DIR, '*.xml')))
+
+def peak_rss_kb():
+    """Returns the peak resident set size of this process, in KB"""
+    # ru_maxrss is in kilobytes on Linux, but in bytes on Mac OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+def run_child(script, *args):
+    """Runs script --child args... in a fresh interpreter, so that its memory
+       use can be measured on its own, and returns the object that it
+       printed as JSON on its last line of output.
+    """
+    out = subprocess.check_output([sys.executable, script, '--child'] +
+                                  [str(arg) for arg in args])
+    return json.loads(out.strip().split('\n')[-1])
+
+def report_child(**values):
+    """Prints the result of a --child run for run_child"""
+    values.setdefault('peak_rss_kb', peak_rss_kb())
+    print json.dumps(values)
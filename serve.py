@@ -0,0 +1,405 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Local analysis server: loads the corpus once, keeps it in memory, reloads
+# files that change, and answers JSON queries over localhost HTTP or a Unix
+# socket, so that a query costs milliseconds instead of a Python start-up
+# and a parse.
+#
+#   serve.py ncslgr-xml --port 8000
+#   curl 'localhost:8000/trees?file=ncslgr10a.xml&utterance=3'
+#
+# GET /files                          loaded files, with their participants
+# GET /trees?file=F[&utterance=U]     pause trees (see analyze.analyze_utterance)
+# GET /glosses?file=F[&field=FIELD]   tokens of a field (main gloss by default)
+# GET /cooccur?field=A&with=B[&with=C][&file=F][&text=T]
+#                                     tokens of A overlapping tokens of B, C, ...
+# GET /media?file=F[&utterance=U]     videos of each utterance
+# GET /status                         files, errors and reload count
+
+import argparse
+import BaseHTTPServer
+import collections
+import json
+import os
+import SocketServer
+import sys
+import threading
+import time
+import traceback
+import urlparse
+
+import analyze
+import analysis.signstream as ss
+import analysis.signstream.cache as sscache
+from analysis.signstream.corpus import expand_sources
+
+# seconds between two looks at the files
+DEFAULT_INTERVAL = 2.0
+
+# joined tiers kept per file, the least recently used dropped first
+MAX_JOINS = 16
+
+
+class LoadedFile(object):
+    """One parsed file, never changed once loaded: a reload replaces it, so
+       that a request sees the same database from start to end"""
+
+    def __init__(self, path, size, mtime, db):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.db = db
+        self.utterances = [u for p in db.get_participants() for u in p.get_utterances()]
+        self._analyses = None
+        self._joins = collections.OrderedDict()
+        self._joins_lock = threading.Lock()
+
+    def analyses(self):
+        """(utterance, analyze_utterance result) for the utterances with a
+           main gloss, computed on first use"""
+        if self._analyses is None:
+            results = []
+            for utterance in self.utterances:
+                try:
+                    results.append((utterance, analyze.analyze_utterance(utterance)))
+                except (KeyError, ss.InvalidField):
+                    pass
+            # two threads may both compute them; either result will do
+            self._analyses = results
+        return self._analyses
+
+    def join_tiers(self, field, others):
+        """The rows of db.join_tiers(field, others), kept for the next
+           requests (the last MAX_JOINS joins); raises InvalidField"""
+        key = (field, tuple(others))
+        with self._joins_lock:
+            rows = self._joins.pop(key, None)
+            if rows is not None:
+                self._joins[key] = rows
+                return rows
+        # join outside the lock; two threads may both compute the same rows
+        rows = list(self.db.join_tiers(field, others))
+        with self._joins_lock:
+            self._joins[key] = rows
+            while len(self._joins) > MAX_JOINS:
+                self._joins.popitem(last=False)
+        return rows
+
+
+class WarmCorpus(object):
+    """The files named by sources (see expand_sources), parsed and kept in
+       memory. refresh() loads new and changed files and drops deleted
+       ones; the files are looked up by path or by base name."""
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.lock = threading.Lock()
+        self.files = dict()
+        self.errors = dict()
+        self.reloads = 0
+        self.refresh()
+
+    def refresh(self):
+        """Bring the corpus up to date with the files on disk. Returns the
+           lists of (re)loaded and dropped paths."""
+        paths = [os.path.abspath(path) for path in expand_sources(self.sources)]
+        loaded = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError, e:
+                self._set_error(path, '{}: {}'.format(e.__class__.__name__, e))
+                continue
+            old = self.files.get(path)
+            if old is not None and (old.size, old.mtime) == (st.st_size, st.st_mtime):
+                continue
+            # parse outside the lock; queries go on with the old version
+            try:
+                db = sscache.read_xml(path)
+            except Exception, e:
+                self._set_error(path, '{}: {}'.format(e.__class__.__name__, e))
+                continue
+            with self.lock:
+                self.files[path] = LoadedFile(path, st.st_size, st.st_mtime, db)
+                self.errors.pop(path, None)
+            loaded.append(path)
+        current = set(paths)
+        with self.lock:
+            removed = [path for path in self.files if path not in current]
+            for path in removed:
+                del self.files[path]
+            if loaded or removed:
+                self.reloads += 1
+        return loaded, removed
+
+    def _set_error(self, path, message):
+        with self.lock:
+            self.errors[path] = message
+
+    def get(self, name):
+        """The LoadedFile for a path or base name; raises KeyError"""
+        with self.lock:
+            loaded = self.files.get(os.path.abspath(name))
+            if loaded is not None:
+                return loaded
+            matches = [f for path, f in self.files.iteritems()
+                       if os.path.basename(path) == name]
+        if len(matches) != 1:
+            raise KeyError(name)
+        return matches[0]
+
+    def all(self):
+        """All LoadedFiles, sorted by path"""
+        with self.lock:
+            return [self.files[path] for path in sorted(self.files)]
+
+    def watch(self, interval=DEFAULT_INTERVAL):
+        """Start a daemon thread that calls refresh every interval seconds;
+           returns the threading.Event that stops it"""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.refresh()
+        thread = threading.Thread(target=run, name='watcher')
+        thread.daemon = True
+        thread.start()
+        return stop
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _decode(value, name):
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        raise BadRequest('parameter is not UTF-8: ' + name)
+
+def _param(query, name, default=None):
+    values = query.get(name)
+    if not values:
+        if default is None:
+            raise BadRequest('missing parameter: ' + name)
+        return default
+    return _decode(values[0], name)
+
+def _utterance_filter(query):
+    if 'utterance' not in query:
+        return None
+    try:
+        return int(query['utterance'][0])
+    except ValueError:
+        raise BadRequest('utterance must be a number')
+
+def _file(corpus, query):
+    name = _param(query, 'file')
+    try:
+        return corpus.get(name)
+    except KeyError:
+        raise LookupError('no such file: ' + name)
+
+def query_files(corpus, query):
+    return {'files': [{'file': f.path, 'utterances': len(f.utterances),
+                       'participants': [p.get_label() for p in f.db.get_participants()]}
+                      for f in corpus.all()]}
+
+def query_trees(corpus, query):
+    loaded = _file(corpus, query)
+    uid = _utterance_filter(query)
+    records = []
+    for utterance, result in loaded.analyses():
+        if uid is not None and utterance.get_id() != uid:
+            continue
+        record = dict(result)
+        record['utterance'] = utterance.get_id()
+        record['participant'] = utterance.get_participant().get_label()
+        records.append(record)
+    return {'file': loaded.path, 'utterances': records}
+
+def query_glosses(corpus, query):
+    loaded = _file(corpus, query)
+    field = _param(query, 'field', u'main gloss')
+    tokens = []
+    for utterance in loaded.utterances:
+        try:
+            field_tokens = utterance.get_tokens_for_field(field)
+        except (KeyError, ss.InvalidField):
+            continue
+        media = [m.get_filename() for m in utterance.get_media()]
+        for token in field_tokens:
+            start, end = token.get_timecodes()
+            tokens.append({'participant': utterance.get_participant().get_label(),
+                           'utterance': utterance.get_id(), 'start': start,
+                           'end': end, 'text': token.get_text(), 'media': media})
+    return {'file': loaded.path, 'field': field, 'tokens': tokens}
+
+def query_cooccur(corpus, query):
+    field = _param(query, 'field')
+    others = [_decode(value, 'with') for value in query.get('with', [])]
+    if not others:
+        raise BadRequest('missing parameter: with')
+    text = query.get('text')
+    if text is not None:
+        text = _decode(text[0], 'text')
+    files = [_file(corpus, query)] if 'file' in query else corpus.all()
+    rows = []
+    for loaded in files:
+        try:
+            pairs = loaded.join_tiers(field, others)
+        except ss.InvalidField:
+            continue
+        for left, right, overlap in pairs:
+            if text is not None and left.get_text() != text:
+                continue
+            rows.append([loaded.path, left.get_utterance().get_id(),
+                         left.get_text(), left.get_timecodes()[0],
+                         left.get_timecodes()[1], right.get_field().get_label(),
+                         right.get_text(), overlap])
+    return {'field': field, 'with': others,
+            'columns': ['file', 'utterance', 'text', 'start', 'end', 'field',
+                        'other', 'overlap'],
+            'rows': rows}
+
+def query_media(corpus, query):
+    loaded = _file(corpus, query)
+    uid = _utterance_filter(query)
+    return {'file': loaded.path,
+            'utterances': [{'utterance': u.get_id(),
+                            'media': [m.get_filename() for m in u.get_media()]}
+                           for u in loaded.utterances
+                           if uid is None or u.get_id() == uid]}
+
+def query_status(corpus, query):
+    with corpus.lock:
+        return {'files': len(corpus.files), 'errors': dict(corpus.errors),
+                'reloads': corpus.reloads}
+
+QUERIES = {
+    '/files': query_files,
+    '/trees': query_trees,
+    '/glosses': query_glosses,
+    '/cooccur': query_cooccur,
+    '/media': query_media,
+    '/status': query_status,
+}
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep connections open, so that a client pays the connection set-up
+    # once rather than per query; send each response in one piece, without
+    # waiting for the client's acknowledgement of the headers (Nagle)
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        try:
+            (status, value) = self.answer()
+            body = json.dumps(value, sort_keys=True)
+        except Exception:
+            # answer anyway, so that the connection stays usable
+            sys.stderr.write(traceback.format_exc())
+            (status, body) = (500, json.dumps({'error': 'internal error'}))
+        self.send_json(status, body)
+
+    def answer(self):
+        """(HTTP status, JSON value) for the requested query"""
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        function = QUERIES.get(url.path)
+        if function is None:
+            path = url.path.decode('utf-8', 'replace')
+            return (404, {'error': u'no such query: ' + path})
+        try:
+            return (200, function(self.server.corpus, query))
+        except BadRequest, e:
+            return (400, {'error': unicode(e)})
+        except LookupError, e:
+            return (404, {'error': unicode(e)})
+
+    def send_json(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class UnixRequestHandler(RequestHandler):
+    # TCP_NODELAY does not apply to Unix sockets
+    disable_nagle_algorithm = False
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Answers each client in its own thread, over localhost TCP"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, corpus, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+        self.corpus = corpus
+        self.verbose = verbose
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """The same as HTTPServer, over a Unix socket"""
+    daemon_threads = True
+
+    def __init__(self, path, corpus, verbose=False):
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, UnixRequestHandler)
+        self.corpus = corpus
+        self.verbose = verbose
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Serve pause trees, glosses, co-occurrences and media of "
+                    "SignStream files from memory.")
+    parser.add_argument('sources', nargs='+', metavar='PATH',
+                        help="XML file, directory of XML files, or glob pattern")
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('--port', type=int, default=8000,
+                       help="localhost port (default: 8000)")
+    where.add_argument('--socket', metavar='PATH', help="listen on this Unix socket")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between checks for changed files "
+                             "(default: %(default)s)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request")
+    args = parser.parse_args()
+
+    start = time.time()
+    corpus = WarmCorpus(args.sources)
+    for path, error in sorted(corpus.errors.items()):
+        sys.stderr.write('{}: {}\n'.format(path, error))
+    if args.socket:
+        server = UnixHTTPServer(args.socket, corpus, args.verbose)
+        where = args.socket
+    else:
+        server = HTTPServer(('127.0.0.1', args.port), corpus, args.verbose)
+        where = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    sys.stderr.write('{} files loaded in {:.1f}s; serving on {}\n'.format(
+        len(corpus.files), time.time() - start, where))
+    corpus.watch(args.interval)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
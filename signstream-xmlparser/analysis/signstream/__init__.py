@@ -3,17 +3,33 @@
 
 from __future__ import absolute_import
 
+import itertools
 import xml.sax as sax
+from timeit import default_timer as _timer
 import analysis.xmlbase as xmlbase
+from analysis.signstream.dom import _digest, _diff_children
 
 from analysis.signstream.dom import *
 
 class SignStreamDatabase(object):
   """Represents a SignStream database"""
+
+  # classes of the field objects, and of the utterance objects created by
+  # the participants
+  field_class = Field
+  utterance_class = Utterance
   
   def __init__(self):
-    """Constructs a new database object"""
+    """Constructs a new database object.
+       Raises TypeError for a subclass that overrides _add_token but not
+       _token_adder, since the parser would bypass its _add_token.
+    """
     super(SignStreamDatabase, self).__init__()
+    cls = type(self)
+    if cls._add_token.im_func is not SignStreamDatabase._add_token.im_func and \
+       cls._token_adder.im_func is SignStreamDatabase._token_adder.im_func:
+      raise TypeError("%s overrides _add_token but not _token_adder, through "
+                      "which the parser adds tokens" % cls.__name__)
     self.participants = dict()
     self.fields = dict()
     self.media = dict()
@@ -22,19 +38,73 @@ class SignStreamDatabase(object):
     self.f_order = None
     self.f_index = None
     self.m_order = None
+    self.digest = None
+    self.frozen = False
     
   @classmethod
-  def read_xml(cls, fileobj, warn_on_error=False):
+  def read_xml(cls, fileobj, warn_on_error=False, fields=None, stats=None, freeze=True):
     """Reads a SignStream database from an XML file.
        fileobj can be either a file name, or a file object.
        If warn_on_error is true, XML parser errors are ignored
           with a warning message, instead of causing an exception to be raised.
+       fields optionally restricts the tokens that are loaded to the given
+          fields (ids or labels). The tracks of all other fields are skipped
+          by the parser without creating any objects for them. All field
+          definitions are loaded regardless.
+       stats, if given, is an xmlbase.ParseStats that the parse adds its
+          element counts and timings to. Without it, the parser is not
+          instrumented at all.
+       freeze, if true, freezes the database (see freeze) before it is
+          returned. Pass False to change it afterwards.
     """
     parser = sax.make_parser()
-    handler = _SignStreamHandler(cls, warn_on_error)
+    handler = _SignStreamHandler(cls, warn_on_error, fields=fields)
+    if stats is not None:
+      handler.enable_stats(stats)
+      start = _timer()
     parser.setContentHandler(handler)
-    parser.parse(fileobj)
-    return handler.get_database()
+    try:
+      parser.parse(fileobj)
+    finally:
+      handler._uninstrument_db()
+    if stats is not None:
+      stats.parses += 1
+      stats.seconds += _timer() - start
+    db = handler.get_database()
+    if freeze:
+      db.freeze()
+    return db
+
+  def freeze(self):
+    """Makes the database read-only. All orders and indices are computed
+       now, as tuples and read-only mappings (FrozenDict), and the _add_*
+       methods raise FrozenDatabase from then on. Nothing in a frozen
+       database is changed by a query, except the digests and interval
+       indices, which are still built on first use but published in one
+       assignment, so any number of threads can read it without locks.
+       Returns the database.
+    """
+    if self.frozen:
+      return self
+    for participant in self.participants.itervalues():
+      participant._freeze()
+    for field in self.fields.itervalues():
+      field._freeze()
+    self.p_order = tuple(sorted(self.participants))
+    self.p_index = FrozenDict((p.get_label(), pid)
+                              for (pid, p) in self.participants.iteritems())
+    self.f_order = tuple(sorted(self.fields))
+    self.f_index = FrozenDict((f.get_label(), fid) for (fid, f) in self.fields.iteritems())
+    self.m_order = tuple(sorted(self.media))
+    self.participants = FrozenDict(self.participants)
+    self.fields = FrozenDict(self.fields)
+    self.media = FrozenDict(self.media)
+    self.frozen = True
+    return self
+
+  def _check_not_frozen(self):
+    if self.frozen:
+      raise FrozenDatabase()
   
   def get_participant(self, participant):
     """Returns a particular particpant by id or label, depending on the
@@ -57,10 +127,7 @@ class SignStreamDatabase(object):
     """
     if isinstance(field, basestring):
       # lookup by name
-      try:
-        return self.fields[self._get_field_index()[field]]
-      except KeyError:
-        raise InvalidField(field)
+      return self.fields[self._get_field_id(field)]
     else:
       # lookup by id
       try:
@@ -76,15 +143,67 @@ class SignStreamDatabase(object):
     """Returns an iterable over all media, ordered by id"""
     return (self._get_media(mid) for mid in self._get_media_order())
   
+  def join_tiers(self, left_field, right_fields):
+    """Pairs every token of left_field with the overlapping tokens of the
+       right_fields (all ids or labels), utterance by utterance, with a
+       sweep over each utterance's tokens (see dom.join_tokens).
+       Returns an iterable over (left token, right token, overlap in ms).
+    """
+    left = self.get_field(left_field).get_id()
+    right = [self.get_field(field).get_id() for field in right_fields]
+    for participant in self.get_participants():
+      for utterance in participant.get_utterances():
+        for row in utterance.join_tiers(left, right):
+          yield row
+
   def has_media(self, media_id):
     """Returns true if the given media id is in the database"""
     return self.media.has_key(media_id)
     
+  def get_digest(self):
+    """Returns a digest (a SHA-1 as a byte string) of the whole database,
+       made from the digests of its participants, fields and media (see
+       dom.Participant.get_digest). It is computed on first use and kept
+       until the database changes; once two databases have their digests,
+       comparing them costs O(1).
+    """
+    if self.digest is None:
+      self.digest = _digest([p.get_digest() for p in self.get_participants()] +
+                            ["fields"] + [f.get_digest() for f in self.get_fields()] +
+                            ["media"] + [m.get_digest() for m in self.get_media()])
+    return self.digest
+
   def __eq__(self, other):
-    """test for self == other"""
+    """test for self == other. If both databases already have their
+       digests (see get_digest), they are compared; otherwise the contents
+       are, which is cheaper than hashing them for a single comparison.
+    """
+    if self.digest is not None and other.digest is not None:
+      return self.digest == other.digest
     return self.participants == other.participants and \
            self.fields == other.fields and \
            self.media == other.media
+
+  def diff(self, other):
+    """Returns an iterable over the differences between this database and
+       another one, as (path, this, other) triples. Only the parts whose
+       digests differ are compared.
+       path locates the difference, as a tuple of (kind, key) pairs, where
+          kind is "participant", "utterance", "field", "token", "value",
+          "media" or "attribute". For example,
+          (("participant", 0), ("utterance", 28), ("field", 10000),
+          ("token", 3)) is the fourth main gloss token of an utterance.
+       this and other are the differing objects or attribute values; one
+          of them is None for an object that only exists on one side. A
+          token path counts positions in this database's token list,
+          except for tokens that only the other database has.
+    """
+    if self.get_digest() == other.get_digest():
+      return iter(())
+    return itertools.chain(
+      _diff_children((), "participant", self.participants, other.participants),
+      _diff_children((), "field", self.fields, other.fields),
+      _diff_children((), "media", self.media, other.media))
   
   def __ne__(self, other):
     """test for self != other"""
@@ -92,31 +211,40 @@ class SignStreamDatabase(object):
   
   def _add_participant(self, pid, age, language, label, name, gender):
     """Adds a participant to the database"""
+    self._check_not_frozen()
     if self.participants.has_key(pid):
       raise DuplicateParticipant(pid)
     self.participants[pid] = Participant(db=self, pid=pid, age=age, language=language,
                                          label=label, name=name, gender=gender)
     self.p_order = None
+    self.digest = None
     self.p_index = None
 
   def _add_field(self, fid, name, label, constraint):
     """Adds a field (tier) to the database"""
+    self._check_not_frozen()
     if self.fields.has_key(fid):
       raise DuplicateField(fid)
-    self.fields[fid] = Field(fid=fid, name=name, label=label, constraint=constraint)
+    self.fields[fid] = self.field_class(fid=fid, name=name, label=label,
+                                        constraint=constraint)
     self.f_order = None
+    self.digest = None
     self.f_index = None
   
   def _add_value(self, fid, vid, name, label=None):
     """Adds a field value to the database"""
+    self._check_not_frozen()
     self.fields[fid]._add_value(vid=vid, label=label, name=name)
+    self.digest = None
   
   def _add_media(self, mid, path):
     """Adds a video to the database"""
+    self._check_not_frozen()
     if self.media.has_key(mid):
       raise DuplicateMediaFile(mid)
     self.media[mid] = MediaFile(mid=mid, path=path)
     self.m_order = None
+    self.digest = None
   
   def _get_media(self, mid):
     if self.media.has_key(mid):
@@ -126,31 +254,79 @@ class SignStreamDatabase(object):
   
   def _add_utterance(self, uid, pid, start, end, media):
     """Adds an utterance to the database"""
+    self._check_not_frozen()
     self.participants[pid]._add_utterance(uid=uid, start=start, end=end,
                                          media=[self._get_media(mid) for mid in media])
+    self.digest = None
   
   def _add_token(self, uid, pid, fid, start, end, vid, text):
     """Adds a token for a specific field (fid), in a specific utterance
-       (uid, pid) to the database.
+       (uid, pid) to the database, through _token_adder.
+    """
+    self._token_adder(uid, pid, fid)(start, end, vid, text)
+
+  def _token_adder(self, uid, pid, fid):
+    """Returns a function (start, end, vid, text) that adds tokens of one
+       field (fid) to one utterance (uid, pid), for loading in bulk: the
+       utterance, field and caches are dealt with here once, rather than
+       for every token (see Utterance._token_appender).
+       The parser and analysis.signstream.cache add all tokens through
+       this method, so subclasses that change how tokens are added must
+       override it, not _add_token (see __init__).
+    """
+    self._check_not_frozen()
+    participant = self.participants[pid]
+    participant.digest = None
+    self.digest = None
+    return participant.utterances[uid]._token_appender(self.fields[fid])
+
+  def _add_token_columns(self, uid, pid, fid, starts, ends, vids, texts):
+    """Adds all tokens of one field (fid) to one utterance (uid, pid), from
+       parallel sequences: starts and ends are absolute timecodes, and
+       vids and texts are the value ids (-1 for free-form tokens) and the
+       texts (whatever for standard tokens), or texts is None if there are
+       only standard tokens. Used by analysis.signstream.cache.restore;
+       this goes through _token_adder, but subclasses that store tokens in
+       columns can take them as they are.
     """
-    self.participants[pid]._add_token(uid=uid, field=self.fields[fid], start=start,
-                                     end=end, vid=vid, text=text)
+    add = self._token_adder(uid, pid, fid)
+    offset = self.participants[pid].utterances[uid].start
+    if texts is None:
+      texts = itertools.repeat(None)
+    for (start, end, vid, text) in itertools.izip(starts, ends, vids, texts):
+      if vid < 0:
+        add(start - offset, end - offset, None, text)
+      else:
+        add(start - offset, end - offset, vid, None)
+
+  def _detach_utterance(self, uid, pid):
+    """Removes an utterance from its participant and returns it"""
+    self._check_not_frozen()
+    self.digest = None
+    return self.participants[pid]._detach_utterance(uid)
 
+  # the lazy orders and indices are complete before they are published,
+  # so that a reader in another thread never sees them half-built
   def _get_field_order(self):
     if self.f_order is None:
-      self.f_order = self.fields.keys()
-      self.f_order.sort()
+      self.f_order = sorted(self.fields)
     return self.f_order
     
   def _get_field_index(self):
     if self.f_index is None:
       self.f_index = dict((self.fields[fid].get_label(), fid) for fid in self.fields)
     return self.f_index
+
+  def _get_field_id(self, label):
+    """Returns the id of the field with the given label"""
+    try:
+      return self._get_field_index()[label]
+    except KeyError:
+      raise InvalidField(label)
   
   def _get_participant_order(self):
     if self.p_order is None:
-      self.p_order = self.participants.keys()
-      self.p_order.sort()
+      self.p_order = sorted(self.participants)
     return self.p_order
 
   def _get_participant_index(self):
@@ -161,11 +337,163 @@ class SignStreamDatabase(object):
   
   def _get_media_order(self):
     if self.m_order is None:
-      self.m_order = self.media.keys()
-      self.m_order.sort()
+      self.m_order = sorted(self.media)
     return self.m_order
 
 
+class ColumnarSignStreamDatabase(SignStreamDatabase):
+  """A SignStream database that stores the tokens of each utterance in
+     parallel integer arrays (see dom.ColumnarUtterance), with the text of
+     free-form tokens held once in a database-wide string table. Tokens are
+     handed out as lightweight views, so the query interface is unchanged,
+     but a token only costs a few array entries while it is not in use.
+  """
+
+  utterance_class = ColumnarUtterance
+
+  def __init__(self):
+    """Constructs a new database object"""
+    super(ColumnarSignStreamDatabase, self).__init__()
+    self.strings = []
+    self.string_ids = dict()
+
+  def _add_token_columns(self, uid, pid, fid, starts, ends, vids, texts):
+    """Adds all tokens of one field to one utterance by extending its
+       TokenColumn (see SignStreamDatabase._add_token_columns)
+    """
+    self._check_not_frozen()
+    participant = self.participants[pid]
+    participant.digest = None
+    self.digest = None
+    participant.utterances[uid]._add_token_columns(self.fields[fid], starts, ends,
+                                                   vids, texts)
+
+  def _intern_text(self, text):
+    """Returns the id of a string in the string table, adding it if needed"""
+    text_id = self.string_ids.get(text)
+    if text_id is None:
+      text_id = len(self.strings)
+      self.strings.append(text)
+      self.string_ids[text] = text_id
+    return text_id
+
+
+class CompactSignStreamDatabase(SignStreamDatabase):
+  """A SignStream database for large corpora. Its utterances, tokens and
+     field values declare __slots__ (see dom.CompactToken), so they take
+     less memory than those of SignStreamDatabase but cannot be given
+     further attributes, and they need pickle protocol 2. Token texts, as
+     well as the names and labels of field values, go through a StringPool
+     while loading, so that each distinct string is held only once.
+  """
+
+  field_class = CompactField
+  utterance_class = CompactUtterance
+
+  def __init__(self, string_pool=None):
+    """Constructs a new database object.
+       string_pool is the StringPool to use; by default the database gets
+          one of its own, which goes away with it. Pass the same pool to
+          several databases to share their strings.
+    """
+    super(CompactSignStreamDatabase, self).__init__()
+    if string_pool is None:
+      string_pool = StringPool()
+    self.string_pool = string_pool
+
+  def _add_value(self, fid, vid, name, label=None):
+    """Adds a field value to the database"""
+    pool = self.string_pool
+    super(CompactSignStreamDatabase, self)._add_value(
+      fid=fid, vid=vid, name=pool.intern(name), label=pool.intern(label))
+
+  def _token_adder(self, uid, pid, fid):
+    """Returns a function (start, end, vid, text) that adds tokens of one
+       field to one utterance (see SignStreamDatabase._token_adder)
+    """
+    add = super(CompactSignStreamDatabase, self)._token_adder(uid, pid, fid)
+    intern = self.string_pool.intern
+    def add_interned(start, end, vid, text):
+      add(start, end, vid, intern(text))
+    return add_interned
+
+
+# Size of the blocks that iter_utterances feeds to the XML parser
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+def iter_utterances(fileobj, fields=None, warn_on_error=False, stats=None):
+  """Reads the utterances of a SignStream XML file one at a time, without
+     building the whole database.
+     fileobj can be either a file name, or a file object.
+     fields, warn_on_error and stats have the same meaning as in
+        SignStreamDatabase.read_xml; the time the caller spends between
+        utterances is not counted.
+     Returns an iterable that yields each utterance, with all of its tokens,
+     as soon as its closing tag has been parsed. A yielded utterance is no
+     longer part of its participant's utterance list, so it is freed as
+     soon as the caller lets go of it. Utterances come in file order, not
+     in ID order.
+  """
+  parser = sax.make_parser()
+  handler = _SignStreamHandler(SignStreamDatabase, warn_on_error, fields=fields,
+                               streaming=True)
+  if stats is not None:
+    handler.enable_stats(stats)
+    parser.feed = stats.timed_seconds(parser.feed)
+    parser.close = stats.timed_seconds(parser.close)
+  parser.setContentHandler(handler)
+  if isinstance(fileobj, basestring):
+    fileobj = open(fileobj, "rb")
+    close = True
+  else:
+    close = False
+  try:
+    while True:
+      data = fileobj.read(_STREAM_CHUNK_SIZE)
+      if not data:
+        break
+      parser.feed(data)
+      for utterance in handler.pop_utterances():
+        yield utterance
+    parser.close()
+    for utterance in handler.pop_utterances():
+      yield utterance
+    if stats is not None:
+      stats.parses += 1
+  finally:
+    handler._uninstrument_db()
+    if close:
+      fileobj.close()
+
+
+def read_header(fileobj, warn_on_error=False):
+  """Reads the participants, fields and media files of a SignStream XML
+     file, and stops parsing at the first utterance, so that the coding
+     scheme can be checked without reading the tokens.
+     fileobj and warn_on_error are as in SignStreamDatabase.read_xml.
+     Returns a frozen SignStreamDatabase without utterances.
+  """
+  parser = sax.make_parser()
+  handler = _HeaderHandler(SignStreamDatabase, warn_on_error)
+  parser.setContentHandler(handler)
+  if isinstance(fileobj, basestring):
+    fileobj = open(fileobj, "rb")
+    close = True
+  else:
+    close = False
+  try:
+    while not handler.complete:
+      data = fileobj.read(_STREAM_CHUNK_SIZE)
+      if not data:
+        parser.close()
+        break
+      parser.feed(data)
+  finally:
+    if close:
+      fileobj.close()
+  return handler.get_database().freeze()
+
+
 # Handler class for reading SignStream databases from XML
 class _SignStreamHandler(xmlbase.ContentHandlerWithDefaults):
   # Note that XML is case-sensitive, so we have to work with uppercase here.
@@ -182,10 +510,14 @@ class _SignStreamHandler(xmlbase.ContentHandlerWithDefaults):
   
   ignored_value_groups = set(['VALUES_DFLT',  'VALUE_COLLECTION', 'SYNTACTIC_GROUP'])
   
-  def __init__(self, model_class, warn_on_error=False):
+  def __init__(self, model_class, warn_on_error=False, fields=None, streaming=False):
     """Initializes a handler for parsing a SignStream file.
        model_class is the class object for the database that should
        be instantiated.
+       fields, if given, lists the fields (ids or labels) whose tracks
+       are loaded; all other tracks are skipped.
+       If streaming is true, each utterance is detached from the database
+       once it is complete, and handed out by pop_utterances().
     """
     xmlbase.ContentHandlerWithDefaults.__init__(self, self.allowed_elements, warn_on_error)
     self.model_class = model_class
@@ -193,6 +525,37 @@ class _SignStreamHandler(xmlbase.ContentHandlerWithDefaults):
     self.current_field = None
     self.current_utterance = None
     self.current_token = None
+    # adds the tokens of the current track (see SignStreamDatabase._token_adder)
+    self.add_token = None
+    self.fields = fields
+    self.field_filter = None
+    self.streaming = streaming
+    self.finished_utterances = []
+    # looked up through the instance, so that enable_stats can time it
+    self._strip_attrs = _strip_attrs
+
+  # Overrides base class method
+  def enable_stats(self, stats=None):
+    stats = xmlbase.ContentHandlerWithDefaults.enable_stats(self, stats)
+    self._strip_attrs = stats.timed("_strip_attrs", _strip_attrs)
+    return stats
+
+  # database construction methods timed by enable_stats
+  _timed_db_methods = ("_add_participant", "_add_field", "_add_value", "_add_media",
+                       "_add_utterance", "_add_token", "_detach_utterance")
+
+  def _instrument_db(self):
+    # wraps the methods of this database object only, until the parse
+    # ends (see _uninstrument_db)
+    for name in self._timed_db_methods:
+      setattr(self.db, name, self.stats.timed(name, getattr(self.db, name)))
+
+  def _uninstrument_db(self):
+    # called by read_xml and iter_utterances once the parse is over,
+    # whether it succeeded or not
+    if self.stats is not None and self.db is not None:
+      for name in self._timed_db_methods:
+        self.db.__dict__.pop(name, None)
     
   def _check_db(self):
     if self.db is None:
@@ -214,23 +577,39 @@ class _SignStreamHandler(xmlbase.ContentHandlerWithDefaults):
     if self.current_token is None:
       raise xmlbase.UnexpectedElement(self.current_element, self.element_stack)
 
+  def _wanted_fields(self):
+    # resolved lazily, since the field definitions precede the utterances
+    if self.field_filter is None:
+      self.field_filter = set(self.db.get_field(f).get_id() for f in self.fields)
+    return self.field_filter
+
   def get_database(self):
     """Returns the SignStream database generated from the XML file."""
     return self.db
+
+  def pop_utterances(self):
+    """Returns the utterances completed since the last call (streaming
+       mode only).
+    """
+    finished = self.finished_utterances
+    self.finished_utterances = []
+    return finished
   
   def start_SIGNSTREAM_DATABASE(self, attrs):
     self.db = self.model_class()
+    if self.stats is not None:
+      self._instrument_db()
   
   def start_PARTICIPANT(self, attrs):
     self._check_db()
-    attrs = _strip_attrs(attrs)
+    attrs = self._strip_attrs(attrs)
     self.db._add_participant(age=attrs['AGE'], gender=attrs['GENDER'],
                              pid=int(attrs['ID']), label=attrs['LABEL'],
                              name=attrs['NAME'], language=attrs['LANGUAGE'])
   
   def start_FIELD(self, attrs):
     self._check_db()
-    attrs = _strip_attrs(attrs)
+    attrs = self._strip_attrs(attrs)
     self.current_field = int(attrs['ID'])
     name = attrs['NAME']
     label = attrs.get('LABEL', name)
@@ -244,34 +623,38 @@ class _SignStreamHandler(xmlbase.ContentHandlerWithDefaults):
   def start_VALUE(self, attrs):
     if self.element_stack[-1] not in self.ignored_value_groups:
       self._check_field()
-      attrs = _strip_attrs(attrs)
+      attrs = self._strip_attrs(attrs)
       self.db._add_value(fid=self.current_field, vid=int(attrs['ID']),
                          label=attrs.get('LABEL', None), name=attrs['NAME'])
 
   def start_MEDIA_FILE(self, attrs):
     self._check_db()
-    attrs = _strip_attrs(attrs)
+    attrs = self._strip_attrs(attrs)
     self.db._add_media(mid=int(attrs['ID']), path=attrs['LEGACY-PATH'])
 
   def start_UTTERANCE(self, attrs):
     self._check_db()
-    attrs = _strip_attrs(attrs)
+    attrs = self._strip_attrs(attrs)
     self.current_utterance = dict(id=int(attrs['ID']), s=int(attrs['S']),
                                   e=int(attrs['E']), media=[], person=None)
   
   def end_UTTERANCE(self, text):
     self._check_utterance()
+    u = self.current_utterance
+    if self.streaming and u['person'] is not None:
+      self.finished_utterances.append(self.db._detach_utterance(uid=u['id'],
+                                                                pid=u['person']))
     self.current_utterance = None 
   
   def start_MEDIA_REF(self, attrs):
     self._check_utterance()
     self._check_media(int(attrs['ID']))
-    attrs = _strip_attrs(attrs)
+    attrs = self._strip_attrs(attrs)
     self.current_utterance['media'].append(int(attrs['ID']))
   
   def start_SEGMENT(self, attrs):
     self._check_utterance()
-    attrs = _strip_attrs(attrs)
+    attrs = self._strip_attrs(attrs)
     self.current_utterance['person'] = int(attrs['PARTICIPANT-ID'])
     u = self.current_utterance
     self.db._add_utterance(uid=u['id'], pid=u['person'], start=u['s'],
@@ -279,33 +662,59 @@ class _SignStreamHandler(xmlbase.ContentHandlerWithDefaults):
 
   def start_TRACK(self, attrs):
     self._check_utterance()
-    attrs = _strip_attrs(attrs)
-    self.current_field = int(attrs['FID']) 
+    attrs = self._strip_attrs(attrs)
+    fid = int(attrs['FID'])
+    if self.fields is not None and fid not in self._wanted_fields():
+      self.skip_element()
+    else:
+      self.current_field = fid
+      self.add_token = None
 
   def end_TRACK(self, text):
     self._check_utterance()
     self._check_field()
     self.current_field = None
+    self.add_token = None
 
   def start_A(self, attrs):
     self._check_utterance()
     self._check_field()
-    attrs = _strip_attrs(attrs)
+    attrs = self._strip_attrs(attrs)
     vid = attrs.get('VID', None)
     if vid is not None:
       vid = int(vid)
-    self.current_token = dict(s=int(attrs['S']), e=int(attrs['E']),
-                              vid=vid)
+    self.current_token = (int(attrs['S']), int(attrs['E']), vid)
     
   def end_A(self, text):
     self._check_token()
-    u = self.current_utterance
-    t = self.current_token
-    self.db._add_token(uid=u['id'], pid=u['person'], fid=self.current_field,
-                       start=t['s'], end=t['e'], vid=t['vid'],
-                       text=text.strip())
+    if self.add_token is None:
+      # resolved at the first token of the track, so that empty tracks
+      # leave no token list behind
+      u = self.current_utterance
+      self.add_token = self.db._token_adder(uid=u['id'], pid=u['person'],
+                                            fid=self.current_field)
+      if self.stats is not None:
+        self.add_token = self.stats.timed("_add_token", self.add_token)
+    (start, end, vid) = self.current_token
+    self.add_token(start, end, vid, text.strip())
     self.current_token = None
 
+
+class _HeaderHandler(_SignStreamHandler):
+  """Handler for read_header: skips the utterances, and sets complete at
+     the first one, after which the rest of the file need not be fed.
+  """
+
+  def __init__(self, model_class, warn_on_error=False):
+    _SignStreamHandler.__init__(self, model_class, warn_on_error)
+    self.complete = False
+
+  # Overrides base class method
+  def start_UTTERANCE(self, attrs):
+    self._check_db()
+    self.complete = True
+    self.skip_element()
+
   
 def _strip_attrs(attrs):
   return dict((k, v.strip()) for (k, v) in attrs.items())
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+# Persistent cache of parsed SignStream databases, so that repeated runs over
+# the same XML files do not have to parse them again.
+
+from __future__ import absolute_import
+
+from array import array
+import cPickle
+import errno
+import gc
+import hashlib
+import os
+import sys
+import tempfile
+
+import analysis.signstream as ss
+
+# Bump whenever the snapshot layout changes; entries with another version
+# are treated as stale.
+SNAPSHOT_VERSION = 2
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Environment variable that overrides the default cache directory. If it is
+# set to the empty string, the module-level read functions do not cache.
+CACHE_DIR_VARIABLE = "SIGNSTREAM_CACHE"
+
+_SUFFIX = ".sscache"
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def snapshot(db):
+  """Returns a compact representation of a database, made of tuples, lists,
+     numbers and strings only, from which restore() can rebuild it.
+     The timecodes and value ids of each field of each utterance are
+     packed into byte strings, so that a snapshot unpickles quickly and
+     columnar databases restore without handling single tokens.
+  """
+  return (_header_record(db),
+          [_utterance_record(u) for p in db.get_participants()
+                                for u in p.get_utterances()])
+
+def restore(snap, model_class=ss.SignStreamDatabase, freeze=True):
+  """Rebuilds a database from the result of snapshot().
+     model_class is the class object for the database that should be
+     instantiated.
+     freeze, if true, freezes the database, as read_xml does.
+  """
+  (header, utterances) = snap
+  # a restore only creates objects that stay alive, so the collector
+  # would walk the growing heap over and over for nothing
+  collecting = gc.isenabled()
+  gc.disable()
+  try:
+    db = _restore_header(header, model_class)
+    for record in utterances:
+      _restore_utterance(db, record)
+  finally:
+    if collecting:
+      gc.enable()
+  if freeze:
+    db.freeze()
+  return db
+
+def _header_record(db):
+  participants = [(p.get_id(), p.get_age(), p.get_language(), p.get_label(),
+                   p.get_name(), p.get_gender()) for p in db.get_participants()]
+  fields = [(f.get_id(), f.get_name(), f.get_label(), f.constraint,
+             [(v.get_id(), v.get_name(), v.get_label()) for v in f.get_values()])
+            for f in db.get_fields()]
+  media = [(m.get_id(), m.path) for m in db.get_media()]
+  return (participants, fields, media)
+
+def _utterance_record(u):
+  (ustart, uend) = u.get_timecodes()
+  fields = [(fid,) + _token_columns(u.tokens[fid]) for fid in u._get_token_field_order()]
+  return (u.get_id(), u.get_participant().get_id(), ustart, uend,
+          [m.get_id() for m in u.get_media()], fields)
+
+def _token_columns(tokens):
+  """Returns (starts, ends, vids, texts) of a field's tokens, in the form
+     SignStreamDatabase._add_token_columns takes, with the first three packed
+  """
+  if isinstance(tokens, ss.TokenColumn):
+    (starts, ends, vids) = (tokens.starts, tokens.ends, tokens.vids)
+    strings = tokens.strings
+    texts = [None if i < 0 else strings[i] for i in tokens.text_ids]
+  else:
+    starts = array("i", [t.start for t in tokens])
+    ends = array("i", [t.end for t in tokens])
+    values = [t.standard_token for t in tokens]
+    vids = array("i", [-1 if v is None else v.vid for v in values])
+    texts = [t.text if v is None else None for (t, v) in zip(tokens, values)]
+  if all(vid >= 0 for vid in vids):
+    texts = None
+  return (_pack(starts), _pack(ends), _pack(vids), texts)
+
+# packed little-endian, so that snapshots can be moved between machines
+def _pack(numbers):
+  if sys.byteorder == "big":
+    numbers = array("i", numbers)
+    numbers.byteswap()
+  return numbers.tostring()
+
+def _unpack(data):
+  numbers = array("i")
+  numbers.fromstring(data)
+  if sys.byteorder == "big":
+    numbers.byteswap()
+  return numbers
+
+def _restore_header(header, model_class):
+  (participants, fields, media) = header
+  db = model_class()
+  for (pid, age, language, label, name, gender) in participants:
+    db._add_participant(pid=pid, age=age, language=language, label=label,
+                        name=name, gender=gender)
+  for (fid, name, label, constraint, values) in fields:
+    db._add_field(fid=fid, name=name, label=label, constraint=constraint)
+    for (vid, vname, vlabel) in values:
+      db._add_value(fid=fid, vid=vid, name=vname, label=vlabel)
+  for (mid, path) in media:
+    db._add_media(mid=mid, path=path)
+  return db
+
+def _restore_utterance(db, record):
+  (uid, pid, start, end, media, fields) = record
+  db._add_utterance(uid=uid, pid=pid, start=start, end=end, media=media)
+  for (fid, starts, ends, vids, texts) in fields:
+    db._add_token_columns(uid, pid, fid, _unpack(starts), _unpack(ends),
+                          _unpack(vids), texts)
+
+
+class DatabaseCache(object):
+  """A directory of parsed database snapshots.
+     Each entry belongs to one XML file (and field selection), and records
+     the file's path, size, modification time and SHA-1 content hash. An
+     entry is used as long as size and mtime still match, or, failing
+     that, as long as the content hash does; otherwise it is discarded and
+     the file is parsed again. When the entries exceed max_bytes in total,
+     the least recently used ones are evicted.
+     Lenient and strict parses (warn_on_error) are kept apart, and so are
+     databases from read_xml and utterance streams from iter_utterances:
+     the latter replay the utterances in file order, as they were streamed.
+  """
+
+  def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+    """Creates a cache in the given directory, which is created if needed.
+       max_bytes bounds the total size of the snapshots kept.
+    """
+    super(DatabaseCache, self).__init__()
+    self.directory = directory
+    self.max_bytes = max_bytes
+    try:
+      os.makedirs(directory)
+    except OSError, e:
+      if e.errno != errno.EEXIST:
+        raise
+
+  def read_xml(self, path, warn_on_error=False, fields=None,
+               model_class=ss.SignStreamDatabase):
+    """Like SignStreamDatabase.read_xml, but answers from the cache if
+       possible, and stores the parsed database in the cache otherwise.
+       path must be a file name.
+    """
+    (snap, key) = self._lookup(path, fields, warn_on_error)
+    if snap is not None:
+      return restore(snap, model_class)
+    db = model_class.read_xml(path, warn_on_error=warn_on_error, fields=fields)
+    self._store(key, snapshot(db))
+    return db
+
+  def iter_utterances(self, path, warn_on_error=False, fields=None):
+    """Like analysis.signstream.iter_utterances, but answers from the cache
+       if possible. On a miss the file is streamed as usual, and the
+       snapshot is stored once the iteration has run to completion.
+       Either way, the utterances come in file order.
+    """
+    (snap, key) = self._lookup(path, fields, warn_on_error, stream=True)
+    if snap is not None:
+      (header, utterances) = snap
+      db = _restore_header(header, ss.SignStreamDatabase)
+      for record in utterances:
+        _restore_utterance(db, record)
+        yield db._detach_utterance(uid=record[0], pid=record[1])
+      return
+    records = []
+    db = None
+    for utterance in ss.iter_utterances(path, warn_on_error=warn_on_error,
+                                        fields=fields):
+      records.append(_utterance_record(utterance))
+      db = utterance.get_participant().get_db()
+      yield utterance
+    if db is not None:
+      self._store(key, (_header_record(db), records))
+
+  def clear(self):
+    """Removes all entries"""
+    for (name, _, _) in self._entries():
+      _remove(name)
+
+  def _entry_name(self, path, fields, warn_on_error=False, stream=False):
+    if fields is not None:
+      fields = sorted(fields)
+    key = u"%s\0%r\0%r\0%r" % (os.path.abspath(path), fields,
+                               bool(warn_on_error), bool(stream))
+    return os.path.join(self.directory,
+                        hashlib.sha1(key.encode("utf-8")).hexdigest() + _SUFFIX)
+
+  def _lookup(self, path, fields, warn_on_error=False, stream=False):
+    """Returns (snapshot or None, key), where key describes the current
+       state of the file for _store.
+    """
+    name = self._entry_name(path, fields, warn_on_error, stream)
+    st = os.stat(path)
+    key = dict(version=SNAPSHOT_VERSION, name=name, size=st.st_size,
+               mtime=st.st_mtime, digest=None)
+    try:
+      f = open(name, "rb")
+    except IOError:
+      key["digest"] = _file_digest(path)
+      return (None, key)
+    try:
+      try:
+        stored = cPickle.load(f)
+        fresh = stored["version"] == SNAPSHOT_VERSION and \
+                stored["size"] == st.st_size
+        if fresh and stored["mtime"] != st.st_mtime:
+          # touched, but possibly not changed
+          key["digest"] = _file_digest(path)
+          fresh = stored["digest"] == key["digest"]
+        snap = None
+        if fresh:
+          snap = cPickle.load(f)
+      except Exception:
+        # unreadable or truncated entry
+        snap = None
+    finally:
+      f.close()
+    if snap is None:
+      _remove(name)
+      if key["digest"] is None:
+        key["digest"] = _file_digest(path)
+      return (None, key)
+    if stored["mtime"] != st.st_mtime:
+      self._store(key, snap)
+    else:
+      # mark as recently used
+      os.utime(name, None)
+    return (snap, key)
+
+  def _store(self, key, snap):
+    (fd, temp_name) = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+    try:
+      f = os.fdopen(fd, "wb")
+      try:
+        cPickle.dump(key, f, cPickle.HIGHEST_PROTOCOL)
+        cPickle.dump(snap, f, cPickle.HIGHEST_PROTOCOL)
+      finally:
+        f.close()
+      os.rename(temp_name, key["name"])
+    except:
+      _remove(temp_name)
+      raise
+    self._evict()
+
+  def _entries(self):
+    """Returns (name, size, last use) for all entries"""
+    entries = []
+    for name in os.listdir(self.directory):
+      if name.endswith(_SUFFIX):
+        name = os.path.join(self.directory, name)
+        try:
+          st = os.stat(name)
+        except OSError:
+          continue
+        entries.append((name, st.st_size, st.st_mtime))
+    return entries
+
+  def _evict(self):
+    entries = self._entries()
+    total = sum(size for (_, size, _) in entries)
+    entries.sort(key=lambda entry: entry[2])
+    for (name, size, _) in entries:
+      if total <= self.max_bytes:
+        break
+      _remove(name)
+      total -= size
+
+
+def _file_digest(path):
+  h = hashlib.sha1()
+  f = open(path, "rb")
+  try:
+    while True:
+      data = f.read(_HASH_BLOCK_SIZE)
+      if not data:
+        break
+      h.update(data)
+  finally:
+    f.close()
+  return h.hexdigest()
+
+def _remove(name):
+  try:
+    os.remove(name)
+  except OSError:
+    pass
+
+def default_cache():
+  """Returns the DatabaseCache in the directory named by the SIGNSTREAM_CACHE
+     environment variable (default: ~/.cache/signstream), or None if that
+     variable is set to the empty string.
+  """
+  directory = os.environ.get(CACHE_DIR_VARIABLE)
+  if directory is None:
+    directory = os.path.join(os.path.expanduser("~"), ".cache", "signstream")
+  elif directory == "":
+    return None
+  return DatabaseCache(directory)
+
+def read_xml(path, warn_on_error=False, fields=None, stats=None):
+  """Reads a SignStream database through the default cache.
+     If stats (an xmlbase.ParseStats) is given, the file is parsed with
+     statistics instead, since the cache would hide the parser.
+  """
+  cache = default_cache()
+  if cache is None or stats is not None:
+    return ss.SignStreamDatabase.read_xml(path, warn_on_error=warn_on_error,
+                                          fields=fields, stats=stats)
+  return cache.read_xml(path, warn_on_error=warn_on_error, fields=fields)
+
+def iter_utterances(path, warn_on_error=False, fields=None, stats=None):
+  """Streams the utterances of a SignStream file through the default cache,
+     or, if stats is given, straight from the parser (see read_xml)
+  """
+  cache = default_cache()
+  if cache is None or stats is not None:
+    return ss.iter_utterances(path, warn_on_error=warn_on_error, fields=fields,
+                              stats=stats)
+  return cache.iter_utterances(path, warn_on_error=warn_on_error, fields=fields)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+# Loading many SignStream files at once, in parallel.
+
+from __future__ import absolute_import
+
+import glob
+import logging
+import multiprocessing
+import os
+
+import analysis.signstream as ss
+import analysis.signstream.cache as sscache
+
+
+def expand_sources(sources):
+  """Turns a file name, directory, glob pattern, or a list of these, into
+     a list of XML file names. Directories contribute their *.xml files.
+     Each source is expanded in sorted order; duplicates are dropped.
+  """
+  if isinstance(sources, basestring):
+    sources = [sources]
+  paths = []
+  seen = set()
+  for source in sources:
+    if os.path.isdir(source):
+      expanded = sorted(glob.glob(os.path.join(source, "*.xml")))
+    elif glob.has_magic(source):
+      expanded = sorted(glob.glob(source))
+    else:
+      expanded = [source]
+    for path in expanded:
+      if path not in seen:
+        seen.add(path)
+        paths.append(path)
+  return paths
+
+
+def _file_size(path):
+  try:
+    return os.path.getsize(path)
+  except OSError:
+    return 0
+
+def _load_snapshot(args):
+  """Pool worker: parses one file and returns (index, snapshot or None,
+     error message or None). Snapshots, rather than database objects, are
+     sent back because they pickle much more cheaply.
+  """
+  (index, path, warn_on_error, fields, model_class) = args
+  try:
+    db = model_class.read_xml(path, warn_on_error=warn_on_error, fields=fields)
+    return (index, sscache.snapshot(db), None)
+  except Exception, e:
+    return (index, None, u"%s: %s" % (e.__class__.__name__, unicode(e)))
+
+
+class SignStreamCorpus(object):
+  """Represents a set of SignStream databases, each read from its own file.
+     Participants, fields and media are merged across the files, and every
+     merged entry records the file it came from.
+     Files parsed by worker processes arrive as snapshots (see
+     analysis.signstream.cache), and each is restored in this process the
+     first time its database is asked for. A restore only creates the
+     objects of the database, from packed token columns: about a third of
+     the parse time for SignStreamDatabase, and a sixth for
+     ColumnarSignStreamDatabase, whose tokens are not objects.
+  """
+
+  def __init__(self, model_class=ss.SignStreamDatabase):
+    """Constructs an empty corpus.
+       model_class is the class object for the databases that should be
+       instantiated.
+    """
+    super(SignStreamCorpus, self).__init__()
+    self.model_class = model_class
+    self.paths = []
+    self.snapshots = dict()
+    self.databases = dict()
+    self.errors = dict()
+
+  @classmethod
+  def read_xml(cls, sources, jobs=None, warn_on_error=False, fields=None,
+               model_class=ss.SignStreamDatabase):
+    """Reads a corpus from XML files.
+       sources is a file name, directory, glob pattern, or a list of these
+          (see expand_sources).
+       jobs is the number of worker processes; the default is one per CPU.
+          With jobs=1 the files are parsed in this process.
+       warn_on_error and fields are passed on to SignStreamDatabase.read_xml.
+       A file that cannot be read does not abort the others: its error is
+       logged, recorded in get_errors(), and the file is left out.
+       The workers parse into model_class too; with more than one job, the
+       databases are restored lazily (see SignStreamCorpus).
+    """
+    corpus = cls(model_class)
+    paths = expand_sources(sources)
+    if jobs is None:
+      jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(paths)))
+    if jobs == 1:
+      for path in paths:
+        try:
+          db = model_class.read_xml(path, warn_on_error=warn_on_error, fields=fields)
+        except Exception, e:
+          corpus._add_error(path, u"%s: %s" % (e.__class__.__name__, unicode(e)))
+        else:
+          corpus._add_database(path, db)
+      return corpus
+    # hand out the largest files first, so that no worker is left with a
+    # big one at the end
+    tasks = [(index, path, warn_on_error, fields, model_class)
+             for (index, path) in enumerate(paths)]
+    tasks.sort(key=lambda task: -_file_size(task[1]))
+    results = [None] * len(paths)
+    pool = multiprocessing.Pool(jobs)
+    try:
+      for (index, snap, error) in pool.imap_unordered(_load_snapshot, tasks):
+        results[index] = (snap, error)
+    finally:
+      pool.terminate()
+    for (path, (snap, error)) in zip(paths, results):
+      if error is not None:
+        corpus._add_error(path, error)
+      else:
+        corpus._add_snapshot(path, snap)
+    return corpus
+
+  def _add_database(self, path, db):
+    self.paths.append(path)
+    self.databases[path] = db
+
+  def _add_snapshot(self, path, snap):
+    # restored on first access
+    self.paths.append(path)
+    self.snapshots[path] = snap
+
+  def _add_error(self, path, message):
+    logging.getLogger("signstream").error((u"%s: %s" % (path, message)).encode("utf-8"))
+    self.errors[path] = message
+
+  def get_files(self):
+    """Returns the names of the files that were read successfully, in
+       order.
+    """
+    return list(self.paths)
+
+  def get_errors(self):
+    """Returns a dictionary from the names of the files that could not be
+       read to their error messages.
+    """
+    return dict(self.errors)
+
+  def get_database(self, path):
+    """Returns the database read from the given file"""
+    db = self.databases.get(path)
+    if db is None:
+      db = sscache.restore(self.snapshots.pop(path), self.model_class)
+      self.databases[path] = db
+    return db
+
+  def get_databases(self):
+    """Returns an iterable over (file name, database) pairs, in file order"""
+    return ((path, self.get_database(path)) for path in self.paths)
+
+  def get_participants(self):
+    """Returns an iterable over (file name, participant) pairs, covering
+       all participants of all files in order.
+    """
+    for (path, db) in self.get_databases():
+      for participant in db.get_participants():
+        yield (path, participant)
+
+  def get_media(self):
+    """Returns an iterable over (file name, media file) pairs, covering
+       all media of all files in order.
+    """
+    for (path, db) in self.get_databases():
+      for media in db.get_media():
+        yield (path, media)
+
+  def get_fields(self):
+    """Returns a list of (field, file names) pairs, ordered by field id.
+       Fields with the same id are merged, and the first file's definition
+       is returned; file names lists every file that defines the field.
+    """
+    fields = dict()
+    for (path, db) in self.get_databases():
+      for field in db.get_fields():
+        entry = fields.get(field.get_id())
+        if entry is None:
+          fields[field.get_id()] = (field, [path])
+        else:
+          entry[1].append(path)
+    return [fields[fid] for fid in sorted(fields)]
+
+  def get_field(self, field):
+    """Returns the merged field, by id or label (see get_fields)"""
+    for (path, db) in self.get_databases():
+      try:
+        return db.get_field(field)
+      except ss.InvalidField:
+        pass
+    if isinstance(field, basestring):
+      raise ss.InvalidField(field)
+    raise ss.InvalidField(unicode(field))
+
+  def join_tiers(self, left_field, right_fields):
+    """Pairs every token of left_field with the overlapping tokens of the
+       right_fields, across all files (see SignStreamDatabase.join_tiers).
+       Files that lack one of the fields are skipped.
+       Returns an iterable over (file name, left token, right token,
+       overlap in ms).
+    """
+    for (path, db) in self.get_databases():
+      try:
+        rows = db.join_tiers(left_field, right_fields)
+        for (left, right, overlap) in rows:
+          yield (path, left, right, overlap)
+      except ss.InvalidField:
+        pass
@@ -5,6 +5,12 @@
 
 from __future__ import absolute_import
 
+from array import array
+import bisect
+import difflib
+import hashlib
+import struct
+
 import analysis.xmlbase as xmlbase
 
 class SignstreamError(xmlbase.XMLException):
@@ -51,6 +57,26 @@ class InvalidField(SignstreamError):
     message = u'Field "%s" does not exist' % fieldname
     super(InvalidField, self).__init__(message)
 
+class FrozenDatabase(SignstreamError):
+  def __init__(self):
+    message = "Database is frozen and cannot be changed"
+    super(FrozenDatabase, self).__init__(message)
+
+
+class FrozenDict(dict):
+  """A dictionary that raises FrozenDatabase on every attempt to change
+     it. Holds the mappings of a frozen database.
+  """
+  __slots__ = ()
+
+  def _frozen(self, *args, **kwargs):
+    raise FrozenDatabase()
+
+  __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _frozen
+
+  def __reduce__(self):
+    return (FrozenDict, (dict(self),))
+
 
 class Participant(object):
   """Represents a participant in the annotated resources"""
@@ -75,12 +101,19 @@ class Participant(object):
     self.language = language
     self.utterances = dict()
     self.uorder = None
+    self.digest = None
     
   def _get_utterance_order(self):
     if self.uorder is None:
-      self.uorder = self.utterances.keys()
-      self.uorder.sort()
+      # sorted before it is published, for concurrent readers
+      self.uorder = sorted(self.utterances)
     return self.uorder
+
+  def _freeze(self):
+    for utterance in self.utterances.itervalues():
+      utterance._freeze()
+    self.uorder = tuple(sorted(self.utterances))
+    self.utterances = FrozenDict(self.utterances)
   
   def __unicode__(self):
     return u"%s: %s, %s user, age %s, id %d" % (self.name, self.gender, self.language,
@@ -88,16 +121,26 @@ class Participant(object):
 
   def _add_utterance(self, uid, start, end, media):
     """Adds an utterance created by this participant"""
+    self.db._check_not_frozen()
     if self.utterances.has_key(uid):
       raise DuplicateUtterance(uid, self.pid)
-    self.utterances[uid] = Utterance(uid=uid, participant=self,
-                                     start=start, end=end, media=media)
+    self.utterances[uid] = self.db.utterance_class(uid=uid, participant=self,
+                                                   start=start, end=end, media=media)
     self.uorder = None
+    self.digest = None
+
+  def _detach_utterance(self, uid):
+    """Removes an utterance from this participant and returns it"""
+    self.db._check_not_frozen()
+    utterance = self.utterances.pop(uid)
+    self.uorder = None
+    self.digest = None
+    return utterance
 
   def _add_token(self, uid, field, start, end, vid, text):
     """Adds a token for a specific field (fid) uttered by this participant"""
-    self.utterances[uid]._add_token(field=field, start=start,
-                                    end=end, vid=vid, text=text)
+    self.utterances[uid]._token_appender(field)(start, end, vid, text)
+    self.digest = None
 
   def get_utterances(self):
     """Enumerates the utterances by this person, in ID order.
@@ -153,8 +196,21 @@ class Participant(object):
     """Returns utterance by ID"""
     return self.utterances[uid]
   
+  def get_digest(self):
+    """Returns a digest (a SHA-1 as a byte string) of the participant's
+       attributes and utterances. Computed on first use, and kept until
+       the participant changes.
+    """
+    if self.digest is None:
+      self.digest = _digest([self.pid, self.name, self.label, self.age, self.gender,
+                             self.language] +
+                            [u.get_digest() for u in self.get_utterances()])
+    return self.digest
+
   def __eq__(self, other):
-    """test for self == other"""
+    """test for self == other; by digest if both sides already have one"""
+    if self.digest is not None and other.digest is not None:
+      return self.digest == other.digest
     return self.pid == other.pid and \
            self.name == other.name and \
            self.label == other.label and \
@@ -163,6 +219,13 @@ class Participant(object):
            self.language == other.language and \
            self.utterances == other.utterances
 
+  def _diff(self, other, path):
+    for d in _diff_attributes(path, self, other, ("pid", "name", "label", "age",
+                                                  "gender", "language")):
+      yield d
+    for d in _diff_children(path, "utterance", self.utterances, other.utterances):
+      yield d
+
   def __ne__(self, other):
     """test for self != other"""
     return not (self == other)
@@ -170,6 +233,9 @@ class Participant(object):
 
 class Field(object):
   """Represents a field (tier) in the annotated resources"""
+
+  # class of the value objects created by _add_value
+  value_class = None # FieldValue, set below
   
   def __init__(self, fid, name, label, constraint):
     """Creates a field.
@@ -185,12 +251,14 @@ class Field(object):
     self.constraint = constraint
     self.values = dict()
     self.vorder = None
+    self.digest = None
   
   def _add_value(self, vid, name, label=None):
     if self.values.has_key(vid):
       raise DuplicateFieldValue(self.fid, vid)
-    self.values[vid] = FieldValue(self, vid=vid, label=label, name=name)
+    self.values[vid] = self.value_class(self, vid=vid, label=label, name=name)
     self.vorder = None
+    self.digest = None
     
   def __unicode__(self):
     return u"Field %s: id %d" % (self.name, self.fid)
@@ -217,13 +285,32 @@ class Field(object):
     """
     return (self.values[vid] for vid in self._get_value_order())
 
+  def get_digest(self):
+    """Returns a digest of the field's attributes and values (see
+       Participant.get_digest)
+    """
+    if self.digest is None:
+      parts = [self.fid, self.name, self.label, self.constraint]
+      for v in self.get_values():
+        parts.extend((v.vid, v.name, v.label))
+      self.digest = _digest(parts)
+    return self.digest
+
   def __eq__(self, other):
-    """test for self == other"""
+    """test for self == other; by digest if both sides already have one"""
+    if self.digest is not None and other.digest is not None:
+      return self.digest == other.digest
     return self.fid == other.fid and \
            self.name == other.name and \
            self.label == other.label and \
            self.constraint == other.constraint and \
            self.values == other.values
+
+  def _diff(self, other, path):
+    for d in _diff_attributes(path, self, other, ("fid", "name", "label", "constraint")):
+      yield d
+    for d in _diff_children(path, "value", self.values, other.values):
+      yield d
   
   def __ne__(self, other):
     """test for self != other"""
@@ -231,13 +318,19 @@ class Field(object):
 
   def _get_value_order(self):
     if self.vorder is None:
-      self.vorder = self.values.keys()
-      self.vorder.sort()
+      self.vorder = sorted(self.values)
     return self.vorder
+
+  def _freeze(self):
+    self.vorder = tuple(sorted(self.values))
+    self.values = FrozenDict(self.values)
   
   
-class FieldValue(object):
-  """Represents a field value in the annotated resources"""
+class FieldValueBase(object):
+  """The behaviour of a field value (see FieldValue), without any
+     attributes of its own, so that subclasses can declare __slots__.
+  """
+  __slots__ = ()
   
   def __init__(self, field, vid, name, label=None):
     """Creates a field.
@@ -246,7 +339,7 @@ class FieldValue(object):
          name is the values's name.
          label is the value's shorthand label (optional for holds).
     """
-    super(FieldValue, self).__init__()
+    super(FieldValueBase, self).__init__()
     self.field = field
     self.vid = vid
     self.name = name
@@ -267,18 +360,43 @@ class FieldValue(object):
     """Returns the id of this field"""
     return self.vid
 
+  def get_digest(self):
+    """Returns a digest of the value, computed anew on every call"""
+    return _digest([self.field.get_id(), self.vid, self.name, self.label])
+
   def __eq__(self, other):
     """Test for self == other"""
     return self.field.get_id() == other.field.get_id() and \
            self.vid == other.vid and \
            self.name == other.name and \
            self.label == other.label
+
+  def _diff(self, other, path):
+    return _diff_attributes(path, self, other, ("vid", "name", "label"))
   
   def __ne_(self, other):
     """Test for self != other"""
     return not (self == other)
 
 
+class FieldValue(FieldValueBase):
+  """Represents a field value in the annotated resources"""
+
+Field.value_class = FieldValue
+
+
+class CompactFieldValue(FieldValueBase):
+  """A field value without a per-instance __dict__, which saves memory but
+     cannot take further attributes (see CompactSignStreamDatabase)
+  """
+  __slots__ = ("field", "vid", "name", "label")
+
+
+class CompactField(Field):
+  """A field whose values are CompactFieldValue objects"""
+  value_class = CompactFieldValue
+
+
 class MediaFile(object):
   """Represents a video in the annotated resources"""
   
@@ -305,22 +423,31 @@ class MediaFile(object):
     """Returns the file name of the video, w/o leading path"""
     return self.filename
 
+  def get_digest(self):
+    """Returns a digest of the media file, computed anew on every call"""
+    return _digest([self.mid, self.path])
+
   def __eq__(self, other):
     """test for self == other"""
     return self.mid == other.mid and \
            self.path == other.path
+
+  def _diff(self, other, path):
+    return _diff_attributes(path, self, other, ("mid", "path"))
   
   def __ne__(self, other):
     """test for self != other"""
     return not (self == other)
 
 
-class Utterance(object):
-  """Represents an utterance in the annotated resources.
-     NOTE: One utterance per participant only.
-     If it contains multiple participants, it must be split into one
-     utterance for each respective participant.
+class UtteranceBase(object):
+  """The behaviour of an utterance (see Utterance), without any attributes
+     of its own, so that subclasses can declare __slots__.
   """
+  __slots__ = ()
+
+  # class of the token objects created by _add_token
+  token_class = None
   
   def __init__(self, uid, participant, start, end, media):
     """Creates a new utterance.
@@ -330,7 +457,7 @@ class Utterance(object):
          end is the end of the utterance in ms
          media is a list of associated media files
     """
-    super(Utterance, self).__init__()
+    super(UtteranceBase, self).__init__()
     self.uid = uid
     self.participant = participant
     self.start = start
@@ -338,17 +465,36 @@ class Utterance(object):
     self.media = media
     self.tokens = dict()
     self.torder = None
+    self.intervals = None
+    self.digest = None
     
   def __unicode__(self):
     return u"Utterance id %d, with %s" % (self.uid, unicode(self.participant))
 
   def _add_token(self, field, start, end, vid, text):
-    fid = field.get_id()
-    if not self.tokens.has_key(fid):
-      self.tokens[fid] = []
-    self.tokens[fid].append(Token(utterance=self, field=field, start=start,
-                                  end=end, vid=vid, text=text))
-    self.torder = None
+    """Adds a single token of the given field (see _token_appender)"""
+    self._token_appender(field)(start, end, vid, text)
+
+  def _token_appender(self, field):
+    """Returns a function (start, end, vid, text) that adds a token of the
+       given field. This is where subclasses change how tokens are stored;
+       _add_token goes through it too. For loading in bulk: the token list
+       is looked up and the caches are reset here, once, so the utterance
+       must not be read until the last token is added.
+       Raises FrozenDatabase if the database is frozen.
+    """
+    self.participant.db._check_not_frozen()
+    tokens = self.tokens.get(field.fid)
+    if tokens is None:
+      tokens = self.tokens[field.fid] = []
+      self.torder = None
+    self.intervals = None
+    self.digest = None
+    append = tokens.append
+    token_class = self.token_class
+    def add(start, end, vid, text):
+      append(token_class(self, field, start, end, vid, text))
+    return add
     
   def get_id(self):
     """Returns the id of the utterance"""
@@ -362,12 +508,47 @@ class Utterance(object):
     """Returns an iterable over all tokens for the given field.
       field can be a field label or numeric id.
     """
+    return self.tokens[self._field_id(field)]
+
+  def get_interval_index(self, field):
+    """Returns an IntervalIndex over the tokens of the given field (label or
+       numeric id), for overlap queries. The index is built on first use
+       and kept until tokens are added to the utterance.
+       Raises KeyError if the field has no tokens in this utterance.
+    """
+    fid = self._field_id(field)
+    intervals = self.intervals
+    if intervals is None:
+      intervals = self.intervals = dict()
+    index = intervals.get(fid)
+    if index is None:
+      # threads that get here at the same time each build one, and one of
+      # them is kept; both are correct
+      index = IntervalIndex(self.tokens[fid])
+      intervals[fid] = index
+    return index
+
+  def join_tiers(self, left_field, right_fields):
+    """Pairs every token of left_field with the overlapping tokens of the
+       right_fields (all ids or labels), see join_tokens. Fields without
+       tokens in this utterance contribute nothing.
+       Returns an iterable over (left token, right token, overlap in ms).
+    """
+    left = self.tokens.get(self._field_id(left_field))
+    if left is None:
+      return iter(())
+    right = []
+    for field in right_fields:
+      right.extend(self.tokens.get(self._field_id(field), ()))
+    return join_tokens(left, right)
+
+  def _field_id(self, field):
     if isinstance(field, basestring):
       # field label
-      return self.tokens[self.get_participant().get_db().get_field(field).get_id()]
+      return self.participant.db._get_field_id(field)
     else:
       # numeric id
-      return self.tokens[field]
+      return field
 
   def get_timecodes(self):
     """Returns (start, end) of the utterance in milliseconds"""
@@ -390,14 +571,55 @@ class Utterance(object):
     """Returns the list of videos belonging to this utterance"""
     return self.media
 
+  def get_digest(self):
+    """Returns a digest of the utterance's attributes, media and tokens
+       (see Participant.get_digest)
+    """
+    if self.digest is None:
+      # hashed a field at a time, with the numbers packed little-endian, so
+      # that digests agree across machines, and the texts joined by NUL,
+      # which cannot occur in XML text
+      h = hashlib.sha1("%d\0%d\0%d\0%d" % (self.uid, self.participant.get_id(),
+                                            self.start, self.end))
+      for m in self.media:
+        h.update((u"\0m%d\0%s" % (m.mid, m.path)).encode("utf-8"))
+      for fid in self._get_token_field_order():
+        tokens = self.tokens[fid]
+        values = [t.standard_token for t in tokens]
+        packing = "<%di" % len(tokens)
+        h.update("\0f%d\0%d\0" % (fid, len(tokens)))
+        h.update(struct.pack(packing, *[t.start for t in tokens]))
+        h.update(struct.pack(packing, *[t.end for t in tokens]))
+        h.update(struct.pack(packing, *[-1 if v is None else v.vid for v in values]))
+        texts = [t.text for t in tokens]
+        texts.extend(u"\1" if v.label is None else v.label
+                     for v in values if v is not None)
+        h.update(u"\0".join(texts).encode("utf-8"))
+      self.digest = h.digest()
+    return self.digest
+
   def __eq__(self, other):
-    """test for self == other"""
+    """test for self == other; by digest if both sides already have one"""
+    if self.digest is not None and other.digest is not None:
+      return self.digest == other.digest
     return self.uid == other.uid and \
            self.participant.get_id() == other.participant.get_id() and \
            self.start == other.start and \
            self.end == other.end and \
            self.media == other.media and \
            self.tokens == other.tokens
+
+  def _diff(self, other, path):
+    for d in _diff_attributes(path, self, other, ("uid", "start", "end")):
+      yield d
+    (media, other_media) = ([m.mid for m in self.media], [m.mid for m in other.media])
+    if media != other_media:
+      yield (path + (("attribute", "media"),), media, other_media)
+    for fid in sorted(set(self.tokens) | set(other.tokens)):
+      mine = self.tokens.get(fid, ())
+      theirs = other.tokens.get(fid, ())
+      for d in _diff_tokens(path + (("field", fid),), list(mine), list(theirs)):
+        yield d
   
   def __ne__(self, other):
     """test for self != other"""
@@ -405,15 +627,21 @@ class Utterance(object):
 
   def _get_token_field_order(self):
     if self.torder is None:
-      self.torder = self.tokens.keys()
-      self.torder.sort()
+      self.torder = sorted(self.tokens)
     return self.torder
+
+  def _freeze(self):
+    # the token lists (or columns) stay as they are, since callers get
+    # them as lists; only _add_token changes them
+    self.torder = tuple(sorted(self.tokens))
+    self.tokens = FrozenDict(self.tokens)
   
 
-class Token(object):
-  """Represents a token uttered by a participant. Can be either
-     a standard token, or free-form text.
+class TokenBase(object):
+  """The behaviour of a token (see Token), without any attributes of its
+     own, so that subclasses can declare __slots__ or compute them.
   """
+  __slots__ = ()
   
   def __init__(self, utterance, field, start, end, vid, text):
     """Creates a new token.
@@ -424,15 +652,16 @@ class Token(object):
          vid is the ID of the standard token, or None if free-form
          text is the free-form text of the token
     """
-    super(Token, self).__init__()
-    (ustart, uend) = utterance.get_timecodes()
+    super(TokenBase, self).__init__()
+    # attributes rather than accessors: this runs once for every token
+    ustart = utterance.start
     self.utterance = utterance
     self.field = field
     self.start = ustart + start
     self.end = ustart + end
     if vid is not None:
-      self.standard_token = field[vid]
-      self.text = self.standard_token.get_name()
+      self.standard_token = field.values[vid]
+      self.text = self.standard_token.name
     else:
       self.standard_token = None
       self.text = text
@@ -498,20 +727,14 @@ class Token(object):
        as a label.
     """
     (start, end) = self.get_timecodes()
-    ptokens = []
     try:
-      for ptoken in self.get_utterance().get_tokens_for_field(field):
-        (pstart, pend) = ptoken.get_timecodes()
-        if pstart > end:
-          break
-        if _overlaps((start, end), (pstart, pend)):
-          ptokens.append(ptoken)
+      index = self.get_utterance().get_interval_index(field)
     except KeyError:
       # ignore key errors - these occur if a field is valid, but not
       # present in the annotations for this particular utterance
       # that belongs to the token.
-      pass
-    return ptokens
+      return []
+    return index.overlapping(start, end)
 
   def __eq__(self, other):
     """test for self == other"""
@@ -527,8 +750,386 @@ class Token(object):
     return not (self == other)
 
 
+class Token(TokenBase):
+  """Represents a token uttered by a participant. Can be either
+     a standard token, or free-form text.
+  """
+
+
+class CompactToken(TokenBase):
+  """A token without a per-instance __dict__, which saves memory but
+     cannot take further attributes (see CompactSignStreamDatabase)
+  """
+  __slots__ = ("utterance", "field", "start", "end", "standard_token", "text")
+
+
+class Utterance(UtteranceBase):
+  """Represents an utterance in the annotated resources.
+     NOTE: One utterance per participant only.
+     If it contains multiple participants, it must be split into one
+     utterance for each respective participant.
+  """
+  token_class = Token
+
+
+class CompactUtterance(UtteranceBase):
+  """An utterance of CompactToken objects, without a per-instance __dict__
+     (see CompactSignStreamDatabase)
+  """
+  __slots__ = ("uid", "participant", "start", "end", "media", "tokens", "torder",
+               "intervals", "digest")
+  token_class = CompactToken
+
+
+def _digest(parts):
+  """Returns the SHA-1 of a sequence of numbers, strings (byte strings,
+     such as other digests, or unicode) and Nones, as a byte string
+  """
+  out = []
+  for part in parts:
+    if part is None:
+      out.append("n")
+      continue
+    if isinstance(part, unicode):
+      part = part.encode("utf-8")
+    elif not isinstance(part, str):
+      out.append("i%s;" % part)
+      continue
+    out.append("s%d:" % len(part))
+    out.append(part)
+  return hashlib.sha1("".join(out)).digest()
+
+def _token_key(token):
+  """Returns what token equality compares, other than the utterance and
+     field, as a tuple
+  """
+  value = token.standard_token
+  if value is None:
+    return (token.start, token.end, None, None, token.text)
+  return (token.start, token.end, value.vid, value.label, token.text)
+
+def _diff_attributes(path, mine, theirs, names):
+  for name in names:
+    (a, b) = (getattr(mine, name), getattr(theirs, name))
+    if a != b:
+      yield (path + (("attribute", name),), a, b)
+
+def _diff_children(path, kind, mine, theirs):
+  """Compares two dictionaries of digestible objects by key, and descends
+     only into the pairs whose digests differ
+  """
+  for key in sorted(set(mine) | set(theirs)):
+    (a, b) = (mine.get(key), theirs.get(key))
+    child_path = path + ((kind, key),)
+    if a is None or b is None:
+      yield (child_path, a, b)
+    elif a.get_digest() != b.get_digest():
+      for d in a._diff(b, child_path):
+        yield d
+
+def _diff_tokens(path, mine, theirs):
+  """Aligns two token lists, and reports the tokens that differ, by their
+     position in the first list (or the second, for added tokens)
+  """
+  keys = [_token_key(t) for t in mine]
+  other_keys = [_token_key(t) for t in theirs]
+  matcher = difflib.SequenceMatcher(None, keys, other_keys, autojunk=False)
+  for (op, i1, i2, j1, j2) in matcher.get_opcodes():
+    if op == "equal":
+      continue
+    for k in range(max(i2 - i1, j2 - j1)):
+      (a, b) = (None, None)
+      if i1 + k < i2:
+        a = mine[i1 + k]
+      if j1 + k < j2:
+        b = theirs[j1 + k]
+      position = i1 + k if a is not None else j1 + k
+      yield (path + (("token", position),), a, b)
+
+
+class StringPool(object):
+  """Hands out one shared instance for every distinct string, so that
+     repeated token texts and value names (IX, HOLD, POSS...) are stored
+     only once, and compare by identity.
+     Unlike intern(), this also works for unicode strings.
+  """
+  __slots__ = ("strings",)
+
+  def __init__(self):
+    self.strings = dict()
+
+  def __len__(self):
+    return len(self.strings)
+
+  def intern(self, text):
+    """Returns the pooled instance of text (None is passed through)"""
+    if text is None:
+      return None
+    return self.strings.setdefault(text, text)
+
+
+class ColumnarUtterance(Utterance):
+  """An utterance that keeps its tokens in a TokenColumn per field, instead
+     of one Token object per token. Token objects are created on demand,
+     as TokenView instances, whenever the columns are indexed or iterated.
+  """
+
+  def _token_appender(self, field):
+    """Returns a function (start, end, vid, text) that adds a token of the
+       given field (see Utterance._token_appender)
+    """
+    column = self._column(field)
+    offset = self.start
+    values = field.values
+    intern = self.participant.db._intern_text
+    (starts, ends, vids, text_ids) = (column.starts.append, column.ends.append,
+                                      column.vids.append, column.text_ids.append)
+    def add(start, end, vid, text):
+      if vid is None:
+        (vid, text_id) = (-1, intern(text))
+      else:
+        values[vid] # raises KeyError for unknown values, as in Token
+        text_id = -1
+      starts(offset + start)
+      ends(offset + end)
+      vids(vid)
+      text_ids(text_id)
+    return add
+
+  def _add_token_columns(self, field, starts, ends, vids, texts):
+    """Adds the tokens of one field at once, straight into its column
+       (see SignStreamDatabase._add_token_columns)
+    """
+    column = self._column(field)
+    values = field.values
+    for vid in set(vids):
+      if vid >= 0:
+        values[vid] # raises KeyError for unknown values, as in Token
+    if texts is None:
+      text_ids = array("i", [-1]) * len(vids)
+    else:
+      intern = self.participant.db._intern_text
+      text_ids = array("i", [intern(text) if vid < 0 else -1
+                             for (vid, text) in zip(vids, texts)])
+    column.starts.extend(starts)
+    column.ends.extend(ends)
+    column.vids.extend(vids)
+    column.text_ids.extend(text_ids)
+
+  def _column(self, field):
+    # appending may move the column arrays, which frames.timecodes exposes
+    # without copying
+    self.participant.db._check_not_frozen()
+    column = self.tokens.get(field.fid)
+    if column is None:
+      column = self.tokens[field.fid] = TokenColumn(self, field)
+      self.torder = None
+    self.intervals = None
+    self.digest = None
+    return column
+
+
+class TokenColumn(object):
+  """The tokens of one field in one utterance, stored as parallel integer
+     arrays: absolute start and end in ms, value id (-1 for free-form text)
+     and text id (an index into the database's string table, -1 for
+     standard tokens).
+     Behaves like a read-only list of Token objects.
+  """
+  __slots__ = ("utterance", "field", "strings", "starts", "ends", "vids",
+               "text_ids")
+
+  def __init__(self, utterance, field):
+    self.utterance = utterance
+    self.field = field
+    self.strings = utterance.get_participant().get_db().strings
+    self.starts = array("i")
+    self.ends = array("i")
+    self.vids = array("i")
+    self.text_ids = array("i")
+
+  def __len__(self):
+    return len(self.starts)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [TokenView(self, i) for i in xrange(*index.indices(len(self)))]
+    if index < 0:
+      index += len(self)
+    if index < 0 or index >= len(self):
+      raise IndexError(index)
+    return TokenView(self, index)
+
+  def __iter__(self):
+    for i in xrange(len(self.starts)):
+      yield TokenView(self, i)
+
+  def __eq__(self, other):
+    """test for self == other, against another column or a token list"""
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    """test for self != other"""
+    return not (self == other)
+
+
+class TokenView(TokenBase):
+  """A token that lives in a TokenColumn. It only stores the column and its
+     position, and reads everything else from the column's arrays.
+  """
+  __slots__ = ("column", "index")
+
+  def __init__(self, column, index):
+    self.column = column
+    self.index = index
+
+  @property
+  def utterance(self):
+    return self.column.utterance
+
+  @property
+  def field(self):
+    return self.column.field
+
+  @property
+  def start(self):
+    return self.column.starts[self.index]
+
+  @property
+  def end(self):
+    return self.column.ends[self.index]
+
+  @property
+  def standard_token(self):
+    vid = self.column.vids[self.index]
+    if vid < 0:
+      return None
+    return self.column.field[vid]
+
+  @property
+  def text(self):
+    vid = self.column.vids[self.index]
+    if vid < 0:
+      return self.column.strings[self.column.text_ids[self.index]]
+    return self.column.field[vid].get_name()
+
+
+class IntervalIndex(object):
+  """Answers overlap queries over a sequence of tokens.
+     The tokens are sorted by start time, and a sparse table over their end
+     times gives the token with the latest end in any range of positions in
+     O(1). A query first bisects to the tokens that start before the end of
+     the query interval, and then repeatedly takes the latest-ending token
+     of a range, reports it if it ends after the start of the query, and
+     splits the range around it. Every range that is split yields a hit, so
+     a query takes O(log n + k) for k results.
+     Intervals are half-open: a token overlaps [start, end) if it starts
+     before end and ends after start, which includes tokens that contain
+     the query interval and tokens that it contains.
+  """
+  __slots__ = ("tokens", "order", "starts", "ends", "table")
+
+  def __init__(self, tokens):
+    """Builds the index over tokens, a list of Token objects (or a
+       TokenColumn).
+    """
+    timecodes = [t.get_timecodes() for t in tokens]
+    order = sorted(xrange(len(timecodes)), key=timecodes.__getitem__)
+    self.tokens = tokens
+    self.order = order
+    self.starts = [timecodes[i][0] for i in order]
+    ends = [timecodes[i][1] for i in order]
+    self.ends = ends
+    # table[j][i] is the position of the latest end among the 2**j
+    # positions starting at i
+    level = range(len(ends))
+    table = [level]
+    width = 1
+    while 2 * width <= len(ends):
+      prev = level
+      level = [a if ends[a] >= ends[b] else b
+               for (a, b) in zip(prev, prev[width:])]
+      table.append(level)
+      width *= 2
+    self.table = table
+
+  def __len__(self):
+    return len(self.order)
+
+  def overlapping(self, start, end):
+    """Returns the tokens that overlap the interval [start, end), in order
+       of their start time. An empty interval (start == end) is treated as
+       the point start.
+    """
+    if end <= start:
+      return self.at(start)
+    return self._query(bisect.bisect_left(self.starts, end), start)
+
+  def at(self, time):
+    """Returns the tokens that are in progress at the given time, i.e.
+       start <= time < end, in order of their start time.
+    """
+    return self._query(bisect.bisect_right(self.starts, time), time)
+
+  def _query(self, limit, after):
+    # all tokens among positions [0, limit) that end after "after"
+    ends = self.ends
+    table = self.table
+    hits = []
+    ranges = [(0, limit)]
+    while ranges:
+      (lo, hi) = ranges.pop()
+      if lo >= hi:
+        continue
+      j = (hi - lo).bit_length() - 1
+      a = table[j][lo]
+      b = table[j][hi - (1 << j)]
+      latest = a if ends[a] >= ends[b] else b
+      if ends[latest] <= after:
+        continue
+      hits.append(latest)
+      ranges.append((lo, latest))
+      ranges.append((latest + 1, hi))
+    hits.sort()
+    tokens = self.tokens
+    order = self.order
+    return [tokens[order[pos]] for pos in hits]
+
+
+def join_tokens(left, right):
+  """Finds all overlapping pairs between two sequences of tokens with a
+     single sweep over their start times, keeping the tokens of each side
+     that are still in progress. Every token either pairs with all of the
+     other side's tokens in progress when it starts, or is dropped from them
+     once, so this takes O(n log n + k) for n tokens and k pairs.
+     Returns an iterable over (left token, right token, overlap in ms),
+     ordered by the start of the later token of each pair. Intervals are
+     half-open, so empty tokens never overlap anything.
+  """
+  events = []
+  for (side, tokens) in ((0, left), (1, right)):
+    for token in tokens:
+      (start, end) = token.get_timecodes()
+      if end > start:
+        events.append((start, side, end, token))
+  events.sort(key=lambda event: event[:2])
+  in_progress = ([], [])
+  for (start, side, end, token) in events:
+    others = in_progress[1 - side]
+    if others:
+      others[:] = [other for other in others if other[0] > start]
+      for (other_end, other) in others:
+        # the other token started first, so the overlap begins here
+        overlap = min(end, other_end) - start
+        if side == 0:
+          yield (token, other, overlap)
+        else:
+          yield (other, token, overlap)
+    in_progress[side].append((end, token))
+
+
 def _overlaps((s1, e1), (s2, e2)):
-  return (s1 >= s2 and s1 < e2) or (e1 > s2 and e1 <= e2)
+  return s1 < e2 and s2 < e1
 
 def _make_slice(obj, fps):
     (start, end) = obj.get_timecodes()
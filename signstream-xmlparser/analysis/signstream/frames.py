@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+# Frame-aligned access to per-video feature arrays (motion capture, video
+# features, ...), in batches, and dense per-frame label matrices of the
+# annotation tiers. Needs numpy.
+
+from __future__ import absolute_import
+
+from array import array
+import json
+import os
+
+import numpy as np
+
+from analysis.signstream.dom import InvalidField, TokenColumn, UtteranceBase
+
+# label of a frame that no standard token of the field covers
+NO_VALUE = -1
+
+DEFAULT_CHUNK_FRAMES = 65536
+
+
+def timecodes(tokens):
+  """Returns the (start, end) timecodes of a sequence of tokens, in ms, as
+     two integer arrays. For the token columns of a columnar database the
+     arrays share memory with the column.
+  """
+  if isinstance(tokens, TokenColumn):
+    return (np.frombuffer(tokens.starts, dtype=np.intc),
+            np.frombuffer(tokens.ends, dtype=np.intc))
+  codes = [t.get_timecodes() for t in tokens]
+  if not codes:
+    return (np.zeros(0, dtype=np.intc), np.zeros(0, dtype=np.intc))
+  codes = np.array(codes, dtype=np.intc)
+  return (codes[:, 0], codes[:, 1])
+
+def _frame(ms, fps):
+  # the same as int(round(ms / 1000.0 * fps)) in Token.slice: halves are
+  # rounded away from zero, not to even as np.round does
+  x = ms / 1000.0 * fps
+  return (np.sign(x) * np.floor(np.abs(x) + 0.5)).astype(np.int64)
+
+def frame_ranges(tokens, fps):
+  """Returns the frames that overlap each of a sequence of tokens (or
+     utterances), at the given frame rate, as two integer arrays (starts,
+     stops): token i covers frames starts[i]:stops[i], exactly as
+     tokens[i].slice(fps) does.
+  """
+  (starts, ends) = timecodes(tokens)
+  # the end frame is included, whereas python slices exclude it
+  return (_frame(starts, fps), _frame(ends, fps) + 1)
+
+def field_frame_ranges(utterances, field, fps):
+  """Returns the frames that overlap each token of a field, across many
+     utterances, in one go: three integer arrays (starts, stops, offsets),
+     where the tokens of the i-th utterance are numbers offsets[i] to
+     offsets[i + 1] - 1, and token j covers frames starts[j]:stops[j].
+     field is a field label or id; utterances without tokens of that field
+     have none.
+  """
+  ids = dict()
+  starts = array("i")
+  ends = array("i")
+  offsets = array("l", [0])
+  for utterance in utterances:
+    db = utterance.get_participant().get_db()
+    fid = ids.get(db)
+    if fid is None:
+      fid = ids[db] = db.get_field(field).get_id()
+    tokens = utterance.tokens.get(fid, ())
+    if isinstance(tokens, TokenColumn):
+      starts.extend(tokens.starts)
+      ends.extend(tokens.ends)
+    else:
+      for token in tokens:
+        (start, end) = token.get_timecodes()
+        starts.append(start)
+        ends.append(end)
+    offsets.append(len(starts))
+  starts = np.frombuffer(starts, dtype=np.intc)
+  ends = np.frombuffer(ends, dtype=np.intc)
+  return (_frame(starts, fps), _frame(ends, fps) + 1,
+          np.frombuffer(offsets, dtype=np.int_))
+
+
+class FeatureStore(object):
+  """Per-video feature arrays on disk, one .npy file per media file, whose
+     first axis is the frame. The arrays are memory-mapped on first use,
+     and windows of them come back as views, without copying or reading
+     more than the frames touched.
+  """
+
+  def __init__(self, directory, fps, locate=None):
+    """Creates a store over the .npy files in directory.
+       fps is the frame rate of the arrays.
+       locate, if given, maps a MediaFile to the name of its array file
+          (relative to directory); by default, the video's file name with
+          its extension replaced by .npy.
+    """
+    super(FeatureStore, self).__init__()
+    self.directory = directory
+    self.fps = fps
+    self.locate = locate
+    self.arrays = dict()
+
+  def get_path(self, media):
+    """Returns the name of the array file of a media file"""
+    if self.locate is not None:
+      name = self.locate(media)
+    else:
+      name = os.path.splitext(media.get_filename())[0] + ".npy"
+    return os.path.join(self.directory, name)
+
+  def get_array(self, media):
+    """Returns the memory-mapped feature array of a media file (a
+       read-only numpy.memmap). Raises IOError if it has no array file.
+    """
+    # by file, since media ids are only unique within one database
+    path = self.get_path(media)
+    array = self.arrays.get(path)
+    if array is None:
+      array = np.load(path, mmap_mode="r")
+      self.arrays[path] = array
+    return array
+
+  def windows(self, tokens, media):
+    """Returns the feature windows of a sequence of tokens in the array of
+       the given media file, as a list of views. Windows that reach past
+       the end of the array are cut short, as with slices.
+    """
+    array = self.get_array(media)
+    (starts, stops) = frame_ranges(tokens, self.fps)
+    return [array[start:stop] for (start, stop) in zip(starts.tolist(), stops.tolist())]
+
+  def window(self, token, media=None):
+    """Returns the feature window of one token (or utterance) as a view.
+       media defaults to the first video of the token's utterance.
+    """
+    if media is None:
+      utterance = token if isinstance(token, UtteranceBase) else token.get_utterance()
+      media = utterance.get_media()[0]
+    return self.get_array(media)[token.slice(self.fps)]
+
+
+def text_vocabulary(utterances, fields):
+  """Returns the sorted list of the distinct (field, text) pairs of the
+     free-text tokens of the given fields in the utterances; field is the
+     entry of fields (label or id) that the token belongs to. Its
+     positions are the columns of the multi-hot text matrices.
+  """
+  pairs = set()
+  for utterance in utterances:
+    db = utterance.get_participant().get_db()
+    for field in fields:
+      try:
+        tokens = utterance.tokens.get(db.get_field(field).get_id(), ())
+      except InvalidField:
+        continue
+      for token in tokens:
+        if not token.is_standard():
+          pairs.add((field, token.get_text()))
+  return sorted(pairs)
+
+def _intervals(utterances, fields, fps, columns):
+  """Returns the tokens of the fields in the utterances as arrays (starts,
+     stops, field columns, value ids, text columns): absolute frame
+     ranges, the index of the token's field in fields, the value id of
+     standard tokens (NO_VALUE otherwise) and the vocabulary column of
+     free-text ones (-1 otherwise, and for texts not in columns). The
+     tokens of each field come in their order within the utterances.
+  """
+  tokens = []
+  field_columns = []
+  for (column, field) in enumerate(fields):
+    count = len(tokens)
+    for utterance in utterances:
+      try:
+        fid = utterance.get_participant().get_db().get_field(field).get_id()
+      except InvalidField:
+        continue
+      tokens.extend(utterance.tokens.get(fid, ()))
+    field_columns.append(np.repeat(column, len(tokens) - count))
+  (starts, stops) = frame_ranges(tokens, fps)
+  field_columns = np.concatenate(field_columns + [np.zeros(0, dtype=np.int_)])
+  vids = []
+  cols = []
+  for (column, token) in zip(field_columns.tolist(), tokens):
+    if token.is_standard():
+      vids.append(token.get_field_value().get_id())
+      cols.append(-1)
+    else:
+      vids.append(NO_VALUE)
+      cols.append(columns.get((fields[column], token.get_text()), -1))
+  return (starts, stops, field_columns, np.array(vids, dtype=np.int32),
+          np.array(cols, dtype=np.int64))
+
+def _fill(labels, texts, intervals, first):
+  """Writes the intervals into labels, and into texts if given, for the
+     frames first to first + len(labels) - 1, with vectorized writes.
+     Where tokens of a field overlap, the later one wins.
+  """
+  (starts, stops, fcols, vids, cols) = intervals
+  count = labels.shape[0]
+  starts = np.clip(starts - first, 0, count)
+  lengths = np.maximum(np.clip(stops - first, 0, count) - starts, 0)
+  # the frame numbers covered by all intervals, one after the other
+  ends = np.cumsum(lengths)
+  frames = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - lengths), lengths)
+  values = np.repeat(vids, lengths)
+  standard = values != NO_VALUE
+  # keep the last write to each cell
+  cells = (frames * labels.shape[1] + np.repeat(fcols, lengths))[standard][::-1]
+  (unique, last) = np.unique(cells, return_index=True)
+  labels.ravel()[unique] = values[standard][::-1][last]
+  if texts is not None:
+    cols = np.repeat(cols, lengths)
+    hot = cols >= 0
+    texts[frames[hot], cols[hot]] = True
+
+def media_labels(utterances, fields, fps, start, stop, vocabulary=None):
+  """Returns the label matrices of frames start to stop - 1, over the
+     given utterances (those of one video): (labels, texts), where labels
+     is a frames x fields matrix of the value ids of the standard tokens
+     that cover each frame (NO_VALUE where there are none), and texts is
+     a frames x len(vocabulary) boolean matrix that marks the free-text
+     tokens covering each frame (see text_vocabulary), or None without a
+     vocabulary.
+  """
+  columns = dict((pair, i) for (i, pair) in enumerate(vocabulary or ()))
+  labels = np.empty((stop - start, len(fields)), dtype=np.int32)
+  labels.fill(NO_VALUE)
+  texts = None
+  if vocabulary is not None:
+    texts = np.zeros((stop - start, len(vocabulary)), dtype=np.bool_)
+  _fill(labels, texts, _intervals(utterances, fields, fps, columns), start)
+  return (labels, texts)
+
+def utterance_labels(utterance, fields, fps, vocabulary=None):
+  """Returns the label matrices (see media_labels) of the frames of one
+     utterance, those of utterance.slice(fps).
+  """
+  frames = utterance.slice(fps)
+  return media_labels([utterance], fields, fps, frames.start, frames.stop, vocabulary)
+
+def export_labels(databases, fields, fps, directory, chunk_frames=DEFAULT_CHUNK_FRAMES,
+                  multi_hot=True, vocabulary=None):
+  """Writes the label matrices (see media_labels) of every video of the
+     databases to directory, which is created if needed, in .npy files of
+     at most chunk_frames frames each, which can be opened with
+     numpy.load(..., mmap_mode="r"). Frames are counted from the start of
+     the video, and the matrices run from the first to the last frame of
+     its utterances. Only one chunk is held in memory at a time.
+     multi_hot also writes the text matrices, over the given vocabulary,
+     or else that of all the databases. With a large vocabulary these take
+     one byte per frame and text: the main gloss of the NCSLGR corpus
+     comes to over 1 GB at 30 fps.
+     Writes and returns the index of the files, a JSON-compatible dict
+     (written to index.json) with the fps, fields, no_value, vocabulary,
+     values, and, for each video, its name, media id, source index (into
+     databases), first frame and number of frames, and its chunks: first
+     frame, number of frames, labels file and texts file.
+     values holds, for each field, a dict from value id (as a string, as
+     JSON has it) to label, or None for values without one. Where the
+     databases define a value differently, the first one counts.
+  """
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  databases = list(databases)
+  videos = []
+  for (source, db) in enumerate(databases):
+    by_media = dict()
+    for participant in db.get_participants():
+      for utterance in participant.get_utterances():
+        for media in utterance.get_media():
+          by_media.setdefault(media.get_id(), []).append(utterance)
+    for media in db.get_media():
+      videos.append((source, media, by_media.get(media.get_id(), [])))
+  if not multi_hot:
+    vocabulary = None
+  elif vocabulary is None:
+    vocabulary = text_vocabulary([u for (_, _, us) in videos for u in us], fields)
+  values = [dict() for _ in fields]
+  for db in databases:
+    for (labels, field) in zip(values, fields):
+      try:
+        field_values = db.get_field(field).get_values()
+      except InvalidField:
+        continue
+      for value in field_values:
+        labels.setdefault(str(value.get_id()), value.get_label())
+  index = dict(fps=fps, fields=list(fields), no_value=NO_VALUE,
+               vocabulary=[list(pair) for pair in vocabulary or ()],
+               values=values, media=[])
+  names = set()
+  for (source, media, utterances) in videos:
+    name = os.path.splitext(media.get_filename())[0]
+    (base, n) = (name, 1)
+    while name in names:
+      n += 1
+      name = "%s.%d" % (base, n)
+    names.add(name)
+    slices = [u.slice(fps) for u in utterances]
+    start = min([sl.start for sl in slices] or [0])
+    stop = max([sl.stop for sl in slices] or [0])
+    entry = dict(name=name, media=media.get_id(), source=source, start=start,
+                 frames=stop - start, chunks=[])
+    for (k, first) in enumerate(range(start, stop, chunk_frames)):
+      last = min(stop, first + chunk_frames)
+      (labels, texts) = media_labels(utterances, fields, fps, first, last, vocabulary)
+      chunk = dict(start=first, frames=last - first,
+                   labels="%s.labels.%d.npy" % (name, k), texts=None)
+      np.save(os.path.join(directory, chunk["labels"]), labels)
+      if texts is not None:
+        chunk["texts"] = "%s.texts.%d.npy" % (name, k)
+        np.save(os.path.join(directory, chunk["texts"]), texts)
+      entry["chunks"].append(chunk)
+    index["media"].append(entry)
+  with open(os.path.join(directory, "index.json"), "w") as f:
+    json.dump(index, f, indent=1, sort_keys=True)
+  return index
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+# Persistent inverted index from gloss text to the tokens that carry it,
+# across any number of SignStream files, so that searches do not have to
+# read the XML.
+
+from __future__ import absolute_import
+
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import unicodedata
+
+import analysis.signstream as ss
+from analysis.signstream.cache import _file_digest
+from analysis.signstream.corpus import expand_sources, _file_size
+
+# Bump whenever the table layout changes; an index with another version is
+# emptied and built again.
+INDEX_VERSION = "1"
+
+_SCHEMA = [
+  "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+  "CREATE TABLE IF NOT EXISTS files (file INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, "
+  "size INTEGER NOT NULL, mtime REAL NOT NULL, digest TEXT NOT NULL)",
+  "CREATE TABLE IF NOT EXISTS glosses (gloss INTEGER PRIMARY KEY, norm TEXT UNIQUE NOT NULL)",
+  "CREATE TABLE IF NOT EXISTS postings (gloss INTEGER NOT NULL, file INTEGER NOT NULL, "
+  "participant INTEGER NOT NULL, utterance INTEGER NOT NULL, position INTEGER NOT NULL, "
+  "start INTEGER NOT NULL, end INTEGER NOT NULL, text TEXT NOT NULL)",
+  "CREATE INDEX IF NOT EXISTS postings_gloss ON postings (gloss)",
+  "CREATE INDEX IF NOT EXISTS postings_token ON postings (file, participant, utterance, position)",
+]
+
+_TABLES = ["meta", "files", "glosses", "postings"]
+
+_OCCURRENCE = ("SELECT files.path, p0.participant, p0.utterance, p0.position, "
+               "p0.start, %(end)s, %(text)s FROM postings AS p0 %(joins)s"
+               "JOIN files ON files.file = p0.file WHERE %(where)s "
+               "ORDER BY files.path, p0.participant, p0.utterance, p0.position")
+
+
+def normalize_gloss(text):
+  """Returns the form of a gloss that the index matches on: Unicode NFC,
+     with surrounding white space removed, inner white space collapsed to
+     single blanks, and upper case.
+  """
+  return u" ".join(unicodedata.normalize("NFC", unicode(text)).split()).upper()
+
+
+def _index_file(args):
+  """Pool worker: reads the tokens of one field from one file, and returns
+     (path, list of (participant, utterance, position, start, end, text),
+     error message or None).
+  """
+  (path, field) = args
+  rows = []
+  try:
+    try:
+      ss.read_header(path).get_field(field)
+    except ss.InvalidField:
+      # a file whose coding scheme lacks the field has nothing to index
+      return (path, [], None)
+    for utterance in ss.iter_utterances(path, fields=[field]):
+      try:
+        tokens = utterance.get_tokens_for_field(field)
+      except KeyError:
+        continue
+      pid = utterance.get_participant().get_id()
+      uid = utterance.get_id()
+      for (position, token) in enumerate(tokens):
+        (start, end) = token.get_timecodes()
+        rows.append((pid, uid, position, start, end, token.get_text()))
+  except Exception, e:
+    return (path, None, u"%s: %s" % (e.__class__.__name__, unicode(e)))
+  return (path, rows, None)
+
+
+class GlossIndex(object):
+  """An inverted index over the tokens of one field (by default the main
+     gloss), kept in an SQLite file. For every normalized gloss (see
+     normalize_gloss) it lists the occurrences: file, participant id,
+     utterance id, position of the token within the utterance's tokens of
+     the field, and the token's start and end.
+     Queries return lists of (file name, participant id, utterance id,
+     position, start, end, text) tuples, ordered by file, participant,
+     utterance and position. Phrase matches give the start of their first
+     and the end of their last token, and their texts joined by blanks.
+  """
+
+  def __init__(self, path, field="main gloss"):
+    """Opens the index in the given file, which is created if needed.
+       field is the label of the field to index. Raises ValueError if the
+       file holds an index of another field.
+    """
+    super(GlossIndex, self).__init__()
+    self.path = path
+    self.field = field
+    self.connection = sqlite3.connect(path)
+    self.connection.create_function("REGEXP", 2, _regexp)
+    with self.connection:
+      for statement in _SCHEMA:
+        self.connection.execute(statement)
+      meta = dict(self.connection.execute("SELECT key, value FROM meta"))
+      if meta.get("version") != INDEX_VERSION:
+        for table in _TABLES:
+          self.connection.execute("DELETE FROM %s" % table)
+        self.connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                    [("version", INDEX_VERSION), ("field", field)])
+      elif meta["field"] != field:
+        raise ValueError(u"%s indexes the field %s, not %s" % (path, meta["field"], field))
+
+  def update(self, sources, jobs=None):
+    """Brings the index up to date with the given files, and drops the files
+       that no longer exist.
+       sources is a file name, directory, glob pattern, or a list of these
+          (see analysis.signstream.corpus.expand_sources).
+       jobs is the number of worker processes; the default is one per CPU.
+          With jobs=1 the files are read in this process.
+       A file is read again only if its size or modification time changed,
+       and its content hash along with them. A file that cannot be read is
+       logged and left as it was.
+       Returns (names of the files (re)indexed, names of the files dropped,
+       dictionary from the names of unreadable files to error messages).
+    """
+    stale = []
+    errors = dict()
+    for path in expand_sources(sources):
+      path = os.path.abspath(path)
+      try:
+        st = os.stat(path)
+      except OSError, e:
+        self._add_error(errors, path, u"%s: %s" % (e.__class__.__name__, unicode(e)))
+        continue
+      row = self.connection.execute("SELECT size, mtime, digest FROM files WHERE path = ?",
+                                    (path,)).fetchone()
+      if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+        continue
+      digest = _file_digest(path)
+      if row is not None and row[2] == digest:
+        # touched, but not changed
+        with self.connection:
+          self.connection.execute("UPDATE files SET size = ?, mtime = ? WHERE path = ?",
+                                  (st.st_size, st.st_mtime, path))
+        continue
+      stale.append((path, st, digest))
+    removed = [path for (path,) in self.connection.execute("SELECT path FROM files")
+               if not os.path.exists(path)]
+    with self.connection:
+      for path in removed:
+        self._remove_file(path)
+    indexed = []
+    states = dict((path, (st, digest)) for (path, st, digest) in stale)
+    for (path, rows, error) in self._read_files([path for (path, _, _) in stale], jobs):
+      if error is not None:
+        self._add_error(errors, path, error)
+        continue
+      (st, digest) = states[path]
+      with self.connection:
+        self._remove_file(path)
+        self._add_file(path, st, digest, rows)
+      indexed.append(path)
+    if removed or indexed:
+      with self.connection:
+        self.connection.execute("DELETE FROM glosses WHERE gloss NOT IN "
+                                "(SELECT DISTINCT gloss FROM postings)")
+    return (sorted(indexed), removed, errors)
+
+  def _read_files(self, paths, jobs):
+    """Returns an iterable over the results of _index_file for the given
+       files, in no particular order.
+    """
+    if jobs is None:
+      jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(paths)))
+    tasks = [(path, self.field) for path in paths]
+    if jobs == 1:
+      for task in tasks:
+        yield _index_file(task)
+      return
+    # largest files first, as in SignStreamCorpus.read_xml
+    tasks.sort(key=lambda task: -_file_size(task[0]))
+    pool = multiprocessing.Pool(jobs)
+    try:
+      for result in pool.imap_unordered(_index_file, tasks):
+        yield result
+    finally:
+      pool.terminate()
+
+  def _add_error(self, errors, path, message):
+    logging.getLogger("signstream").error((u"%s: %s" % (path, message)).encode("utf-8"))
+    errors[path] = message
+
+  def _remove_file(self, path):
+    row = self.connection.execute("SELECT file FROM files WHERE path = ?", (path,)).fetchone()
+    if row is not None:
+      self.connection.execute("DELETE FROM postings WHERE file = ?", row)
+      self.connection.execute("DELETE FROM files WHERE file = ?", row)
+
+  def _add_file(self, path, st, digest, rows):
+    cursor = self.connection.execute(
+      "INSERT INTO files (path, size, mtime, digest) VALUES (?, ?, ?, ?)",
+      (path, st.st_size, st.st_mtime, digest))
+    file_id = cursor.lastrowid
+    glosses = dict()
+    postings = []
+    for (pid, uid, position, start, end, text) in rows:
+      norm = normalize_gloss(text)
+      gloss = glosses.get(norm)
+      if gloss is None:
+        gloss = self._gloss_id(norm)
+        glosses[norm] = gloss
+      postings.append((gloss, file_id, pid, uid, position, start, end, text))
+    self.connection.executemany(
+      "INSERT INTO postings (gloss, file, participant, utterance, position, start, end, text) "
+      "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", postings)
+
+  def _gloss_id(self, norm):
+    row = self.connection.execute("SELECT gloss FROM glosses WHERE norm = ?",
+                                  (norm,)).fetchone()
+    if row is not None:
+      return row[0]
+    return self.connection.execute("INSERT INTO glosses (norm) VALUES (?)",
+                                   (norm,)).lastrowid
+
+  def get_files(self):
+    """Returns the names of the indexed files, sorted"""
+    return [path for (path,) in
+            self.connection.execute("SELECT path FROM files ORDER BY path")]
+
+  def get_glosses(self):
+    """Returns a list of (normalized gloss, number of occurrences) pairs,
+       sorted by gloss.
+    """
+    return self.connection.execute(
+      "SELECT glosses.norm, COUNT(*) FROM glosses JOIN postings "
+      "ON postings.gloss = glosses.gloss GROUP BY glosses.gloss "
+      "ORDER BY glosses.norm").fetchall()
+
+  def lookup(self, gloss):
+    """Returns the occurrences of the given gloss"""
+    return self._query("p0.gloss IN (SELECT gloss FROM glosses WHERE norm = ?)",
+                       [normalize_gloss(gloss)])
+
+  def prefix(self, prefix):
+    """Returns the occurrences of the glosses that start with prefix"""
+    prefix = normalize_gloss(prefix)
+    if not prefix:
+      return self._query("1", [])
+    # a range over the unique index on norm, rather than LIKE, which
+    # neither uses the index nor treats _ and % literally. SQLite compares
+    # the UTF-8 bytes, which sort like the code points.
+    bound = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+    return self._query("p0.gloss IN (SELECT gloss FROM glosses "
+                       "WHERE norm >= ? AND norm < ?)", [prefix, bound])
+
+  def regex(self, pattern):
+    """Returns the occurrences of the glosses that the regular expression
+       pattern matches (with re.search, ignoring case). The expression is
+       matched against the normalized glosses, once per distinct gloss.
+    """
+    re.compile(pattern)
+    return self._query("p0.gloss IN (SELECT gloss FROM glosses WHERE norm REGEXP ?)",
+                       [pattern])
+
+  def phrase(self, glosses):
+    """Returns the occurrences of a sequence of glosses: tokens with these
+       glosses at consecutive positions in one utterance.
+       glosses is a list of glosses, or a string of glosses separated by
+       blanks.
+    """
+    if isinstance(glosses, basestring):
+      glosses = glosses.split()
+    glosses = [normalize_gloss(g) for g in glosses]
+    if not glosses:
+      return []
+    joins = []
+    where = []
+    for i in range(1, len(glosses)):
+      joins.append("JOIN postings AS p%d ON p%d.file = p0.file AND "
+                   "p%d.participant = p0.participant AND p%d.utterance = p0.utterance "
+                   "AND p%d.position = p0.position + %d " % (i, i, i, i, i, i))
+    for i in range(len(glosses)):
+      where.append("p%d.gloss IN (SELECT gloss FROM glosses WHERE norm = ?)" % i)
+    last = len(glosses) - 1
+    text = " || ' ' || ".join("p%d.text" % i for i in range(len(glosses)))
+    sql = _OCCURRENCE % dict(end="p%d.end" % last, text=text, joins="".join(joins),
+                             where=" AND ".join(where))
+    return self.connection.execute(sql, glosses).fetchall()
+
+  def _query(self, where, parameters):
+    sql = _OCCURRENCE % dict(end="p0.end", text="p0.text", joins="", where=where)
+    return self.connection.execute(sql, parameters).fetchall()
+
+  def close(self):
+    self.connection.close()
+
+
+_REGEX_CACHE = dict()
+
+def _regexp(pattern, text):
+  regex = _REGEX_CACHE.get(pattern)
+  if regex is None:
+    regex = re.compile(pattern, re.IGNORECASE | re.UNICODE)
+    _REGEX_CACHE[pattern] = regex
+  return regex.search(text) is not None
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+# Generator for synthetic SignStream XML files of any size, for scale testing.
+
+from __future__ import absolute_import
+
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+MAIN_GLOSS_FID = 10000
+HOLD_VID = 400000
+
+# First field id of the generated non-manual tiers
+_TIER_FID = 1
+# Number of values defined for each non-manual tier
+_TIER_VALUES = 4
+
+
+class SyntheticProfile(object):
+  """The distributions that synthetic utterances are drawn from. Each one is
+     a list of observed values (in ms, except for lengths and glosses), and
+     sampling picks one of them uniformly.
+       lengths: signs per utterance, HOLDs not counted
+       signs: sign durations
+       pauses: pauses between signs, after merging HOLDs
+       holds: how far a HOLD extends its sign
+       leads, tails: time before the first and after the last sign
+       glosses: main gloss texts
+       hold_rate: fraction of signs followed by a HOLD
+  """
+
+  def __init__(self, lengths, signs, pauses, holds, leads, tails, glosses,
+               hold_rate):
+    super(SyntheticProfile, self).__init__()
+    self.lengths = list(lengths)
+    self.signs = list(signs)
+    self.pauses = list(pauses)
+    self.holds = list(holds)
+    self.leads = list(leads)
+    self.tails = list(tails)
+    self.glosses = list(glosses)
+    self.hold_rate = hold_rate
+
+  @classmethod
+  def default(cls):
+    """Returns a profile made of the 2.5%, 7.5%, ..., 97.5% quantiles of
+       the bundled NCSLGR corpus, and its most frequent glosses.
+    """
+    return cls(
+      lengths=[2, 3, 3, 4, 4, 4, 5, 5, 5, 5, 6, 6, 6, 7, 7, 8, 9, 10, 11, 16],
+      signs=[33, 66, 67, 100, 100, 100, 133, 134, 167, 200, 200, 233, 266, 300,
+             333, 367, 433, 500, 633, 933],
+      pauses=[33, 66, 67, 67, 100, 100, 100, 100, 133, 133, 134, 166, 167, 167,
+              200, 200, 233, 267, 333, 500],
+      holds=[33, 66, 67, 100, 111, 133, 134, 167, 200, 233, 266, 300, 333, 367,
+             433, 467, 567, 666, 800, 1133],
+      leads=[0, 33, 66, 67, 100, 100, 100, 133, 134, 167, 200, 200, 233, 266,
+             300, 333, 367, 433, 519, 833],
+      tails=[0, 0, 0, 0, 0, 0, 33, 67, 133, 167, 200, 266, 300, 333, 367, 400,
+             434, 500, 567, 834],
+      glosses=[u"IX-1p", u"fs-JOHN", u"REALLY", u"IX-3p:i", u"part:indef",
+               u"BOOK", u"BUY", u"NOT", u"CAR", u"FINISH", u"IX-loc:i", u"WHO",
+               u"IN", u"FUTURE", u"LIKE", u"POSS-1p", u"fs-MARY", u"MOTHER",
+               u"TEACH+AGENT", u"ARRIVE", u"SAME", u"SEE", u"HOUSE", u"SAY",
+               u"THAT", u"LEARN+AGENT", u"SOMETHING/ONE", u"POSS-3p:i",
+               u"IX-3p:j", u"YESTERDAY", u"KNOW", u"ONE", u"BUT", u"ON"],
+      hold_rate=0.06)
+
+  @classmethod
+  def from_databases(cls, databases):
+    """Returns the profile observed in the main gloss tracks of the given
+       databases. Raises ValueError if they have no main gloss tokens.
+    """
+    values = dict(lengths=[], signs=[], pauses=[], holds=[], leads=[],
+                  tails=[], glosses=[])
+    for db in databases:
+      for participant in db.get_participants():
+        for utterance in participant.get_utterances():
+          _observe(utterance, values)
+    if not values["signs"]:
+      raise ValueError("no main gloss tokens to draw a profile from")
+    for name in ("pauses", "holds"):
+      if not values[name]:
+        values[name] = [0]
+    hold_rate = len(values["holds"]) / float(len(values["signs"]))
+    return cls(hold_rate=hold_rate, **values)
+
+
+def _observe(utterance, values):
+  try:
+    tokens = utterance.get_tokens_for_field(MAIN_GLOSS_FID)
+  except KeyError:
+    return
+  (ustart, uend) = utterance.get_timecodes()
+  previous = None
+  count = 0
+  for token in tokens:
+    (start, end) = token.get_timecodes()
+    if token.get_text() == "HOLD" and previous is not None:
+      if end > previous:
+        values["holds"].append(end - previous)
+        previous = end
+      continue
+    if previous is None:
+      values["leads"].append(max(0, start - ustart))
+    else:
+      values["pauses"].append(max(0, start - previous))
+    values["signs"].append(end - start)
+    values["glosses"].append(token.get_text())
+    previous = end
+    count += 1
+  if count:
+    values["lengths"].append(count)
+    values["tails"].append(max(0, uend - previous))
+
+
+def write_database(f, utterances, participants=1, tokens=None, tiers=0,
+                   hold_rate=None, profile=None, seed=0):
+  """Writes a synthetic SignStream database as XML (UTF-8) to the file
+     object f. The output is written one utterance at a time, so memory use
+     does not depend on its size.
+       utterances is the total number of utterances; they are handed out to
+          the participants in turn.
+       tokens fixes the number of signs per utterance, either as a number or
+          as a (min, max) pair; by default it is drawn from the profile.
+       tiers is the number of non-manual tiers besides the main gloss. Each
+          utterance gets a few spans on each of them.
+       hold_rate is the fraction of signs followed by a HOLD; by default,
+          that of the profile.
+       profile is a SyntheticProfile (default: SyntheticProfile.default()).
+     The same arguments and seed always produce the same file.
+  """
+  if profile is None:
+    profile = SyntheticProfile.default()
+  if hold_rate is None:
+    hold_rate = profile.hold_rate
+  if isinstance(tokens, (int, long)):
+    tokens = (tokens, tokens)
+  rng = random.Random(seed)
+  f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+  f.write('<SIGNSTREAM-DATABASE DATABASE-VERSION="1.1" SIGNSTREAM-VERSION="2" '
+          'SOURCE="synthetic">\n')
+  f.write('<PARTICIPANTS>\n')
+  for pid in range(participants):
+    f.write('<PARTICIPANT AGE="" GENDER="" ID="%d" LABEL="P%d" LANGUAGE="ASL" '
+            'NAME="Participant %d"/>\n' % (pid, pid, pid))
+  f.write('</PARTICIPANTS>\n')
+  f.write('<CODING-SCHEME>\n')
+  f.write('<FIELD CONSTRAINT="free-text" ID="%d" LABEL="main gloss" NAME="main gloss">\n'
+          '<VALUE ID="%d" NAME="HOLD"/>\n</FIELD>\n' % (MAIN_GLOSS_FID, HOLD_VID))
+  for tier in range(tiers):
+    f.write('<FIELD CONSTRAINT="free-text" ID="%d" LABEL="tier %d" NAME="tier %d">\n'
+            % (_TIER_FID + tier, tier, tier))
+    for vid in range(_TIER_VALUES):
+      f.write('<VALUE ID="%d" NAME="value %d"/>\n' % (vid, vid))
+    f.write('</FIELD>\n')
+  f.write('</CODING-SCHEME>\n')
+  f.write('<MEDIA-FILES>\n')
+  for pid in range(participants):
+    f.write('<MEDIA-FILE ID="%d" LEGACY-PATH="synthetic:participant%d.mov"/>\n'
+            % (pid, pid))
+  f.write('</MEDIA-FILES>\n')
+  f.write('<UTTERANCES>\n')
+  clocks = [0] * participants
+  for uid in range(utterances):
+    pid = uid % participants
+    clocks[pid] = _write_utterance(f, rng, profile, uid, pid, clocks[pid],
+                                   tokens, tiers, hold_rate)
+  f.write('</UTTERANCES>\n')
+  f.write('</SIGNSTREAM-DATABASE>\n')
+
+
+def _write_utterance(f, rng, profile, uid, pid, clock, tokens, tiers, hold_rate):
+  """Writes one utterance starting at clock, and returns its end time"""
+  if tokens is None:
+    count = rng.choice(profile.lengths)
+  else:
+    count = rng.randint(tokens[0], tokens[1])
+  # main gloss: (start, end, text or None for HOLD), relative to the
+  # utterance start
+  gloss = []
+  time = rng.choice(profile.leads)
+  for i in range(count):
+    if i:
+      time += rng.choice(profile.pauses)
+    end = time + max(1, rng.choice(profile.signs))
+    gloss.append((time, end, rng.choice(profile.glosses)))
+    if rng.random() < hold_rate:
+      hold_end = end + max(1, rng.choice(profile.holds))
+      gloss.append((time, hold_end, None))
+      end = hold_end
+    time = end
+  length = max(1, time + rng.choice(profile.tails))
+  glosses = u" ".join(text for (_, _, text) in gloss if text is not None)
+  out = ['<UTTERANCE E="%d" EXCERPT=%s ID="%d" S="%d">\n'
+           % (clock + length, quoteattr(glosses[:24].encode("utf-8")), uid, clock),
+         '<NOTES></NOTES>\n',
+         '<MEDIA-REF ID="%d"/>\n' % pid,
+         '<SEGMENT PARTICIPANT-ID="%d" PRIMARY="true">\n' % pid]
+  if gloss:
+    out.append('<TRACK FID="%d">\n' % MAIN_GLOSS_FID)
+    for (start, end, text) in gloss:
+      if text is None:
+        out.append('<A E="%d" S="%d" VID="%d"/>\n' % (end, start, HOLD_VID))
+      else:
+        out.append('<A E="%d" S="%d">%s</A>\n' % (end, start,
+                                                 escape(text.encode("utf-8"))))
+    out.append('</TRACK>\n')
+  for tier in range(tiers):
+    spans = sorted(rng.randint(0, length) for _ in range(2 * rng.randint(0, 2)))
+    if not spans:
+      continue
+    out.append('<TRACK FID="%d">\n' % (_TIER_FID + tier))
+    for i in range(0, len(spans), 2):
+      start = min(spans[i], length - 1)
+      out.append('<A E="%d" S="%d" VID="%d"/>\n'
+                 % (max(spans[i + 1], start + 1), start,
+                    rng.randrange(_TIER_VALUES)))
+    out.append('</TRACK>\n')
+  out.append('</SEGMENT>\n</UTTERANCE>\n')
+  f.write("".join(out))
+  return clock + length + rng.choice(profile.pauses)
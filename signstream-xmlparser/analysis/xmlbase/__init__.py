@@ -7,6 +7,7 @@ from __future__ import absolute_import
 
 import xml.sax as sax
 import logging
+from timeit import default_timer as _timer
 
 class XMLException(Exception):
   """The base class for all XML parser exceptions. These are caught by some
@@ -40,18 +41,132 @@ class ContentHandlerError(XMLException):
     self.tag = tag
 
 
+class ParseStats(object):
+  """Counters gathered by an instrumented content handler (see
+     ContentHandlerBase.enable_stats). Several parses may share one stats
+     object, and stats objects from different processes can be merged.
+       elements maps each element name to [count, seconds in start handlers,
+          seconds in end handlers, bytes of character data]. Elements
+          inside a skipped element are counted, with their (negligible) time.
+       sections maps the name of any other timed function to [calls,
+          seconds]. Their time is also part of the handler time of the
+          elements they were called for.
+       seconds is the wall-clock time of the parses, if the caller recorded
+          it; what is not spent in handlers is spent in the SAX parser.
+  """
+
+  def __init__(self):
+    super(ParseStats, self).__init__()
+    self.elements = dict()
+    self.sections = dict()
+    self.parses = 0
+    self.seconds = 0.0
+
+  def _element(self, name):
+    counters = self.elements.get(name)
+    if counters is None:
+      counters = self.elements[name] = [0, 0.0, 0.0, 0]
+    return counters
+
+  def timed(self, name, function):
+    """Returns a wrapper around function that adds its calls and time to
+       the given section.
+    """
+    counters = self.sections.setdefault(name, [0, 0.0])
+    def wrapper(*args, **kwargs):
+      start = _timer()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        counters[0] += 1
+        counters[1] += _timer() - start
+    return wrapper
+
+  def timed_seconds(self, function):
+    """Returns a wrapper around function that adds its time to seconds"""
+    def wrapper(*args, **kwargs):
+      start = _timer()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        self.seconds += _timer() - start
+    return wrapper
+
+  def merge(self, other):
+    """Adds the counters of another stats object to this one"""
+    for (name, counters) in other.elements.items():
+      mine = self._element(name)
+      for i in range(len(mine)):
+        mine[i] += counters[i]
+    for (name, counters) in other.sections.items():
+      mine = self.sections.setdefault(name, [0, 0.0])
+      mine[0] += counters[0]
+      mine[1] += counters[1]
+    self.parses += other.parses
+    self.seconds += other.seconds
+
+  def handler_seconds(self):
+    """Returns the total time spent in element handlers"""
+    return sum(c[1] + c[2] for c in self.elements.values())
+
+  def text_bytes(self):
+    """Returns the total bytes (UTF-8) of character data"""
+    return sum(c[3] for c in self.elements.values())
+
+  def format(self):
+    """Returns a human-readable report, as a string"""
+    handlers = self.handler_seconds()
+    lines = ["%d parse(s), %.3fs: %.3fs in handlers, %.3fs in the SAX parser, "
+             "%d bytes of character data" %
+             (self.parses, self.seconds, handlers, max(0.0, self.seconds - handlers),
+              self.text_bytes())]
+    lines.append("%-24s %9s %10s %10s %10s" % ("element", "count", "start s",
+                                               "end s", "text bytes"))
+    for name in sorted(self.elements, key=lambda n: -sum(self.elements[n][1:3])):
+      (count, start, end, text) = self.elements[name]
+      lines.append("%-24s %9d %10.4f %10.4f %10d" % (name, count, start, end, text))
+    if self.sections:
+      lines.append("%-24s %9s %10s" % ("within handlers", "calls", "s"))
+      for name in sorted(self.sections, key=lambda n: -self.sections[n][1]):
+        (calls, seconds) = self.sections[name]
+        lines.append("%-24s %9d %10.4f" % (name, calls, seconds))
+    return "\n".join(lines)
+
+
+def split_profile_option(args):
+  """Handles the --profile option of the example scripts, which print
+     parser statistics to stderr when it is given.
+     Returns (the other arguments, a new ParseStats if --profile was among
+     args, or None otherwise).
+  """
+  if "--profile" not in args:
+    return (list(args), None)
+  return ([arg for arg in args if arg != "--profile"], ParseStats())
+
+
 class ContentHandlerBase(sax.ContentHandler):
   """Convenience base class for an XML SAX content handler.
      Provides automatic dispatching to methods that handle individual
      elements, of the form "start_<name>" and "end_<name>", and maintains an
      element nesting stack.
      Special characters in elements are converted to "_".
+     A start_<name> handler may call skip_element() to skip over the rest
+     of the element: none of its children are dispatched, no text is
+     accumulated for it, and its end_<name> handler is not called.
      
      The tag handling functions have the following signature:
        start_<name>(self, attributes)
        end_<name>(self, text) where text is any text that has accumulated since
                               the start of the tag. Note that this messes up
                               mixed content, but we don't need it anyway.
+
+     The handler functions of a class are collected once per class; each
+     instance then binds them per element name on first use, so that
+     dispatching an element costs a single dictionary lookup.
+
+     enable_stats() turns on instrumentation. It replaces the SAX callbacks
+     of the instance with timed versions, so a handler without it runs
+     exactly the same code as before.
   """
   import re
   _special_chars = re.compile(r"[^A-Za-z0-9_]")
@@ -65,8 +180,56 @@ class ContentHandlerBase(sax.ContentHandler):
     self.element_stack = None
     self.locator = None
     self.current_element = None
+    self.skip_depth = 0
     self.element_methods = dict() # caches the transformed element names
+    self.start_methods = dict() # element name -> bound start handler
+    self.end_methods = dict() # element name -> bound end handler
     self.warn_on_exception = warn_on_exception
+    self.stats = None
+
+  def enable_stats(self, stats=None):
+    """Turns on instrumentation: from now on, elements, handler time and
+       character data are counted in stats (a new ParseStats by default),
+       which is returned. Must be called before parsing starts, since the
+       SAX parser looks up the callbacks when it starts.
+    """
+    if stats is None:
+      stats = ParseStats()
+    self.stats = stats
+    start_element = self.startElement
+    end_element = self.endElement
+    characters = self.characters
+    element = stats._element
+    def timed_start_element(name, attrs):
+      start = _timer()
+      start_element(name, attrs)
+      counters = element(name)
+      counters[0] += 1
+      counters[1] += _timer() - start
+    def timed_end_element(name):
+      start = _timer()
+      end_element(name)
+      element(name)[2] += _timer() - start
+    def counted_characters(text):
+      characters(text)
+      if not self.skip_depth:
+        element(self.element_stack[-1])[3] += len(text.encode("utf-8"))
+    self.startElement = timed_start_element
+    self.endElement = timed_end_element
+    self.characters = counted_characters
+    return stats
+
+  @classmethod
+  def _handler_table(cls):
+    """Returns the start_/end_ handler functions of this class, keyed by
+       method name. Computed once per class.
+    """
+    table = cls.__dict__.get("_handler_functions")
+    if table is None:
+      table = dict((name, getattr(cls, name).im_func) for name in dir(cls)
+                   if name.startswith("start_") or name.startswith("end_"))
+      cls._handler_functions = table
+    return table
 
   def _method_name(self, name):
     method_name = self.element_methods.get(name, None)
@@ -74,56 +237,90 @@ class ContentHandlerBase(sax.ContentHandler):
       method_name = self._special_chars.sub("_", name)
       self.element_methods[name] = method_name
     return method_name
-  
-  def _exception_wrap(self, tag, call_obj, *args, **kw):
-    try:
-      ret = call_obj(*args, **kw)
-    except Exception, e:
-      line = None
-      column = None
-      if self.locator is not None:
-        (line, column) = (self.locator.getLineNumber(), self.locator.getColumnNumber())
-      e = ContentHandlerError(tag, line, column, e)
-      if self.warn_on_exception:
-        ret = None
-        logging.getLogger("xmlbase").error(unicode(e).encode("utf-8"))
-      else:
-        raise e
-    return ret
 
-  def _call_element(self, is_start, name, *args, **kw):
+  def _bind_method(self, is_start, name):
+    """Looks up the handler for an element, and caches it bound to this
+       instance. Raises UnexpectedElement if there is none.
+    """
     if is_start:
       element_type = "start_"
+      methods = self.start_methods
     else:
       element_type = "end_"
-    method = getattr(self, element_type + self._method_name(name), None)
-    if method is not None:
-      method(*args, **kw)
+      methods = self.end_methods
+    function = self._handler_table().get(element_type + self._method_name(name))
+    if function is not None:
+      method = function.__get__(self, type(self))
+    else:
+      method = self._missing_method(is_start, name)
+    methods[name] = method
+    return method
+
+  def _missing_method(self, is_start, name):
+    """Returns the handler for an element that has no start_/end_ method,
+       or raises UnexpectedElement.
+    """
+    if not is_start:
+      name = "/" + name
+    raise UnexpectedElement(name, self.element_stack)
+
+  def _handle_exception(self, tag, e):
+    line = None
+    column = None
+    if self.locator is not None:
+      (line, column) = (self.locator.getLineNumber(), self.locator.getColumnNumber())
+    e = ContentHandlerError(tag, line, column, e)
+    if self.warn_on_exception:
+      logging.getLogger("xmlbase").error(unicode(e).encode("utf-8"))
     else:
-      if not is_start:
-        name = "/" + name
-      raise UnexpectedElement(name, self.element_stack)
+      raise e
+
+  def skip_element(self):
+    """Skips the content and the end handler of the element whose start
+       handler is currently running.
+    """
+    self.skip_depth = 1
 
   def setDocumentLocator(self, locator):
     self.locator = locator
     
   def startDocument(self):
-    self.text_stack = [""]
+    self.text_stack = [[]]
     self.element_stack = []
+    self.skip_depth = 0
 
   def endDocument(self):
     self.text_stack = None
     self.element_stack = None
     
   def startElement(self, name, attrs):
+    if self.skip_depth:
+      self.skip_depth += 1
+      return
     self.current_element = name
-    self._exception_wrap(name, self._call_element, True, name, attrs)
-    self.text_stack.append("")
+    try:
+      method = self.start_methods.get(name)
+      if method is None:
+        method = self._bind_method(True, name)
+      method(attrs)
+    except Exception, e:
+      self._handle_exception(name, e)
+    self.text_stack.append([])
     self.element_stack.append(name)
   
   def endElement(self, name):
-    self._exception_wrap(name, self._call_element, False, name,
-                         self.text_stack[-1])
+    if self.skip_depth:
+      self.skip_depth -= 1
+      if self.skip_depth:
+        return
+    else:
+      try:
+        method = self.end_methods.get(name)
+        if method is None:
+          method = self._bind_method(False, name)
+        method("".join(self.text_stack[-1]))
+      except Exception, e:
+        self._handle_exception(name, e)
     self.text_stack.pop()
     self.element_stack.pop()
     if len(self.element_stack) > 0:
@@ -132,7 +329,8 @@ class ContentHandlerBase(sax.ContentHandler):
       self.current_element = None
 
   def characters(self, text):
-    self.text_stack[-1] += text
+    if not self.skip_depth:
+      self.text_stack[-1].append(text)
 
 
 class ContentHandlerWithDefaults(ContentHandlerBase):
@@ -150,26 +348,19 @@ class ContentHandlerWithDefaults(ContentHandlerBase):
     """Constructor. allowed_elements contains the set of allowed tags."""
     ContentHandlerBase.__init__(self, warn_on_error)
     self.allowed_elements = allowed_elements
+    # the set of elements is known up front, so bind all handlers now
+    for name in allowed_elements:
+      self._bind_method(True, name)
+      self._bind_method(False, name)
 
   # Overrides base class method
-  def _call_element(self, is_start, name, *args, **kw):
+  def _missing_method(self, is_start, name):
+    if name not in self.allowed_elements:
+      return ContentHandlerBase._missing_method(self, is_start, name)
     if is_start:
-      element_type = "start_"
-    else:
-      element_type = "end_"
-    method = getattr(self, element_type + self._method_name(name), None)
-    if method is not None:
-      method(*args, **kw)
+      return lambda attrs: self.default_start(name, attrs)
     else:
-      if name in self.allowed_elements:
-        if is_start:
-          self.default_start(name, args[0])
-        else:
-          self.default_end(name, args[0])
-      else:
-        if not is_start:
-          name = "/" + name
-        raise UnexpectedElement(name, self.element_stack)
+      return lambda text: self.default_end(name, text)
   
   def default_start(self, name, attrs):
     """Called when an allowed start element has no specialized handler"""
@@ -178,4 +369,3 @@ class ContentHandlerWithDefaults(ContentHandlerBase):
   def default_end(self, name, text):
     """Called when an allowed closing element has no specialized handler"""
     pass
-  
\ No newline at end of file
@@ -8,9 +8,11 @@
 
 import sys
 import analysis.signstream as ss
+import analysis.xmlbase as xmlbase
 
-if len(sys.argv) != 2:
-  sys.stderr.write("Usage: showglosses.py <XML file>\n")
+(args, stats) = xmlbase.split_profile_option(sys.argv[1:])
+if len(args) != 1:
+  sys.stderr.write("Usage: glosses_n_head.py [--profile] <XML file>\n")
   sys.exit(1)
 
 def format_headshake(head_movements):
@@ -21,7 +23,7 @@ def format_headshake(head_movements):
     temp.append(u"%s (%d-%d)" % (hstext, hs, he))
   return u"headshake: " + ", ".join(temp)
 
-db = ss.SignStreamDatabase.read_xml(sys.argv[1])
+db = ss.SignStreamDatabase.read_xml(args[0], stats=stats)
 
 for participant in db.get_participants():
   print unicode(participant)
@@ -34,3 +36,6 @@ for participant in db.get_participants():
     else:
       head_str = u""
     print u"%6d-%6d %s%s" % (start, end, text, head_str)
+
+if stats is not None:
+  sys.stderr.write(stats.format() + "\n")
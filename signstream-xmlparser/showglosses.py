@@ -6,13 +6,15 @@
 # Simple example showing how to display the glosses track of a signstream database
 
 import sys
-import analysis.signstream as ss
+import analysis.signstream.cache as sscache
+import analysis.xmlbase as xmlbase
 
-if len(sys.argv) != 2:
-  sys.stderr.write("Usage: showglosses.py <XML file>\n")
+(args, stats) = xmlbase.split_profile_option(sys.argv[1:])
+if len(args) != 1:
+  sys.stderr.write("Usage: showglosses.py [--profile] <XML file>\n")
   sys.exit(1)
 
-db = ss.SignStreamDatabase.read_xml(sys.argv[1])
+db = sscache.read_xml(args[0], stats=stats)
 
 for participant in db.get_participants():
   print unicode(participant)
@@ -21,3 +23,6 @@ for participant in db.get_participants():
     text = token.get_text()
     filenames = [m.get_filename() for m in token.get_utterance().get_media()]
     print u"%6d-%6d %s (in %20s)" % (start, end, text, ", ".join(filenames))
+
+if stats is not None:
+  sys.stderr.write(stats.format() + "\n")
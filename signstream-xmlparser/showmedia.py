@@ -7,12 +7,14 @@
 
 import sys
 import analysis.signstream as ss
+import analysis.xmlbase as xmlbase
 
-if len(sys.argv) != 2:
-  sys.stderr.write("Usage: showmedia.py <XML file>\n")
+(args, stats) = xmlbase.split_profile_option(sys.argv[1:])
+if len(args) != 1:
+  sys.stderr.write("Usage: showmedia.py [--profile] <XML file>\n")
   sys.exit(1)
 
-db = ss.SignStreamDatabase.read_xml(sys.argv[1])
+db = ss.SignStreamDatabase.read_xml(args[0], stats=stats)
 for participant in db.get_participants():
   for utterance in participant.get_utterances():
     print "Utterance #%d" % utterance.get_id()
@@ -20,3 +22,5 @@ for participant in db.get_participants():
     for video in media:
       print "-- %s" % video.get_filename()
 
+if stats is not None:
+  sys.stderr.write(stats.format() + "\n")
@@ -6,16 +6,34 @@
 # Compares two SignStream XML files.
 # Note that this comparison does not cover every attribute, but it does
 # touch on all the useful ones.
+# With --diff, every difference found is printed to stdout, one per line.
+# Only the parts of the files whose digests differ are compared.
 
 import sys
-import analysis.signstream as ss
+import analysis.signstream.cache as sscache
+import analysis.xmlbase as xmlbase
 
-if len(sys.argv) != 3:
-  sys.stderr.write("Usage: ss-compare.py <XML file1> <XML file2>\n")
+(args, stats) = xmlbase.split_profile_option(sys.argv[1:])
+diff = "--diff" in args
+args = [arg for arg in args if arg != "--diff"]
+if len(args) != 2:
+  sys.stderr.write("Usage: ss-compare.py [--profile] [--diff] <XML file1> <XML file2>\n")
   sys.exit(2)
 
-db1 = ss.SignStreamDatabase.read_xml(sys.argv[1])
-db2 = ss.SignStreamDatabase.read_xml(sys.argv[2])
+db1 = sscache.read_xml(args[0], stats=stats)
+db2 = sscache.read_xml(args[1], stats=stats)
+if stats is not None:
+  sys.stderr.write(stats.format() + "\n")
+
+def describe(x):
+  if x is None:
+    return u"(none)"
+  return unicode(x)
+
+if diff:
+  for (path, this, other) in db1.diff(db2):
+    location = u" / ".join(u"%s %s" % (kind, key) for (kind, key) in path)
+    print (u"%s: %s -> %s" % (location, describe(this), describe(other))).encode("utf-8")
 if db1 == db2:
   sys.stderr.write("same\n")
   sys.exit(0)
@@ -0,0 +1,39 @@
+#!/usr/bin/python
+
+# -*- coding: utf-8 -*-
+# $Id$
+
+# Exports the annotation tiers of SignStream files as dense per-frame label
+# matrices for model training (see analysis.signstream.frames.export_labels):
+# one frames x fields matrix of field value ids per video, and optionally
+# multi-hot matrices of the free-text tokens, in chunked .npy files with an
+# index.json that describes them.
+#
+#   ss-labels.py -o labels/ --fps 30 -f "main gloss" -f "eye brows" ncslgr-xml/
+
+import argparse
+import sys
+import analysis.signstream.cache as sscache
+import analysis.signstream.frames as frames
+from analysis.signstream.corpus import expand_sources
+
+parser = argparse.ArgumentParser(description="Export per-frame label matrices.")
+parser.add_argument("sources", nargs="+", metavar="PATH",
+                    help="XML file, directory of XML files, or glob pattern")
+parser.add_argument("-o", "--output", required=True, help="output directory")
+parser.add_argument("--fps", type=float, required=True, help="frame rate")
+parser.add_argument("-f", "--field", action="append", dest="fields", required=True,
+                    metavar="FIELD", help="field to export (may be repeated)")
+parser.add_argument("--texts", action="store_true",
+                    help="also write multi-hot matrices of the free-text tokens")
+parser.add_argument("--chunk-frames", type=int, default=frames.DEFAULT_CHUNK_FRAMES,
+                    help="frames per .npy file (default: %(default)s)")
+args = parser.parse_args()
+
+fields = [field.decode("utf-8") for field in args.fields]
+databases = [sscache.read_xml(path, fields=fields) for path in expand_sources(args.sources)]
+index = frames.export_labels(databases, fields, args.fps, args.output,
+                             chunk_frames=args.chunk_frames, multi_hot=args.texts)
+sys.stderr.write("%d videos, %d frames, %d texts\n"
+                 % (len(index["media"]), sum(m["frames"] for m in index["media"]),
+                    len(index["vocabulary"])))
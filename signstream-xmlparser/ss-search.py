@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+# -*- coding: utf-8 -*-
+# $Id$
+
+# Searches glosses across SignStream files through a persistent index (see
+# analysis.signstream.index). --add brings the index up to date with the
+# given files, directories or glob patterns first, reading only the files
+# that changed; the searches themselves never touch the XML.
+#
+#   ss-search.py -i glosses.idx --add ncslgr-xml/
+#   ss-search.py -i glosses.idx FINISH
+#   ss-search.py -i glosses.idx --prefix IX-
+#   ss-search.py -i glosses.idx --regex '^#'
+#   ss-search.py -i glosses.idx --phrase IX-1p FINISH
+
+import argparse
+import sys
+import analysis.signstream.index as ssindex
+
+parser = argparse.ArgumentParser(description="Search glosses across SignStream files.")
+parser.add_argument("-i", "--index", required=True, help="index file")
+parser.add_argument("--add", nargs="+", metavar="SOURCE",
+                    help="index these files, directories or patterns first")
+parser.add_argument("-j", "--jobs", type=int,
+                    help="worker processes for --add (default: one per CPU)")
+parser.add_argument("--field", default="main gloss",
+                    help="field to index (default: main gloss)")
+query = parser.add_mutually_exclusive_group()
+query.add_argument("--prefix", action="store_true", help="glosses starting with GLOSS")
+query.add_argument("--regex", action="store_true", help="GLOSS is a regular expression")
+query.add_argument("--phrase", action="store_true",
+                   help="the GLOSSes in consecutive tokens")
+query.add_argument("--list", action="store_true",
+                   help="list the indexed glosses with their counts")
+parser.add_argument("gloss", nargs="*")
+args = parser.parse_args()
+
+index = ssindex.GlossIndex(args.index, field=args.field)
+try:
+  if args.add:
+    (indexed, removed, errors) = index.update(args.add, jobs=args.jobs)
+    sys.stderr.write("%d indexed, %d dropped, %d unreadable\n"
+                     % (len(indexed), len(removed), len(errors)))
+  if args.list:
+    for (gloss, count) in index.get_glosses():
+      print (u"%s\t%d" % (gloss, count)).encode("utf-8")
+    sys.exit(0)
+  if not args.gloss:
+    if not args.add:
+      parser.error("nothing to search for")
+    sys.exit(0)
+  if args.phrase:
+    rows = index.phrase([g.decode("utf-8") for g in args.gloss])
+  elif len(args.gloss) != 1:
+    parser.error("give one GLOSS, or use --phrase")
+  elif args.prefix:
+    rows = index.prefix(args.gloss[0].decode("utf-8"))
+  elif args.regex:
+    rows = index.regex(args.gloss[0].decode("utf-8"))
+  else:
+    rows = index.lookup(args.gloss[0].decode("utf-8"))
+  for (path, pid, uid, position, start, end, text) in rows:
+    print (u"%s\t%d\t%d\t%d\t%d-%d\t%s" % (path, pid, uid, position, start, end,
+                                          text)).encode("utf-8")
+  sys.exit(0 if rows else 1)
+finally:
+  index.close()
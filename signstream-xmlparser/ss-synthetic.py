@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+# -*- coding: utf-8 -*-
+# $Id$
+
+# Writes a synthetic SignStream XML file, for testing at scale.
+# Sign durations, pauses, HOLDs and glosses are drawn from the real corpus:
+# by default from quantiles of the bundled NCSLGR corpus, or, with --like,
+# from the given SignStream files.
+
+import argparse
+import sys
+import analysis.signstream.cache as sscache
+import analysis.signstream.synthetic as synthetic
+
+def token_range(text):
+  (low, _, high) = text.partition("-")
+  return (int(low), int(high or low))
+
+parser = argparse.ArgumentParser(description="Write a synthetic SignStream XML file.")
+parser.add_argument("-o", "--output", help="output file (default: standard output)")
+parser.add_argument("-u", "--utterances", type=int, default=1000,
+                    help="number of utterances (default: 1000)")
+parser.add_argument("-p", "--participants", type=int, default=1,
+                    help="number of participants (default: 1)")
+parser.add_argument("-t", "--tokens", type=token_range, metavar="MIN[-MAX]",
+                    help="signs per utterance (default: as in the corpus)")
+parser.add_argument("--tiers", type=int, default=0,
+                    help="number of non-manual tiers (default: 0)")
+parser.add_argument("--hold-rate", type=float,
+                    help="fraction of signs followed by a HOLD (default: as in the corpus)")
+parser.add_argument("--like", nargs="+", metavar="XML",
+                    help="draw the distributions from these files")
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+profile = None
+if args.like:
+  profile = synthetic.SyntheticProfile.from_databases(
+    sscache.read_xml(path, fields=["main gloss"]) for path in args.like)
+if args.output:
+  out = open(args.output, "wb")
+else:
+  out = sys.stdout
+try:
+  synthetic.write_database(out, args.utterances, participants=args.participants,
+                           tokens=args.tokens, tiers=args.tiers,
+                           hold_rate=args.hold_rate, profile=profile,
+                           seed=args.seed)
+finally:
+  if args.output:
+    out.close()
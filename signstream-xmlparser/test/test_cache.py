@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+#@PydevCodeAnalysisIgnore
+
+import os
+import shutil
+import tempfile
+
+import nose.tools as nt
+import nose
+import analysis.signstream as ss
+import analysis.xmlbase as xmlbase
+import analysis.signstream.cache as sscache
+
+ACCIDENT = "test/resources/accident.ss3.xml"
+ALI = "test/resources/ali.ss3.xml"
+BAD_VALUE = "test/resources/bad_value.ss3.xml"
+
+def setup_tempdir():
+  global tempdir
+  tempdir = tempfile.mkdtemp()
+
+def teardown_tempdir():
+  shutil.rmtree(tempdir)
+
+def copy_resource(name):
+  path = os.path.join(tempdir, os.path.basename(name))
+  shutil.copy(name, path)
+  return path
+
+def entries(cache):
+  return sorted(name for (name, _, _) in cache._entries())
+
+def test_snapshot_roundtrip():
+  db = ss.SignStreamDatabase.read_xml(ACCIDENT)
+  nt.eq_(sscache.restore(sscache.snapshot(db)), db)
+  for model_class in (ss.CompactSignStreamDatabase, ss.ColumnarSignStreamDatabase):
+    other = model_class.read_xml(ALI)
+    snap = sscache.snapshot(other)
+    # the same snapshot, whatever class it came from
+    nt.eq_(snap, sscache.snapshot(ss.SignStreamDatabase.read_xml(ALI)))
+    restored = sscache.restore(snap, model_class)
+    nt.eq_(type(restored), model_class)
+    nt.eq_(restored, other)
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_cold_and_warm():
+  cache = sscache.DatabaseCache(os.path.join(tempdir, "cache"))
+  path = copy_resource(ACCIDENT)
+  db = cache.read_xml(path)
+  nt.eq_(len(entries(cache)), 1)
+  nt.eq_(cache.read_xml(path), db)
+  nt.eq_(cache._lookup(path, None)[0], sscache.snapshot(db))
+  # a field selection gets its own entry
+  gloss = cache.read_xml(path, fields=["main gloss"])
+  nt.eq_(len(entries(cache)), 2)
+  nt.eq_(cache.read_xml(path, fields=["main gloss"]), gloss)
+  nt.assert_not_equal(gloss, db)
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_iter_utterances():
+  cache = sscache.DatabaseCache(os.path.join(tempdir, "cache"))
+  path = copy_resource(ACCIDENT)
+  cold = list(cache.iter_utterances(path, fields=["main gloss"]))
+  nt.eq_(len(entries(cache)), 1)
+  warm = list(cache.iter_utterances(path, fields=["main gloss"]))
+  nt.eq_([u.get_id() for u in warm], [u.get_id() for u in cold])
+  for (w, c) in zip(warm, cold):
+    nt.eq_(w, c)
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_iter_utterances_order():
+  cache = sscache.DatabaseCache(os.path.join(tempdir, "cache"))
+  path = copy_resource(ACCIDENT)
+  order = [u.get_id() for u in ss.iter_utterances(path)]
+  # an entry from read_xml does not change the order of the stream
+  cache.read_xml(path)
+  nt.eq_([u.get_id() for u in cache.iter_utterances(path)], order)
+  nt.eq_([u.get_id() for u in cache.iter_utterances(path)], order)
+  nt.eq_(len(entries(cache)), 2)
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_lenient_parse():
+  cache = sscache.DatabaseCache(os.path.join(tempdir, "cache"))
+  path = copy_resource(BAD_VALUE)
+  cache.read_xml(path, warn_on_error=True)
+  nt.assert_raises(xmlbase.ContentHandlerError, cache.read_xml, path)
+  nt.eq_(len(entries(cache)), 1)
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_invalidation():
+  cache = sscache.DatabaseCache(os.path.join(tempdir, "cache"))
+  path = copy_resource(ACCIDENT)
+  cache.read_xml(path)
+  # touching the file without changing it keeps the entry
+  st = os.stat(path)
+  os.utime(path, (st.st_atime, st.st_mtime + 10))
+  nt.assert_true(cache._lookup(path, None)[0] is not None)
+  # changing the contents invalidates it
+  shutil.copy(ALI, path)
+  nt.assert_true(cache._lookup(path, None)[0] is None)
+  nt.eq_(entries(cache), [])
+  nt.eq_(cache.read_xml(path), ss.SignStreamDatabase.read_xml(ALI))
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_lru_eviction():
+  cache = sscache.DatabaseCache(os.path.join(tempdir, "cache"))
+  first = copy_resource(ACCIDENT)
+  second = copy_resource(ALI)
+  cache.read_xml(first)
+  cache.read_xml(second)
+  sizes = [size for (_, size, _) in cache._entries()]
+  # make the first entry the most recently used one
+  (first_entry, second_entry) = [cache._entry_name(p, None) for p in (first, second)]
+  os.utime(second_entry, (0, 0))
+  cache.read_xml(first)
+  cache.max_bytes = max(sizes)
+  cache._evict()
+  nt.eq_(entries(cache), [first_entry])
+
+
+if __name__ == '__main__':
+  nose.runmodule()
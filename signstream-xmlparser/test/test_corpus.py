@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+#@PydevCodeAnalysisIgnore
+
+import nose.tools as nt
+import nose
+import analysis.signstream as ss
+from analysis.signstream.corpus import SignStreamCorpus, expand_sources
+
+GOOD = ["test/resources/accident.ss3.xml", "test/resources/ali.ss3.xml",
+        "test/resources/ncslgr10a.ss3.xml"]
+
+def test_expand_sources():
+  nt.eq_(expand_sources("test/resources/a*.ss3.xml"), GOOD[:2])
+  paths = expand_sources(["test/resources", GOOD[0]])
+  nt.eq_(len(paths), 8)
+  nt.eq_(paths, sorted(paths))
+
+def check_corpus(jobs, model_class):
+  corpus = SignStreamCorpus.read_xml(
+    ["test/resources/bad_field.ss3.xml"] + GOOD, jobs=jobs, model_class=model_class)
+  nt.eq_(corpus.get_files(), GOOD)
+  nt.eq_(corpus.get_errors().keys(), ["test/resources/bad_field.ss3.xml"])
+  nt.assert_true("DuplicateField" in corpus.get_errors().values()[0])
+  for (path, db) in corpus.get_databases():
+    nt.eq_(type(db), model_class)
+    nt.eq_(db, model_class.read_xml(path))
+  participants = list(corpus.get_participants())
+  nt.eq_(len(participants), 3)
+  nt.eq_(participants[0][0], GOOD[0])
+  nt.eq_(participants[0][1].get_name(), "Michael Eric Schlang")
+  nt.eq_(set(path for (path, _) in corpus.get_media()), set(GOOD))
+  fields = corpus.get_fields()
+  nt.eq_([f.get_id() for (f, _) in fields], sorted(f.get_id() for (f, _) in fields))
+  gloss = [(f, paths) for (f, paths) in fields if f.get_label() == "main gloss"]
+  nt.eq_(gloss[0][1], GOOD)
+  nt.eq_(corpus.get_field("main gloss"), gloss[0][0])
+  nt.assert_raises(ss.InvalidField, corpus.get_field, "no such field")
+
+def test_join_tiers():
+  corpus = SignStreamCorpus.read_xml(GOOD, jobs=1)
+  rows = list(corpus.join_tiers("main gloss", ["hm: shake"]))
+  for path in GOOD:
+    db = corpus.get_database(path)
+    nt.eq_([(l, r, o) for (p, l, r, o) in rows if p == path],
+           list(db.join_tiers("main gloss", ["hm: shake"])))
+
+def test_corpus():
+  for model_class in (ss.SignStreamDatabase, ss.ColumnarSignStreamDatabase):
+    for jobs in (1, 2):
+      yield check_corpus, jobs, model_class
+
+
+if __name__ == '__main__':
+  nose.runmodule()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+#@PydevCodeAnalysisIgnore
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import nose.tools as nt
+import nose
+import analysis.signstream as ss
+import analysis.signstream.frames as frames
+
+ACCIDENT = "test/resources/accident.ss3.xml"
+
+def setup_tempdir():
+  global tempdir
+  tempdir = tempfile.mkdtemp()
+
+def teardown_tempdir():
+  shutil.rmtree(tempdir)
+
+def as_slices(starts, stops):
+  return [slice(a, b) for (a, b) in zip(starts.tolist(), stops.tolist())]
+
+def test_frame_ranges():
+  for model_class in (ss.SignStreamDatabase, ss.ColumnarSignStreamDatabase):
+    db = model_class.read_xml(ACCIDENT)
+    utterances = list(db.get_participant(0).get_utterances())
+    for fps in (29.97, 30.0, 60.0):
+      for u in utterances:
+        for tokens in u.get_tokens():
+          nt.eq_(as_slices(*frames.frame_ranges(tokens, fps)),
+                 [t.slice(fps) for t in tokens])
+      nt.eq_(as_slices(*frames.frame_ranges(utterances, fps)),
+             [u.slice(fps) for u in utterances])
+  nt.eq_(as_slices(*frames.frame_ranges([], 30.0)), [])
+
+def test_field_frame_ranges():
+  db = ss.ColumnarSignStreamDatabase.read_xml(ACCIDENT)
+  utterances = list(db.get_participant(0).get_utterances())
+  (starts, stops, offsets) = frames.field_frame_ranges(utterances, "main gloss", 30.0)
+  nt.eq_(len(offsets), len(utterances) + 1)
+  for (i, u) in enumerate(utterances):
+    tokens = u.tokens.get(10000, ())
+    nt.eq_(as_slices(starts[offsets[i]:offsets[i + 1]], stops[offsets[i]:offsets[i + 1]]),
+           [t.slice(30.0) for t in tokens])
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_feature_store():
+  db = ss.SignStreamDatabase.read_xml(ACCIDENT)
+  utterances = [u for u in db.get_participant(0).get_utterances() if u.get_media()]
+  media = utterances[1].get_media()[0]
+  length = utterances[-1].slice(30.0).stop + 10
+  features = np.arange(length * 3, dtype=np.float32).reshape((length, 3))
+  store = frames.FeatureStore(tempdir, 30.0)
+  np.save(store.get_path(media), features)
+  array = store.get_array(media)
+  nt.assert_true(isinstance(array, np.memmap))
+  nt.assert_true(store.get_array(media) is array)
+  tokens = list(utterances[1].get_tokens_for_field("main gloss"))
+  windows = store.windows(tokens, media)
+  for (token, window) in zip(tokens, windows):
+    nt.assert_true(np.array_equal(window, features[token.slice(30.0)]))
+    nt.assert_true(np.may_share_memory(window, array))
+  window = store.window(tokens[0])
+  nt.assert_true(np.array_equal(window, windows[0]))
+  nt.assert_true(np.array_equal(store.window(utterances[1]),
+                                features[utterances[1].slice(30.0)]))
+  nt.assert_raises(IOError, frames.FeatureStore(tempdir, 30.0, locate=lambda m: "none.npy").get_array,
+                   media)
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_feature_store_across_databases():
+  # both files have a video with id 478
+  ali = ss.SignStreamDatabase.read_xml("test/resources/ali.ss3.xml")
+  accident = ss.SignStreamDatabase.read_xml(ACCIDENT)
+  media = [ali.media[478], accident.media[478]]
+  nt.assert_not_equal(media[0].get_filename(), media[1].get_filename())
+  store = frames.FeatureStore(tempdir, 30.0)
+  for (value, m) in enumerate(media):
+    np.save(store.get_path(m), np.repeat(np.float32(value), 10))
+  nt.eq_([store.get_array(m)[0] for m in media], [0.0, 1.0])
+
+
+FIELDS = ["main gloss", "eye brows", "hm: nod"]
+
+def naive_labels(utterance, fields, fps, vocabulary):
+  """Per-frame labels by walking every frame of every token"""
+  frames_ = utterance.slice(fps)
+  count = frames_.stop - frames_.start
+  labels = np.empty((count, len(fields)), dtype=np.int32)
+  labels.fill(frames.NO_VALUE)
+  texts = np.zeros((count, len(vocabulary)), dtype=np.bool_)
+  db = utterance.get_participant().get_db()
+  for (column, field) in enumerate(fields):
+    for token in utterance.tokens.get(db.get_field(field).get_id(), ()):
+      covered = token.slice(fps)
+      for frame in range(max(covered.start, frames_.start), min(covered.stop, frames_.stop)):
+        if token.is_standard():
+          labels[frame - frames_.start, column] = token.get_field_value().get_id()
+        else:
+          texts[frame - frames_.start, vocabulary.index((field, token.get_text()))] = True
+  return (labels, texts)
+
+def test_utterance_labels():
+  db = ss.SignStreamDatabase.read_xml(ACCIDENT)
+  utterances = list(db.get_participant(0).get_utterances())
+  vocabulary = frames.text_vocabulary(utterances, FIELDS)
+  nt.assert_true((u"main gloss", u"IX-1p") in vocabulary)
+  for u in utterances:
+    (labels, texts) = frames.utterance_labels(u, FIELDS, 30.0, vocabulary)
+    (expected_labels, expected_texts) = naive_labels(u, FIELDS, 30.0, vocabulary)
+    nt.assert_true(np.array_equal(labels, expected_labels))
+    nt.assert_true(np.array_equal(texts, expected_texts))
+  nt.eq_(frames.utterance_labels(utterances[0], FIELDS, 30.0)[1], None)
+
+def test_overlapping_tokens():
+  db = ss.SignStreamDatabase()
+  db._add_participant(1, 29, 'ASL', 'Ben', 'Benjamin Bahan', 'male')
+  db._add_field(2, 'eye brows', 'eye brows', None)
+  db._add_value(2, 5, 'raised')
+  db._add_value(2, 6, 'lowered')
+  db._add_utterance(1, 1, 0, 1000, [])
+  db._add_token(1, 1, 2, 100, 500, 5, None)
+  db._add_token(1, 1, 2, 300, 700, 6, None)
+  u = list(db.get_participant(1).get_utterances())[0]
+  (labels, _) = frames.utterance_labels(u, ["eye brows"], 10.0)
+  nt.eq_(labels[:, 0].tolist(), [-1, 5, 5, 6, 6, 6, 6, 6, -1, -1, -1])
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_export_labels():
+  db = ss.SignStreamDatabase.read_xml(ACCIDENT)
+  index = frames.export_labels([db], FIELDS, 30.0, tempdir, chunk_frames=1000)
+  vocabulary = [tuple(pair) for pair in index["vocabulary"]]
+  nt.eq_(len(set(m["name"] for m in index["media"])), len(index["media"]))
+  utterances = list(db.get_participant(0).get_utterances())
+  for entry in index["media"]:
+    nt.eq_(sum(chunk["frames"] for chunk in entry["chunks"]), entry["frames"])
+    nt.assert_true(len(entry["chunks"]) > 1)
+    labels = np.concatenate([np.load(os.path.join(tempdir, chunk["labels"]), mmap_mode="r")
+                             for chunk in entry["chunks"]])
+    texts = np.concatenate([np.load(os.path.join(tempdir, chunk["texts"]), mmap_mode="r")
+                            for chunk in entry["chunks"]])
+    for u in utterances:
+      frames_ = u.slice(30.0)
+      window = slice(frames_.start - entry["start"], frames_.stop - entry["start"])
+      (expected_labels, expected_texts) = naive_labels(u, FIELDS, 30.0, vocabulary)
+      # consecutive utterances share the frame where one ends and the next
+      # starts
+      nt.assert_true(np.array_equal(labels[window][1:-1], expected_labels[1:-1]))
+      nt.assert_true(np.array_equal(texts[window][1:-1], expected_texts[1:-1]))
+  with open(os.path.join(tempdir, "index.json")) as f:
+    nt.eq_(json.load(f), index)
+  # every exported value id can be looked up
+  for (k, field) in enumerate(FIELDS):
+    nt.eq_(index["values"][k], dict((str(v.get_id()), v.get_label())
+                                    for v in db.get_field(field).get_values()))
+    for entry in index["media"]:
+      for chunk in entry["chunks"]:
+        vids = np.load(os.path.join(tempdir, chunk["labels"]))[:, k]
+        nt.assert_true(all(str(vid) in index["values"][k]
+                           for vid in set(vids.tolist()) - set([index["no_value"]])))
+
+
+if __name__ == '__main__':
+  nose.runmodule()
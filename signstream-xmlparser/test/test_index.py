@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+#@PydevCodeAnalysisIgnore
+
+import os
+import shutil
+import tempfile
+
+import nose.tools as nt
+import nose
+import analysis.signstream as ss
+import analysis.signstream.index as ssindex
+
+ACCIDENT = "test/resources/accident.ss3.xml"
+ALI = "test/resources/ali.ss3.xml"
+
+def setup_tempdir():
+  global tempdir
+  tempdir = tempfile.mkdtemp()
+
+def teardown_tempdir():
+  shutil.rmtree(tempdir)
+
+def copy_resource(name):
+  path = os.path.join(tempdir, os.path.basename(name))
+  shutil.copy(name, path)
+  return path
+
+def expected(path, predicate):
+  """The occurrences that a scan of the main gloss tokens finds"""
+  db = ss.SignStreamDatabase.read_xml(path)
+  rows = []
+  for p in db.get_participants():
+    for u in p.get_utterances():
+      try:
+        tokens = list(u.get_tokens_for_field("main gloss"))
+      except KeyError:
+        continue
+      for (position, t) in enumerate(tokens):
+        if predicate(t.get_text()):
+          (start, end) = t.get_timecodes()
+          rows.append((os.path.abspath(path), p.get_id(), u.get_id(), position,
+                       start, end, t.get_text()))
+  return rows
+
+def test_normalize_gloss():
+  nt.eq_(ssindex.normalize_gloss(u"  fs-john \n"), u"FS-JOHN")
+  nt.eq_(ssindex.normalize_gloss(u"a  b"), u"A B")
+  nt.eq_(ssindex.normalize_gloss(u"é"), u"\xc9")
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_queries():
+  path = copy_resource(ACCIDENT)
+  index = ssindex.GlossIndex(os.path.join(tempdir, "glosses.idx"))
+  nt.eq_(index.update(path, jobs=1), ([os.path.abspath(path)], [], {}))
+  nt.eq_(index.lookup(u"ix-1p"), expected(path, lambda text: text == u"IX-1p"))
+  nt.eq_(index.prefix(u"IX-"), expected(path, lambda text: text.startswith(u"IX-")))
+  nt.eq_(index.regex(u"^fs-"), expected(path, lambda text: text.startswith(u"fs-")))
+  nt.eq_(index.lookup(u"NO-SUCH-SIGN"), [])
+  nt.eq_(sum(count for (_, count) in index.get_glosses()),
+         len(expected(path, lambda text: True)))
+  # a phrase of each gloss and the next one
+  first = expected(path, lambda text: True)[3]
+  second = expected(path, lambda text: True)[4]
+  phrase = index.phrase([first[6], second[6]])
+  nt.assert_true((first[0], first[1], first[2], first[3], first[4], second[5],
+                  first[6] + u" " + second[6]) in phrase)
+  for row in phrase:
+    nt.eq_(row[6], u" ".join([first[6], second[6]]))
+  nt.eq_(index.phrase(u"IX-1p"), index.lookup(u"IX-1p"))
+  index.close()
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_incremental_update():
+  accident = copy_resource(ACCIDENT)
+  ali = copy_resource(ALI)
+  name = os.path.join(tempdir, "glosses.idx")
+  index = ssindex.GlossIndex(name)
+  (indexed, removed, errors) = index.update(tempdir, jobs=2)
+  nt.eq_(indexed, sorted(map(os.path.abspath, [accident, ali])))
+  nt.eq_(index.get_files(), indexed)
+  both = index.lookup(u"IX-1p")
+  nt.eq_(index.update(tempdir), ([], [], {}))
+  # touched only
+  os.utime(ali, (0, 0))
+  nt.eq_(index.update(tempdir), ([], [], {}))
+  # changed
+  with open(ali, "rb") as f:
+    text = f.read()
+  with open(ali, "wb") as f:
+    f.write(text.replace(">IX-1p<", ">IX-1P-CHANGED<"))
+  index.close()
+  index = ssindex.GlossIndex(name)
+  nt.eq_(index.update(tempdir), ([os.path.abspath(ali)], [], {}))
+  nt.eq_(index.lookup(u"IX-1p"), expected(accident, lambda text: text == u"IX-1p"))
+  nt.assert_true(len(index.lookup(u"IX-1p")) < len(both))
+  nt.assert_true(index.lookup(u"IX-1P-CHANGED"))
+  # removed
+  os.remove(ali)
+  nt.eq_(index.update(tempdir), ([], [os.path.abspath(ali)], {}))
+  nt.eq_(index.lookup(u"IX-1P-CHANGED"), [])
+  nt.assert_false(u"IX-1P-CHANGED" in dict(index.get_glosses()))
+  index.close()
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_file_without_field():
+  ali = copy_resource(ALI)
+  # a file whose coding scheme has no main gloss field
+  other = os.path.join(tempdir, "other.xml")
+  with open(ACCIDENT, "rb") as f:
+    text = f.read()
+  with open(other, "wb") as f:
+    f.write(text.replace('LABEL="main gloss" NAME="main gloss"',
+                         'LABEL="gloss" NAME="gloss"'))
+  nt.assert_raises(ss.InvalidField, ss.read_header(other).get_field, "main gloss")
+  for jobs in (1, 2):
+    index = ssindex.GlossIndex(os.path.join(tempdir, "glosses%d.idx" % jobs))
+    nt.eq_(index.update(tempdir, jobs=jobs),
+           (sorted(map(os.path.abspath, [ali, other])), [], {}))
+    nt.eq_(index.lookup(u"IX-1p"), expected(ali, lambda text: text == u"IX-1p"))
+    index.close()
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_unreadable_file():
+  path = os.path.join(tempdir, "broken.xml")
+  with open(path, "w") as f:
+    f.write("<SIGNSTREAM-DATABASE>")
+  index = ssindex.GlossIndex(os.path.join(tempdir, "glosses.idx"))
+  (indexed, removed, errors) = index.update([path], jobs=1)
+  nt.eq_(indexed, [])
+  nt.eq_(errors.keys(), [os.path.abspath(path)])
+  nt.eq_(index.get_files(), [])
+  index.close()
+  nt.assert_raises(ValueError, ssindex.GlossIndex,
+                   os.path.join(tempdir, "glosses.idx"), field="eye gaze")
+
+
+if __name__ == '__main__':
+  nose.runmodule()
@@ -3,9 +3,14 @@
 
 #@PydevCodeAnalysisIgnore
 
+import pickle
+import random
+import threading
+
 import nose.tools as nt
 import nose
 import analysis.signstream as ss
+import analysis.signstream.cache as sscache
 import analysis.xmlbase as xmlbase
 from analysis.xmlbase import XMLException
 
@@ -184,6 +189,100 @@ def test_inequality():
   nt.assert_false(db1 != db1)
   nt.assert_false(db1 != db1a)
 
+def test_digest():
+  db1 = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml", freeze=False)
+  db1a = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  nt.eq_(db1.get_digest(), db1a.get_digest())
+  nt.eq_(db1.get_participant(0).get_digest(), db1a.get_participant(0).get_digest())
+  u = list(db1.get_participant(0).get_utterances())[1]
+  before = u.get_digest()
+  db1._add_token(u.get_id(), 0, 10000, 7800, 7900, None, u"NEW")
+  nt.assert_not_equal(u.get_digest(), before)
+  nt.assert_false(db1 == db1a)
+  nt.eq_(list(db1a.diff(db1a)), [])
+  # a single comparison does not hash; once both sides are hashed,
+  # the digests are compared
+  db2 = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  nt.assert_true(db2 == db1a)
+  nt.eq_(db2.digest, None)
+  db2.get_digest()
+  nt.assert_true(db2 == db1a)
+  nt.assert_false(db2 == db1)
+
+def test_diff():
+  db1 = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  db2 = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml", freeze=False)
+  u = list(db2.get_participant(0).get_utterances())[1]
+  token = u.tokens[10000][2]
+  token.text = u"CHANGED"
+  db2.get_participant(0).label = u"other"
+  db2._add_utterance(9999, 0, 100000, 101000, [])
+  for x in (db2, db2.get_participant(0), u):
+    x.digest = None
+  diffs = list(db1.diff(db2))
+  participant = ("participant", 0)
+  nt.eq_(diffs[0], ((participant, ("attribute", "label")),
+                    db1.get_participant(0).get_label(), u"other"))
+  paths = [path for (path, _, _) in diffs]
+  nt.assert_true((participant, ("utterance", u.get_id()), ("field", 10000),
+                  ("token", 2)) in paths)
+  added = [d for d in diffs if d[0] == (participant, ("utterance", 9999))]
+  nt.eq_(len(added), 1)
+  nt.eq_(added[0][1], None)
+  nt.eq_(added[0][2].get_id(), 9999)
+
+def test_freeze():
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  nt.assert_true(db.frozen)
+  nt.eq_(db.p_order, (0,))
+  nt.assert_true(isinstance(db.f_order, tuple))
+  nt.eq_(db.get_field("main gloss").get_id(), 10000)
+  p = db.get_participant(0)
+  u = list(p.get_utterances())[1]
+  nt.assert_true(isinstance(p.uorder, tuple))
+  nt.assert_true(isinstance(u.torder, tuple))
+  nt.assert_raises(ss.FrozenDatabase, db._add_token, u.get_id(), 0, 10000, 7800, 7900,
+                   None, u"NEW")
+  nt.assert_raises(ss.FrozenDatabase, db._add_utterance, 9999, 0, 0, 1000, [])
+  nt.assert_raises(ss.FrozenDatabase, db._add_participant, 5, 29, 'ASL', 'Ben',
+                   'Benjamin Bahan', 'male')
+  nt.assert_raises(ss.FrozenDatabase, db._add_value, 10000, 99999, "NEW")
+  nt.assert_raises(ss.FrozenDatabase, db._detach_utterance, u.get_id(), 0)
+  nt.assert_raises(ss.FrozenDatabase, p.utterances.pop, u.get_id())
+  # nor through the participants and utterances
+  for model_class in (ss.SignStreamDatabase, ss.ColumnarSignStreamDatabase):
+    frozen = model_class.read_xml("test/resources/accident.ss3.xml")
+    fp = frozen.get_participant(0)
+    fu = list(fp.get_utterances())[1]
+    count = len(fu.get_tokens_for_field(10000))
+    nt.assert_raises(ss.FrozenDatabase, fu._add_token, frozen.get_field(10000), 0, 1,
+                     None, u"X")
+    nt.assert_raises(ss.FrozenDatabase, fp._add_token, fu.get_id(), frozen.get_field(10000),
+                     0, 1, None, u"X")
+    nt.assert_raises(ss.FrozenDatabase, fp._add_utterance, 9999, 0, 1000, [])
+    nt.eq_(len(fu.get_tokens_for_field(10000)), count)
+  nt.eq_(db, ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml", freeze=False))
+
+def test_frozen_concurrent_readers():
+  def read(db):
+    return [(u.get_id(), u.get_digest(),
+             [t.get_text() for t in u.get_tokens_for_field("main gloss")],
+             [len(list(u.get_interval_index(fid).overlapping(u.start, u.end)))
+              for fid in u.torder])
+            for p in db.get_participants() for u in p.get_utterances()]
+  expected = read(ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml"))
+  # the threads fill the lazy caches (digests, interval indices) together
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  results = []
+  def run():
+    results.append(read(db))
+  threads = [threading.Thread(target=run) for _ in range(8)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  nt.eq_(results, [expected] * 8)
+
 def test_missing_field_label():
   db = ss.SignStreamDatabase.read_xml("test/resources/ncslgr10a.ss3.xml")
   hm_jut = db.get_field(7)
@@ -207,6 +306,280 @@ def test_slice():
   nt.eq_(u.slice(60.0), slice(60, 121))
   nt.eq_(t.slice(60.0), slice(66, 85))
 
+class Span(object):
+  def __init__(self, start, end):
+    self.start = start
+    self.end = end
+
+  def get_timecodes(self):
+    return (self.start, self.end)
+
+def test_interval_index():
+  rnd = random.Random(42)
+  for n in (0, 1, 2, 7, 64, 200):
+    spans = []
+    for _ in range(n):
+      start = rnd.randint(0, 1000)
+      spans.append(Span(start, start + rnd.randint(1, 300)))
+    index = ss.IntervalIndex(spans)
+    nt.eq_(len(index), n)
+    for _ in range(50):
+      qs = rnd.randint(-50, 1300)
+      qe = qs + rnd.randint(1, 200)
+      expected = [t for t in spans if t.start < qe and qs < t.end]
+      expected.sort(key=lambda t: t.start)
+      nt.eq_(sorted(index.overlapping(qs, qe)), sorted(expected))
+      nt.eq_([t.start for t in index.overlapping(qs, qe)],
+             [t.start for t in expected])
+      nt.eq_(sorted(index.at(qs)),
+             sorted(t for t in spans if t.start <= qs < t.end))
+
+def test_coinciding_containment():
+  ssdb = ss.SignStreamDatabase()
+  ssdb._add_participant(1, 29, 'ASL', 'Ben', 'Benjamin Bahan', 'male')
+  ssdb._add_media(1, 'blabla')
+  ssdb._add_field(2, 'main gloss', 'main gloss', None)
+  ssdb._add_field(3, 'hm: nod', 'hm: nod', None)
+  ssdb._add_utterance(1, 1, 1000, 2000, [1])
+  ssdb._add_token(1, 1, 2, 100, 400, None, "TREE")
+  ssdb._add_token(1, 1, 3, 200, 300, None, "inside")
+  ssdb._add_token(1, 1, 3, 0, 900, None, "around")
+  ssdb._add_token(1, 1, 3, 400, 500, None, "after")
+  u = ssdb.get_participant(1).get_utterance(1)
+  tree = u.get_tokens_for_field(2)[0]
+  nt.eq_([t.get_text() for t in tree.get_coinciding_tokens("hm: nod")],
+         ["around", "inside"])
+  # the cached index is rebuilt when tokens are added
+  ssdb._add_token(1, 1, 3, 350, 450, None, "late")
+  nt.eq_([t.get_text() for t in tree.get_coinciding_tokens(3)],
+         ["around", "inside", "late"])
+  nt.eq_([t.get_text() for t in u.get_interval_index(3).at(1400)],
+         ["around", "late", "after"])
+  nt.assert_raises(KeyError, u.get_interval_index, 4)
+
+def test_join_tiers():
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  right = ["hp: tilt fr/bk", "hm: nod", "eye brows"]
+  rows = list(db.join_tiers("main gloss", right))
+  nt.assert_true(len(rows) > 0)
+  expected = []
+  for gloss in db.get_participant(0).get_tokens("main gloss"):
+    for field in right:
+      for other in gloss.get_coinciding_tokens(field):
+        overlap = min(gloss.end, other.end) - max(gloss.start, other.start)
+        expected.append((id(gloss), id(other), overlap))
+  nt.eq_(sorted((id(l), id(r), o) for (l, r, o) in rows), sorted(expected))
+  nt.assert_true(all(o > 0 for (_, _, o) in rows))
+  starts = [max(l.start, r.start) for (l, r, _) in rows if l.get_utterance() is rows[0][0].get_utterance()]
+  nt.eq_(starts, sorted(starts))
+  nt.assert_raises(ss.InvalidField, list, db.join_tiers("main gloss", ["asdf"]))
+
+def test_join_tokens():
+  left = [Span(0, 10), Span(10, 20), Span(5, 5)]
+  right = [Span(5, 15), Span(10, 11), Span(30, 40)]
+  rows = [(left.index(l), right.index(r), o) for (l, r, o) in ss.join_tokens(left, right)]
+  nt.eq_(rows, [(0, 0, 5), (1, 0, 5), (1, 1, 1)])
+
+def test_columnar():
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  cdb = ss.ColumnarSignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  nt.eq_(cdb, db)
+  nt.eq_(db, cdb)
+  u = list(db.get_participant(0).get_utterances())
+  cu = list(cdb.get_participant(0).get_utterances())
+  nt.assert_true(isinstance(cu[1], ss.ColumnarUtterance))
+  gloss = cu[1].get_tokens_for_field("main gloss")
+  nt.eq_(len(gloss), 9)
+  nt.eq_(gloss, list(u[1].get_tokens_for_field("main gloss")))
+  nt.eq_(gloss[-1], gloss[8])
+  nt.eq_(gloss[1:3], list(u[1].get_tokens_for_field("main gloss"))[1:3])
+  nt.assert_raises(IndexError, gloss.__getitem__, 9)
+  nt.eq_(gloss[0].get_text(), '5"that\'s the way it is"')
+  nt.assert_false(gloss[0].is_standard())
+  nt.eq_(gloss[1].get_text(), 'HOLD')
+  nt.eq_(gloss[1].get_field_value(), cdb.get_field("main gloss")[400000])
+  nt.eq_(gloss[1].get_timecodes(), (7200, 7800))
+  nt.eq_(gloss[1].get_utterance(), cu[1])
+  jut_tok = gloss[0].get_coinciding_tokens("hp: jut")
+  nt.eq_([t.get_text() for t in jut_tok], ["ONSET", "slightly back"])
+  nt.eq_(list(cdb.get_participant(0).get_tokens("main gloss")),
+         list(db.get_participant(0).get_tokens("main gloss")))
+
+def test_compact():
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  c1 = ss.CompactSignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  c2 = ss.CompactSignStreamDatabase.read_xml("test/resources/ali.ss3.xml")
+  nt.eq_(c1, db)
+  t1 = list(c1.get_participant(0).get_tokens("main gloss"))
+  ix = [t.get_text() for t in t1 if t.get_text() == "IX-1p"]
+  nt.assert_true(len(ix) > 1)
+  nt.assert_true(ix[0] is ix[1])
+  nt.assert_false(hasattr(t1[0], "__dict__"))
+  nt.assert_false(hasattr(c1.get_field("main gloss")[400000], "__dict__"))
+  # one pool per database, unless it is passed in
+  nt.assert_false(c1.string_pool is c2.string_pool)
+  shared = ss.StringPool()
+  s1 = sscache.restore(sscache.snapshot(c1),
+                       lambda: ss.CompactSignStreamDatabase(string_pool=shared))
+  s2 = sscache.restore(sscache.snapshot(c2),
+                       lambda: ss.CompactSignStreamDatabase(string_pool=shared))
+  nt.eq_(s1, c1)
+  nt.assert_true(s1.get_field("main gloss")[400000].get_name() is
+                 s2.get_field("main gloss")[400000].get_name())
+
+def test_default_classes():
+  # the default DOM objects are ordinary ones: they pickle with any
+  # protocol, and take extra attributes
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  field = db.get_field("main gloss")
+  token = list(db.get_participant(0).get_tokens("main gloss"))[0]
+  for x in (field, field[400000], token, token.get_utterance(), db.get_participant(0)):
+    pickle.dumps(x, 0)
+    x.note = 1
+  nt.eq_(pickle.loads(pickle.dumps(db, 0)), db)
+
+def test_token_adder():
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  for model_class in (ss.SignStreamDatabase, ss.ColumnarSignStreamDatabase,
+                      ss.CompactSignStreamDatabase):
+    # the same tokens, one _add_token call at a time
+    one_by_one = model_class()
+    for f in db.get_fields():
+      one_by_one._add_field(f.get_id(), f.get_name(), f.get_label(), f.constraint)
+      for v in f.get_values():
+        one_by_one._add_value(f.get_id(), v.get_id(), v.get_name(), v.get_label())
+    for m in db.get_media():
+      one_by_one._add_media(m.get_id(), m.path)
+    p = db.get_participant(0)
+    one_by_one._add_participant(p.get_id(), p.age, p.language, p.get_label(),
+                                p.get_name(), p.gender)
+    for u in p.get_utterances():
+      (ustart, uend) = u.get_timecodes()
+      one_by_one._add_utterance(u.get_id(), 0, ustart, uend,
+                                [m.get_id() for m in u.get_media()])
+      for tokens in u.get_tokens():
+        for t in tokens:
+          vid = t.get_field_value().get_id() if t.is_standard() else None
+          one_by_one._add_token(u.get_id(), 0, t.get_field().get_id(),
+                                t.start - ustart, t.end - ustart, vid, t.get_text())
+    nt.eq_(model_class.read_xml("test/resources/accident.ss3.xml"), one_by_one)
+    # an unknown value is rejected before anything is added
+    built = model_class.read_xml("test/resources/accident.ss3.xml", freeze=False)
+    add = built._token_adder(1, 0, 10000)
+    nt.assert_raises(KeyError, add, 0, 100, 12345, None)
+    nt.eq_(built, one_by_one)
+    add(0, 100, None, u"NEW")
+    nt.eq_(len(built.get_participant(0).get_utterance(1).get_tokens_for_field(10000)), 10)
+  # the parser only calls _token_adder, so overriding _add_token alone
+  # would be silently skipped
+  class Overriding(ss.SignStreamDatabase):
+    def _add_token(self, uid, pid, fid, start, end, vid, text):
+      pass
+  nt.assert_raises(TypeError, Overriding)
+
+def test_string_pool():
+  pool = ss.StringPool()
+  a = u"".join([u"HO", u"LD"])
+  b = u"".join([u"H", u"OLD"])
+  nt.assert_false(a is b)
+  nt.assert_true(pool.intern(a) is pool.intern(b))
+  nt.eq_(pool.intern(None), None)
+  nt.eq_(len(pool), 1)
+
+def test_read_xml_fields():
+  full = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml",
+                                      fields=["main gloss", "hm: shake"])
+  nt.eq_(len(list(db.get_fields())), 36)
+  shake = db.get_field("hm: shake").get_id()
+  for (u, fu) in zip(db.get_participant(0).get_utterances(),
+                     full.get_participant(0).get_utterances()):
+    nt.eq_(u.get_timecodes(), fu.get_timecodes())
+    nt.assert_true(set(u.tokens.keys()) <= set([10000, shake]))
+    nt.eq_(u.tokens.get(10000), fu.tokens.get(10000))
+    nt.eq_(u.tokens.get(shake), fu.tokens.get(shake))
+  nt.eq_(list(db.get_participant(0).get_tokens("hp: jut", ignore_missing=True)), [])
+
+def test_iter_utterances():
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  expected = dict((u.get_id(), u) for u in db.get_participant(0).get_utterances())
+  streamed = list(ss.iter_utterances("test/resources/accident.ss3.xml"))
+  nt.eq_(len(streamed), len(expected))
+  for u in streamed:
+    nt.eq_(u, expected[u.get_id()])
+    nt.eq_(u.get_participant().get_name(), "Michael Eric Schlang")
+    # yielded utterances are detached from their participant
+    nt.assert_false(u.get_id() in u.get_participant().utterances)
+
+def test_iter_utterances_fields():
+  streamed = list(ss.iter_utterances(open("test/resources/accident.ss3.xml"),
+                                     fields=["main gloss", 5]))
+  nt.eq_(len(streamed), 72)
+  for u in streamed:
+    nt.assert_true(set(u.tokens.keys()) <= set([10000, 5]))
+  u1 = [u for u in streamed if u.get_id() == 1][0]
+  nt.eq_(len(list(u1.get_tokens_for_field("main gloss"))), 9)
+  nt.assert_raises(XMLException, list,
+                   ss.iter_utterances("test/resources/accident.ss3.xml",
+                                      fields=["no such field"]))
+
+def test_read_header():
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml")
+  header = ss.read_header(open("test/resources/accident.ss3.xml"))
+  nt.assert_true(header.frozen)
+  nt.eq_(header.fields, db.fields)
+  nt.eq_(header.media, db.media)
+  nt.eq_([p.get_id() for p in header.get_participants()],
+         [p.get_id() for p in db.get_participants()])
+  nt.eq_([list(p.get_utterances()) for p in header.get_participants()],
+         [[] for p in db.get_participants()])
+
+def test_parse_stats():
+  stats = xmlbase.ParseStats()
+  db = ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml", stats=stats)
+  nt.eq_(db, ss.SignStreamDatabase.read_xml("test/resources/accident.ss3.xml"))
+  tokens = sum(len(field_tokens) for u in db.get_participant(0).get_utterances()
+                                 for field_tokens in u.get_tokens())
+  nt.eq_(stats.elements["A"][0], tokens)
+  nt.eq_(stats.elements["UTTERANCE"][0], 72)
+  nt.eq_(stats.sections["_add_token"][0], tokens)
+  nt.eq_(stats.parses, 1)
+  nt.assert_true(stats.handler_seconds() <= stats.seconds)
+  nt.assert_true(stats.text_bytes() > 0)
+  nt.assert_true("_add_token" in stats.format())
+  # the timing wrappers do not outlive the parse
+  nt.assert_false("_add_token" in vars(db))
+  # a handler without stats keeps its plain SAX callbacks
+  handler = ss._SignStreamHandler(ss.SignStreamDatabase)
+  nt.assert_false("startElement" in vars(handler))
+  handler.enable_stats()
+  nt.assert_true("startElement" in vars(handler))
+
+def test_parse_stats_failure():
+  databases = []
+  class Recording(ss.SignStreamDatabase):
+    def __init__(self):
+      super(Recording, self).__init__()
+      databases.append(self)
+  # a failed parse does not leave the database instrumented
+  nt.assert_raises(xmlbase.ContentHandlerError, Recording.read_xml,
+                   "test/resources/bad_value.ss3.xml", stats=xmlbase.ParseStats())
+  nt.eq_(len(databases), 1)
+  nt.assert_false("_add_value" in databases[0].__dict__)
+
+def test_parse_stats_merge():
+  stats = xmlbase.ParseStats()
+  streamed = list(ss.iter_utterances("test/resources/accident.ss3.xml",
+                                     fields=["main gloss"], stats=stats))
+  nt.eq_(stats.sections["_detach_utterance"][0], len(streamed))
+  nt.eq_(stats.sections["_add_token"][0], sum(len(u.tokens[10000]) for u in streamed))
+  total = xmlbase.ParseStats()
+  total.merge(stats)
+  total.merge(stats)
+  nt.eq_(total.parses, 2)
+  nt.eq_(total.elements["A"][0], 2 * stats.elements["A"][0])
+  nt.eq_(total.sections["_add_token"][0], 2 * stats.sections["_add_token"][0])
+
   
 if __name__ == '__main__':
   nose.runmodule()
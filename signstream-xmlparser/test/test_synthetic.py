@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# $Id$
+
+#@PydevCodeAnalysisIgnore
+
+import StringIO
+
+import nose.tools as nt
+import nose
+import analysis.signstream as ss
+import analysis.signstream.synthetic as synthetic
+
+ACCIDENT = "test/resources/accident.ss3.xml"
+
+def generate(utterances, **kwargs):
+  f = StringIO.StringIO()
+  synthetic.write_database(f, utterances, **kwargs)
+  return f.getvalue()
+
+def test_generated_database():
+  text = generate(30, participants=3, tokens=(2, 6), tiers=2, hold_rate=0.5)
+  db = ss.SignStreamDatabase.read_xml(StringIO.StringIO(text))
+  nt.eq_([p.get_label() for p in db.get_participants()], ["P0", "P1", "P2"])
+  nt.eq_(sorted(f.get_label() for f in db.get_fields()),
+         ["main gloss", "tier 0", "tier 1"])
+  utterances = [u for p in db.get_participants() for u in p.get_utterances()]
+  nt.eq_(len(utterances), 30)
+  holds = 0
+  for u in utterances:
+    (ustart, uend) = u.get_timecodes()
+    tokens = list(u.get_tokens_for_field("main gloss"))
+    signs = [t for t in tokens if t.get_text() != "HOLD"]
+    nt.assert_true(2 <= len(signs) <= 6)
+    nt.assert_not_equal(tokens[0].get_text(), "HOLD")
+    holds += len(tokens) - len(signs)
+    for t in tokens:
+      (start, end) = t.get_timecodes()
+      nt.assert_true(ustart <= start < end <= uend)
+    # signs do not overlap once HOLDs are merged into them
+    for (a, b) in zip(signs, signs[1:]):
+      nt.assert_true(a.get_timecodes()[1] <= b.get_timecodes()[0])
+  nt.assert_true(holds > 0)
+
+def test_deterministic():
+  nt.eq_(generate(20, tiers=1, seed=3), generate(20, tiers=1, seed=3))
+  nt.assert_not_equal(generate(20, seed=3), generate(20, seed=4))
+
+def test_streamed_parse():
+  text = generate(50, participants=2, tiers=1)
+  streamed = list(ss.iter_utterances(StringIO.StringIO(text)))
+  nt.eq_(sorted(u.get_id() for u in streamed), range(50))
+
+def test_profile_from_databases():
+  db = ss.SignStreamDatabase.read_xml(ACCIDENT)
+  profile = synthetic.SyntheticProfile.from_databases([db])
+  glosses = set(t.get_text() for t in db.get_participant(0).get_tokens("main gloss"))
+  nt.assert_true(set(profile.glosses) <= glosses)
+  nt.eq_(len(profile.lengths), len([u for u in db.get_participant(0).get_utterances()
+                                    if u.tokens.get(10000)]))
+  nt.assert_true(0 <= profile.hold_rate < 1)
+  text = generate(10, profile=profile)
+  db = ss.SignStreamDatabase.read_xml(StringIO.StringIO(text))
+  for token in db.get_participant(0).get_tokens("main gloss"):
+    nt.assert_true(token.get_text() in glosses)
+  nt.assert_raises(ValueError, synthetic.SyntheticProfile.from_databases, [])
+
+
+if __name__ == '__main__':
+  nose.runmodule()
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import nose.tools as nt
+import nose
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import analyze
+
+CORPUS = sorted(glob.glob(os.path.join(ROOT, 'ncslgr-xml', '*.xml')))
+
+
+def setup_module():
+  global cachedir, saved_cachedir
+  # keep the parse cache out of the user's home directory
+  cachedir = tempfile.mkdtemp()
+  saved_cachedir = os.environ.get(analyze.sscache.CACHE_DIR_VARIABLE)
+  os.environ[analyze.sscache.CACHE_DIR_VARIABLE] = cachedir
+
+def teardown_module():
+  if saved_cachedir is None:
+    del os.environ[analyze.sscache.CACHE_DIR_VARIABLE]
+  else:
+    os.environ[analyze.sscache.CACHE_DIR_VARIABLE] = saved_cachedir
+  shutil.rmtree(cachedir)
+
+
+class Stub(object):
+  def __init__(self, gloss, start, end):
+    self.gloss = gloss
+    self.start = start
+    self.end = end
+
+
+def naive_process_gloss(cleaned):
+  """The Grosjean & Lane algorithm as stated in the paper: rescan every
+     adjacent pair, merge the leftmost shortest pause, repeat."""
+  working = list(cleaned)
+  while len(working) > 1:
+    min_pause_len = float('Infinity')
+    min_pause_pos = 0
+    for i in range(len(working) - 1):
+      pause_len = working[i + 1].start - working[i].end
+      if pause_len < min_pause_len:
+        min_pause_len = pause_len
+        min_pause_pos = i
+    merged = analyze.Node(working[min_pause_pos], working[min_pause_pos + 1])
+    working = working[:min_pause_pos] + [merged] + working[min_pause_pos + 2:]
+  return working[0]
+
+def shape(tree):
+  if isinstance(tree, analyze.Node):
+    return (tree.pause_length, shape(tree.left), shape(tree.right))
+  return (tree.gloss, tree.start, tree.end)
+
+def test_single_token():
+  t = Stub("A", 0, 10)
+  nt.assert_true(analyze.process_gloss([t]) is t)
+
+def test_leftmost_tie():
+  tokens = [Stub("A", 0, 10), Stub("B", 20, 30), Stub("C", 40, 50)]
+  tree = analyze.process_gloss(tokens)
+  nt.eq_(shape(tree), (10, (10, shape(tokens[0]), shape(tokens[1])), shape(tokens[2])))
+
+def test_merges_at_minimum():
+  tokens = [Stub("A", 0, 10), Stub("B", 15, 30), Stub("C", 90, 100),
+            Stub("D", 101, 110)]
+  tree = analyze.process_gloss(tokens)
+  nt.eq_(shape(tree), (60, (5, shape(tokens[0]), shape(tokens[1])),
+                           (1, shape(tokens[2]), shape(tokens[3]))))
+
+def check_corpus_file(path):
+  db = analyze.ss.SignStreamDatabase.read_xml(path)
+  for person in db.get_participants():
+    for utterance in person.get_utterances():
+      tokens = analyze.cleanup_utterance(utterance)
+      nt.eq_(shape(analyze.process_gloss(tokens)),
+             shape(naive_process_gloss(tokens)))
+
+def test_matches_naive_on_corpus():
+  for path in CORPUS:
+    yield check_corpus_file, path
+
+def old_str(tree):
+  # the original recursive rendering
+  if not isinstance(tree, analyze.Node):
+    return str(tree)
+  indent = lambda s: '\n'.join('  ' + line for line in s.split('\n'))
+  return "[{}\n{}\n{}]".format(tree.pause_length, indent(old_str(tree.left)),
+                               indent(old_str(tree.right)))
+
+def tree_shape(tree, node):
+  pair = tree.children(node)
+  if pair is None:
+    token = tree.tokens[node]
+    return (token.gloss, token.start, token.end)
+  return (tree.pause_length(node), tree_shape(tree, pair[0]),
+          tree_shape(tree, pair[1]))
+
+def test_pause_tree():
+  tokens = [Stub("A", 0, 10), Stub("B", 15, 30), Stub("C", 90, 100),
+            Stub("D", 101, 110)]
+  tree = analyze.PauseTree.from_tokens(tokens)
+  nt.eq_(len(tree), 7)
+  nt.eq_(tree.root(), 6)
+  nt.eq_(list(tree.preorder()), [6, 5, 0, 1, 4, 2, 3])
+  nt.eq_(tree.span(4), (90, 110))
+  nt.eq_([tree.depth(node) for node in range(7)], [2, 2, 2, 2, 1, 1, 0])
+  nt.eq_(tree.height(), 2)
+  nt.eq_(tree.height(4), 1)
+  nt.eq_(tree_shape(tree, tree.root()), shape(analyze.process_gloss(tokens)))
+  nt.eq_(str(tree), old_str(analyze.process_gloss(tokens)))
+
+def test_pause_tree_degenerate():
+  tree = analyze.PauseTree.from_tokens([])
+  nt.eq_(tree.root(), None)
+  nt.eq_(str(tree), "")
+  nt.eq_(list(tree.preorder()), [])
+  token = Stub("A", 0, 10)
+  tree = analyze.PauseTree.from_tokens([token])
+  nt.eq_(tree.height(), 0)
+  nt.eq_(str(tree), str(token))
+
+def test_pause_tree_deep():
+  # a chain deeper than the recursion limit: each pause is longer than
+  # the one before, so every merge extends the same constituent
+  tokens = []
+  time = 0
+  for i in range(5000):
+    tokens.append(Stub("A", time, time + 1))
+    time += i + 2
+  tree = analyze.PauseTree.from_tokens(tokens)
+  nt.eq_(tree.height(), 4999)
+  nt.eq_(tree.depth(0), 4999)
+  text = str(tree)
+  nt.eq_(text.count('\n'), 2 * 4999)
+  nt.eq_(str(tree.to_node()), text)
+
+def check_pause_tree_corpus_file(path):
+  db = analyze.ss.SignStreamDatabase.read_xml(path)
+  for person in db.get_participants():
+    for utterance in person.get_utterances():
+      tokens = analyze.cleanup_utterance(utterance)
+      node = analyze.process_gloss(tokens)
+      tree = analyze.PauseTree.from_tokens(tokens)
+      nt.eq_(tree_shape(tree, tree.root()), shape(node))
+      nt.eq_(str(tree), old_str(node))
+      nt.eq_(str(node), old_str(node))
+
+def test_pause_tree_on_corpus():
+  for path in CORPUS:
+    yield check_pause_tree_corpus_file, path
+
+def check_batch_corpus_file(path):
+  db = analyze.ss.SignStreamDatabase.read_xml(path)
+  utterances = [u for person in db.get_participants()
+                  for u in person.get_utterances()]
+  batch = analyze.PauseBatch(utterances)
+  nt.eq_(len(batch), len(utterances))
+  for (i, utterance) in enumerate(utterances):
+    tokens = analyze.cleanup_utterance(utterance)
+    pauses = [b.start - a.end for (a, b) in zip(tokens, tokens[1:])]
+    nt.eq_(batch.pause_vector(i).tolist(), pauses)
+    nt.eq_(shape(batch.tree(i)), shape(analyze.process_gloss(tokens)))
+
+def test_batch_matches_process_gloss():
+  if analyze.np is None:
+    raise nose.SkipTest("NumPy is not installed")
+  for path in CORPUS:
+    yield check_batch_corpus_file, path
+
+def test_batch_merge_order():
+  if analyze.np is None:
+    raise nose.SkipTest("NumPy is not installed")
+  # merge_order only needs the main gloss, so stub utterances will do
+  class Utterance(object):
+    def __init__(self, *tokens):
+      self.tokens = [SSToken(*t) for t in tokens]
+    def get_tokens_for_field(self, field):
+      return self.tokens
+  class SSToken(object):
+    def __init__(self, text, start, end):
+      (self.text, self.start, self.end) = (text, start, end)
+    def get_text(self):
+      return self.text
+    def get_timecodes(self):
+      return (self.start, self.end)
+  batch = analyze.PauseBatch([
+    Utterance(("A", 0, 10), ("B", 20, 30), ("C", 40, 50)),
+    Utterance(),
+    Utterance(("A", 0, 10), ("HOLD", 10, 15), ("B", 20, 30), ("C", 31, 40)),
+    Utterance(("A", 0, 10)),
+    Utterance(("HOLD", 0, 5), ("HOLD", 5, 8), ("A", 10, 20), ("B", 30, 40))])
+  nt.eq_([batch.merge_order(i).tolist() for i in range(len(batch))],
+         [[0, 1], [], [1, 0], [], [0, 1]])
+  nt.eq_(batch.pause_vector(2).tolist(), [5, 1])
+  nt.eq_(batch.tree(1), None)
+  # a leading HOLD stays a token of its own on both paths
+  nt.eq_(batch.pause_vector(4).tolist(), [2, 10])
+  nt.eq_([t.gloss for t in analyze.cleanup_utterance(batch.utterances[4])],
+         ["HOLD/HOLD3", "A", "B"])
+  for i in range(len(batch)):
+    if batch.lengths[i]:
+      nt.eq_(shape(batch.tree(i)),
+             shape(analyze.process_gloss(analyze.cleanup_utterance(batch.utterances[i]))))
+
+def test_jsonl_records():
+  path = CORPUS[0]
+  lines = analyze.analyze_file(path, output_format='jsonl').splitlines()
+  db = analyze.ss.SignStreamDatabase.read_xml(path)
+  nt.eq_(len(lines), sum(len(list(p.get_utterances())) for p in db.get_participants()))
+  for line in lines:
+    record = json.loads(line)
+    nt.eq_(record['file'], path)
+    nt.eq_(len(record['pauses']), len(record['glosses']) - 1)
+    nt.eq_(record['pauses'], [b - a for (a, b) in zip(record['ends'], record['starts'][1:])])
+    # every token appears exactly once in the tree
+    leaves = []
+    stack = [record['tree']]
+    while stack:
+      node = stack.pop()
+      if isinstance(node, list):
+        stack.extend(node[1:])
+      else:
+        leaves.append(node)
+    nt.eq_(sorted(leaves), range(len(record['glosses'])))
+
+def test_analyze_files_order():
+  paths = CORPUS[:4]
+  serial = list(analyze.analyze_files(paths, output_format='jsonl', jobs=1))
+  parallel = list(analyze.analyze_files(paths, output_format='jsonl', jobs=2))
+  nt.eq_(serial, parallel)
+  nt.eq_([output for (output, _) in serial],
+         [analyze.analyze_file(path, output_format='jsonl') for path in paths])
+
+def test_analyze_files_error():
+  results = list(analyze.analyze_files([os.path.join(ROOT, 'missing.xml'), CORPUS[0]], jobs=1))
+  nt.eq_(results[0][0], '')
+  nt.assert_true('missing.xml' in results[0][1])
+  nt.eq_(results[1], (analyze.analyze_file(CORPUS[0]), None))
+
+def test_pause_distribution():
+  rng = random.Random(7)
+  pauses = [rng.randint(-50, 3000) for _ in range(2000)] + [0] * 5
+  whole = analyze.PauseDistribution()
+  parts = [analyze.PauseDistribution() for _ in range(3)]
+  for (i, pause) in enumerate(pauses):
+    whole.add(pause)
+    parts[i % 3].add(pause)
+  merged = analyze.PauseDistribution()
+  for part in reversed(parts):
+    merged.merge(part)
+  nt.eq_(merged.summary(), whole.summary())
+  nt.eq_(whole.count, len(pauses))
+  nt.eq_((whole.min, whole.max), (min(pauses), max(pauses)))
+  mean = float(sum(pauses)) / len(pauses)
+  nt.assert_almost_equal(whole.mean(), mean)
+  nt.assert_almost_equal(whole.variance(),
+                         sum((p - mean) ** 2 for p in pauses) / (len(pauses) - 1), places=4)
+  nt.eq_(sum(whole.histogram), len(pauses))
+  ordered = sorted(pauses)
+  for q in analyze.QUANTILES:
+    exact = ordered[int(q * (len(ordered) - 1))]
+    nt.assert_true(abs(whole.quantile(q) - exact) <= abs(exact) * analyze.SKETCH_ACCURACY + 1e-9)
+  empty = analyze.PauseDistribution()
+  nt.eq_((empty.mean(), empty.variance(), empty.quantile(0.5)), (None, None, None))
+
+def test_pause_context():
+  left = Stub('A', 0, 100)
+  right = Stub('B', 200, 300)
+  nt.eq_(analyze.pause_context([], left, right), 'outside')
+  nt.eq_(analyze.pause_context([(0, 300)], left, right), 'inside')
+  nt.eq_(analyze.pause_context([(0, 100)], left, right), 'edge')
+  nt.eq_(analyze.pause_context([(0, 120), (200, 300)], left, right), 'edge')
+  nt.eq_(analyze.pause_context([(300, 400)], left, right), 'outside')
+
+def test_pause_stats():
+  paths = CORPUS[:4]
+  serial, errors = analyze.pause_stats_files(paths, jobs=1)
+  nt.eq_(errors, [])
+  parallel, _ = analyze.pause_stats_files(paths, jobs=2)
+  nt.eq_(parallel.summary(), serial.summary())
+  summary = serial.summary()
+  count = 0
+  for path in paths:
+    for utterance in analyze.ss.iter_utterances(path, fields=['main gloss']):
+      try:
+        count += len(analyze.cleanup_utterance(utterance)) - 1
+      except KeyError:
+        pass
+  nt.eq_(summary['all']['count'], count)
+  for group in ('participant', 'story', 'before', 'after', 'topic/focus'):
+    nt.eq_(sum(value['count'] for value in summary[group].values()), count)
+  nt.eq_(sorted(summary['story']),
+         sorted(os.path.splitext(os.path.basename(path))[0] for path in paths))
+  nt.assert_false(any('/HOLD' in gloss for gloss in summary['before']))
+  json.dumps(summary)
+  _, errors = analyze.pause_stats_files([os.path.join(ROOT, 'missing.xml')], jobs=1)
+  nt.eq_(len(errors), 1)
+
+def setup_tempdir():
+  global tempdir
+  tempdir = tempfile.mkdtemp()
+
+def teardown_tempdir():
+  shutil.rmtree(tempdir)
+
+@nt.with_setup(setup_tempdir, teardown_tempdir)
+def test_result_store():
+  path = os.path.join(tempdir, 'ncslgr10a.xml')
+  shutil.copy(os.path.join(ROOT, 'ncslgr-xml', 'ncslgr10a.xml'), path)
+  store = analyze.ResultStore(os.path.join(tempdir, 'results.sqlite'))
+  for output_format in ('brackets', 'jsonl'):
+    expected = analyze.analyze_file(path, output_format=output_format)
+    nt.eq_(analyze.analyze_file(path, output_format=output_format, store=store), expected)
+  # the second format found every utterance analyzed by the first
+  n = store.misses
+  nt.eq_(store.hits, n)
+  # an unchanged file is not read again
+  analyze.analyze_file(path, output_format='jsonl', store=store)
+  nt.eq_((store.hits, store.misses), (n, n))
+
+  # edit one gloss: only that utterance is analyzed again
+  with open(path, 'rb') as f:
+    text = f.read()
+  with open(path, 'wb') as f:
+    f.write(text.replace('>MOTHER</A>', '>FATHER</A>', 1))
+  output = analyze.analyze_file(path, output_format='jsonl', store=store)
+  nt.eq_((store.hits, store.misses), (2 * n - 1, n + 1))
+  nt.eq_(output, analyze.analyze_file(path, output_format='jsonl'))
+  nt.assert_true('FATHER' in output)
+  store.close()
+
+
+if __name__ == '__main__':
+  nose.runmodule()
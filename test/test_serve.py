@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import httplib
+import json
+import os
+import shutil
+import socket
+import StringIO
+import sys
+import tempfile
+import threading
+
+import nose.tools as nt
+import nose
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import analyze
+import serve
+import analysis.signstream as ss
+
+CORPUS_DIR = os.path.join(ROOT, 'ncslgr-xml')
+
+
+def setup_server():
+  global tempdir, corpus, server, saved_cachedir
+  tempdir = tempfile.mkdtemp()
+  for name in ('ncslgr10a.xml', 'accident.xml'):
+    shutil.copy(os.path.join(CORPUS_DIR, name), tempdir)
+  # no parse cache, so that edited files are read again for certain
+  saved_cachedir = os.environ.get(analyze.sscache.CACHE_DIR_VARIABLE)
+  os.environ[analyze.sscache.CACHE_DIR_VARIABLE] = ''
+  corpus = serve.WarmCorpus([tempdir])
+  server = serve.HTTPServer(('127.0.0.1', 0), corpus)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+
+def teardown_server():
+  server.shutdown()
+  server.server_close()
+  if saved_cachedir is None:
+    del os.environ[analyze.sscache.CACHE_DIR_VARIABLE]
+  else:
+    os.environ[analyze.sscache.CACHE_DIR_VARIABLE] = saved_cachedir
+  shutil.rmtree(tempdir)
+
+def get(path, connection=None):
+  if connection is None:
+    connection = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+  connection.request('GET', path)
+  response = connection.getresponse()
+  return (response.status, json.loads(response.read()))
+
+@nt.with_setup(setup_server, teardown_server)
+def test_queries():
+  (status, files) = get('/files')
+  nt.eq_(status, 200)
+  nt.eq_(sorted(os.path.basename(f['file']) for f in files['files']),
+         ['accident.xml', 'ncslgr10a.xml'])
+  path = os.path.join(tempdir, 'ncslgr10a.xml')
+  db = ss.SignStreamDatabase.read_xml(path)
+  utterance = list(db.get_participant(0).get_utterances())[3]
+  (status, trees) = get('/trees?file=ncslgr10a.xml&utterance={}'.format(utterance.get_id()))
+  nt.eq_(status, 200)
+  nt.eq_(len(trees['utterances']), 1)
+  expected = analyze.analyze_utterance(utterance)
+  for name in expected:
+    nt.eq_(trees['utterances'][0][name], expected[name])
+  (_, glosses) = get('/glosses?file=' + path)
+  nt.eq_([t['text'] for t in glosses['tokens']],
+         [t.get_text() for p in db.get_participants() for t in p.get_tokens('main gloss')])
+  (_, media) = get('/media?file=ncslgr10a.xml')
+  nt.eq_(len(media['utterances']), len(list(db.get_participant(0).get_utterances())))
+  (_, cooccur) = get('/cooccur?field=main+gloss&with=hm%3A+shake&file=ncslgr10a.xml')
+  rows = list(db.join_tiers('main gloss', ['hm: shake']))
+  nt.eq_([(r[2], r[7]) for r in cooccur['rows']],
+         [(left.get_text(), overlap) for (left, _, overlap) in rows])
+  (_, both) = get('/cooccur?field=main+gloss&with=hm%3A+shake&text=NOT')
+  nt.assert_true(all(r[2] == 'NOT' for r in both['rows']))
+  nt.eq_(get('/trees?file=missing.xml')[0], 404)
+  nt.eq_(get('/trees')[0], 400)
+  nt.eq_(get('/media?file=accident.xml&utterance=x')[0], 400)
+  nt.eq_(get('/nothing')[0], 404)
+
+@nt.with_setup(setup_server, teardown_server)
+def test_bad_requests():
+  connection = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+  nt.eq_(get('/glosses?file=%FF', connection)[0], 400)
+  (status, error) = get('/trees?file=%C3%A9', connection)
+  nt.eq_(status, 404)
+  nt.eq_(error['error'], u'no such file: \xe9')
+  nt.eq_(get('/%FF', connection)[0], 404)
+  def broken(corpus, query):
+    raise ValueError('broken')
+  serve.QUERIES['/broken'] = broken
+  stderr = sys.stderr
+  sys.stderr = StringIO.StringIO()
+  try:
+    nt.eq_(get('/broken', connection)[0], 500)
+    nt.assert_true('ValueError: broken' in sys.stderr.getvalue())
+  finally:
+    sys.stderr = stderr
+    del serve.QUERIES['/broken']
+  # the connection is still open
+  nt.eq_(get('/status', connection)[0], 200)
+
+@nt.with_setup(setup_server, teardown_server)
+def test_reload():
+  path = os.path.join(tempdir, 'ncslgr10a.xml')
+  (_, before) = get('/glosses?file=ncslgr10a.xml')
+  nt.assert_false(any(t['text'] == 'MOTHER-EDITED' for t in before['tokens']))
+  with open(path, 'rb') as f:
+    text = f.read()
+  with open(path, 'wb') as f:
+    f.write(text.replace('>MOTHER</A>', '>MOTHER-EDITED</A>', 1))
+  os.utime(path, (0, 0))
+  nt.eq_(corpus.refresh(), ([os.path.abspath(path)], []))
+  nt.eq_(corpus.refresh(), ([], []))
+  (_, after) = get('/glosses?file=ncslgr10a.xml')
+  nt.assert_true(any(t['text'] == 'MOTHER-EDITED' for t in after['tokens']))
+  os.remove(os.path.join(tempdir, 'accident.xml'))
+  nt.eq_(corpus.refresh(), ([], [os.path.abspath(os.path.join(tempdir, 'accident.xml'))]))
+  nt.eq_(get('/media?file=accident.xml')[0], 404)
+  nt.eq_(get('/status')[1]['files'], 1)
+
+@nt.with_setup(setup_server, teardown_server)
+def test_join_cache():
+  loaded = corpus.files[os.path.abspath(os.path.join(tempdir, 'ncslgr10a.xml'))]
+  saved = serve.MAX_JOINS
+  serve.MAX_JOINS = 2
+  try:
+    first = loaded.join_tiers('main gloss', ['hm: shake'])
+    nt.assert_true(loaded.join_tiers('main gloss', ['hm: shake']) is first)
+    loaded.join_tiers('main gloss', ['eye brows'])
+    # the first join is now the most recently used, so this drops the second
+    loaded.join_tiers('main gloss', ['hm: shake'])
+    loaded.join_tiers('hm: shake', ['main gloss'])
+    nt.eq_(list(loaded._joins),
+           [('main gloss', ('hm: shake',)), ('hm: shake', ('main gloss',))])
+    nt.assert_true(loaded.join_tiers('main gloss', ['hm: shake']) is first)
+  finally:
+    serve.MAX_JOINS = saved
+
+@nt.with_setup(setup_server, teardown_server)
+def test_concurrent_clients():
+  results = []
+  def client():
+    connection = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+    for _ in range(20):
+      results.append(get('/trees?file=accident.xml&utterance=41', connection))
+  threads = [threading.Thread(target=client) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  nt.eq_(len(results), 80)
+  nt.eq_(len(set(json.dumps(r) for r in results)), 1)
+  nt.eq_(results[0][0], 200)
+
+@nt.with_setup(setup_server, teardown_server)
+def test_unix_socket():
+  path = os.path.join(tempdir, 'serve.sock')
+  unix_server = serve.UnixHTTPServer(path, corpus)
+  thread = threading.Thread(target=unix_server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  try:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    client.sendall('GET /status HTTP/1.0\r\n\r\n')
+    response = ''
+    while True:
+      data = client.recv(4096)
+      if not data:
+        break
+      response += data
+    client.close()
+    nt.eq_(response.split(' ', 2)[1], '200')
+    nt.eq_(json.loads(response.split('\r\n\r\n', 1)[1])['files'], 2)
+  finally:
+    unix_server.shutdown()
+    unix_server.server_close()
+
+
+if __name__ == '__main__':
+  nose.runmodule()